@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the generation of the entrypoint script, `EntrypointScriptBuilder(env).build()`, over synthetic
+scenarios: number of value overrides, number of Helm repo contexts (with the Codefresh API served by
+tests/LocalCodefreshServer.py) and size of the chart given as CHART_JSON or CHART_JSON_GZIP.
+
+The time (median of the runs) and the peak memory allocated by Python (tracemalloc, measured in a separate run) are
+reported for every scenario. Results can be saved as a baseline and later runs compared against it, failing when a
+scenario got slower or bigger than the baseline by more than the threshold.
+
+Usage: python3 benchmarks/build_entrypoint_script.py [--repeat N] [--filter SUBSTRING] [--latency MS]
+                                                      [--save FILE] [--baseline FILE] [--threshold FRACTION]
+"""
+import argparse
+import base64
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from unittest.mock import patch
+
+root_dir_name = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(root_dir_name)
+sys.path.append(os.path.join(root_dir_name, 'tests'))
+import lib.EntrypointScriptBuilder
+from lib.EntrypointScriptBuilder import EntrypointScriptBuilder
+from LocalCodefreshServer import LocalCodefreshServer
+
+KB = 1024
+MB = 1024 * KB
+TEMPLATE_SIZE = 8 * KB
+
+BASE_ENV = {
+    'ACTION': 'install',
+    'KUBE_CONTEXT': 'local',
+    'CHART_NAME': 'tomcat',
+    'RELEASE_NAME': 'tomcat',
+    'NAMESPACE': 'default',
+    'HELM_VERSION': '3.9.0',
+    'CHART_REPO_URL': 'https://charts.example.com/',
+}
+
+
+def overrides_env(count):
+    env = dict(BASE_ENV)
+    env.update(('CUSTOM_service%d_image_tag' % i, '1.0.%d' % i) for i in range(count))
+    return env
+
+
+def repo_contexts_env(count):
+    env = dict(BASE_ENV)
+    env['HELM_REPOSITORY_CONTEXT'] = 'primary'
+    for i in range(count):
+        # Every other context is an Azure Helm repo, whose token is obtained from the API
+        if i % 2:
+            env['CF_CTX_repo%d_URL' % i] = 'az://repo%d' % i
+        else:
+            env['CF_CTX_repo%d_URL' % i] = 'https://repo%d.example.com/' % i
+    return env
+
+
+def chart_json(size):
+    items = [{'name': 'Chart.yaml', 'data': 'apiVersion: v2\nname: tomcat\nversion: 1.0.0\n'},
+             {'name': 'values', 'data': 'replicaCount: 1\n'}]
+    line = 'metadata: {name: "{{ .Release.Name }}", labels: {app: tomcat}}\n'
+    template = line * (TEMPLATE_SIZE // len(line))
+    for i in range(max(size // TEMPLATE_SIZE, 1)):
+        items.append({'name': 'templates/resource%d.yaml' % i, 'data': template})
+    return json.dumps(items)
+
+
+def chart_env(size, compressed):
+    env = dict(BASE_ENV)
+    payload = chart_json(size)
+    if compressed:
+        env['CHART_JSON_GZIP'] = base64.b64encode(gzip.compress(payload.encode())).decode()
+    else:
+        env['CHART_JSON'] = payload
+    return env
+
+
+def scenarios():
+    """
+    Return (name, function returning the environment of the scenario) pairs, the environments are built lazily.
+    """
+    result = []
+    for count in [1, 100, 10000]:
+        result.append(('overrides-%d' % count, lambda count=count: overrides_env(count)))
+    for count in [1, 50]:
+        result.append(('repo-contexts-%d' % count, lambda count=count: repo_contexts_env(count)))
+    for size, label in [(10 * KB, '10KB'), (1 * MB, '1MB'), (10 * MB, '10MB'), (50 * MB, '50MB')]:
+        for compressed in [False, True]:
+            name = 'chart-json%s-%s' % ('-gzip' if compressed else '', label)
+            result.append((name, lambda size=size, compressed=compressed: chart_env(size, compressed)))
+    return result
+
+
+def run_once(env, chart_dir):
+    # Materialize the chart from scratch every time
+    shutil.rmtree(chart_dir, ignore_errors=True)
+    for path in [chart_dir + '.manifest.json']:
+        if os.path.exists(path):
+            os.remove(path)
+    EntrypointScriptBuilder(env).build()
+
+
+def measure(env, repeat, chart_dir):
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run_once(env, chart_dir)
+        durations.append(time.perf_counter() - started)
+    durations.sort()
+
+    tracemalloc.start()
+    try:
+        run_once(env, chart_dir)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'time': durations[len(durations) // 2], 'peak_memory': peak}
+
+
+def compare(results, baseline, threshold):
+    """
+    Return the description of every scenario of `results` slower or bigger than in `baseline` by more than
+    `threshold`.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        for metric in ['time', 'peak_memory']:
+            previous = baseline[name][metric]
+            if previous > 0 and result[metric] > previous * (1 + threshold):
+                regressions.append('%s: %s %.4g -> %.4g (+%.0f%%)' % (
+                    name, metric, previous, result[metric], (result[metric] / previous - 1) * 100))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the generation of the entrypoint script')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per scenario (default: 5)')
+    parser.add_argument('--filter', default='', help='only run the scenarios whose name contains this')
+    parser.add_argument('--latency', type=float, default=0, help='latency of the API server in ms (default: 0)')
+    parser.add_argument('--save', help='save the results as JSON to this file')
+    parser.add_argument('--baseline', help='compare the results with the ones saved in this file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='maximum slowdown or memory growth over the baseline, as a fraction (default: 0.2)')
+    args = parser.parse_args()
+
+    server = LocalCodefreshServer(api_key='api-key', latency=args.latency / 1000).start()
+    server.add_context('primary', 'https://primary.example.com/',
+                       {'HELMREPO_USERNAME': 'user', 'HELMREPO_PASSWORD': 'pass'})
+    api_env = {'CF_BUILD_URL': server.url, 'CF_API_KEY': 'api-key'}
+
+    tmp_dir = tempfile.mkdtemp(prefix='cfstep-helm-benchmark-')
+    chart_dir = os.path.join(tmp_dir, 'chart')
+    results = {}
+    devnull = open(os.devnull, 'w')
+    try:
+        print('%-24s %12s %12s' % ('SCENARIO', 'TIME (ms)', 'PEAK (KB)'))
+        for name, make_env in scenarios():
+            if args.filter not in name:
+                continue
+            env = make_env()
+            # The builder reports its progress on stdout and stderr
+            with patch.dict(os.environ, api_env), patch.object(lib.EntrypointScriptBuilder, 'CHART_DIR', chart_dir), \
+                    patch('sys.stdout', devnull), patch('sys.stderr', devnull):
+                results[name] = measure(env, args.repeat, chart_dir)
+            print('%-24s %12.2f %12.0f' % (name, results[name]['time'] * 1000, results[name]['peak_memory'] / KB))
+    finally:
+        devnull.close()
+        server.stop()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print('Regressions over %s (threshold %.0f%%):' % (args.baseline, args.threshold * 100))
+            for regression in regressions:
+                print('  ' + regression)
+            sys.exit(1)
+        print('No regression over %s (threshold %.0f%%)' % (args.baseline, args.threshold * 100))
+
+
+if __name__ == '__main__':
+    main()
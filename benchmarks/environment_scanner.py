@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the classification of the step environment: the single pass of EnvironmentScanner against the
+sorted sweeps per kind of variable it replaced, on environments of 10k variables.
+
+Usage: python3 benchmarks/environment_scanner.py [number of variables]
+"""
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from lib.EnvironmentScanner import EnvironmentScanner
+
+REPEAT = 5
+NUMBER = 20
+
+
+def make_env(size):
+    env = dict(('PIPELINE_VAR_%d' % i, 'value%d' % i) for i in range(size // 2))
+    env.update(('CUSTOM_service%d_image_tag' % i, '1.0.%d' % i) for i in range(size // 4))
+    env.update(('VALUESTRING_service%d_build..id' % i, '%08d' % i) for i in range(size // 8))
+    env.update(('VALUESFILE_%d' % i, 'values-%d.yaml' % i) for i in range(size // 16))
+    env.update(('CF_CTX_repo%d_URL' % i, 'https://repo%d.example.com' % i) for i in range(size // 16))
+    return env
+
+
+def sorted_sweeps(env):
+    custom_valuesfiles = []
+    for key, val in sorted(env.items()):
+        key_upper = key.upper()
+        if key_upper.startswith('CUSTOMFILE_') or key_upper.startswith('VALUESFILE_'):
+            custom_valuesfiles.append(val)
+
+    custom_values = {}
+    for key, val in sorted(env.items()):
+        key_upper = key.upper()
+        if key_upper.startswith('CUSTOM_'):
+            cli_set_key = key[7:]
+        elif key_upper.startswith('VALUE_'):
+            cli_set_key = key[6:]
+        else:
+            continue
+        custom_values[cli_set_key.replace('_', '.').replace('..', '_')] = val
+
+    string_values = {}
+    for key, val in sorted(env.items()):
+        if key.upper().startswith('VALUESTRING_'):
+            string_values[key[12:].replace('_', '.').replace('..', '_')] = val
+
+    context_repo_names = []
+    for key in sorted(env.keys()):
+        if key.startswith('CF_CTX_') and key.endswith('_URL'):
+            context_repo_names.append(key[7:len(key) - 4])
+    return custom_valuesfiles, custom_values, string_values, context_repo_names
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    env = make_env(size)
+
+    scanner = EnvironmentScanner(env)
+    expected = sorted_sweeps(env)
+    assert (scanner.valuesfiles, scanner.values, scanner.string_values, scanner.context_repo_names) == expected
+
+    print('Environment of %d variables, best of %d x %d runs' % (len(env), REPEAT, NUMBER))
+    for name, function in [('sorted sweeps', sorted_sweeps), ('EnvironmentScanner', EnvironmentScanner)]:
+        best = min(timeit.repeat(lambda: function(env), repeat=REPEAT, number=NUMBER)) / NUMBER
+        print('  %-20s %8.2f ms' % (name, best * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import base64
+import hashlib
+import json
+import os
+import time
+
+# Tokens are considered expired this many seconds before their actual expiry
+EXPIRY_MARGIN = 60
+
+
+class AzureTokenCache(object):
+    """
+    Cache of Azure Helm repo tokens keyed by (scheme, service, tenant, client id).
+
+    Tokens are kept until their expiry, read from the "exp" claim of JWT tokens or otherwise assumed to be
+    `default_ttl` seconds after they were obtained. When `path` is set, the cache is shared through a file only
+    readable by the current user, so that later steps of the same build can reuse the tokens.
+    """
+
+    def __init__(self, path=None, default_ttl=600):
+        self.path = path
+        self.default_ttl = default_ttl
+        self._tokens = self._load()
+
+    @staticmethod
+    def key(scheme, service, tenant=None, client_id=None):
+        return hashlib.sha256('|'.join([scheme, service, tenant or '', client_id or '']).encode()).hexdigest()
+
+    def get(self, key):
+        entry = self._tokens.get(key)
+        if entry is None or entry['expires_at'] - EXPIRY_MARGIN <= time.time():
+            return None
+        return entry['token']
+
+    def put(self, key, token):
+        self._tokens[key] = {'token': token, 'expires_at': self._expiry(token)}
+        if self.path is not None:
+            # Merge with the tokens other steps may have stored in the meantime
+            tokens = self._load()
+            tokens[key] = self._tokens[key]
+            self._save(tokens)
+
+    def _expiry(self, token):
+        try:
+            payload = token.split('.')[1]
+            payload += '=' * (-len(payload) % 4)
+            return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+        except (IndexError, KeyError, TypeError, ValueError):
+            return time.time() + self.default_ttl
+
+    def _load(self):
+        if self.path is None:
+            return {}
+        try:
+            with open(self.path) as tokens_file:
+                return json.load(tokens_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, tokens):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as tokens_file:
+            json.dump(tokens, tokens_file)
+        os.replace(tmp_path, self.path)
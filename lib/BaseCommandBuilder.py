@@ -1,4 +1,10 @@
 import re
+import shlex
+
+from string import Template
+
+from lib.Command import ShellScript
+
 REPO_DIR_RE = re.compile('^(.\/|\.\.\/).*')
 
 
@@ -11,7 +17,7 @@ class BaseCommandBuilder:
         if google_application_credentials_json is not None:
             lines.append('echo -E $GOOGLE_APPLICATION_CREDENTIALS_JSON > /tmp/google-creds.json')
             lines.append('export GOOGLE_APPLICATION_CREDENTIALS=/tmp/google-creds.json')
-        return lines
+        return [ShellScript(lines)]
 
     @staticmethod
     def need_pull(ref, name, repo, version):
@@ -21,3 +27,33 @@ class BaseCommandBuilder:
             return False
 
         return not REPO_DIR_RE.match(ref)
+
+    @staticmethod
+    def _build_prune_history_command(kind, namespace, selector, version_label, status_label, deployed_status,
+                                     name_prefix, release_name, history_max, dry_run):
+        """
+        Return bash lines deleting the `kind` objects storing the revisions of a release in `namespace` (the one of
+        the kube context if None), all but the `history_max` most recent ones and the deployed one. How long listing
+        the revisions took is reported. With `dry_run`, the revisions are listed but only printed instead of deleted.
+        """
+        return ShellScript(Template('''
+TIMEFORMAT='Release storage lookup took %3Rs'
+time cf_release_revisions=$$(kubectl get $kind$namespace_args --selector $selector \\
+  --output jsonpath='{range .items[*]}{.metadata.labels.$version_label} {.metadata.labels.$status_label}{"\\n"}{end}')
+cf_release_revisions=$$(echo "$$cf_release_revisions" | sort -n)
+cf_release_revision_count=$$(echo "$$cf_release_revisions" | grep -c . || true)
+printf 'Release %s has %s revisions in storage, keeping the last %s\\n' $release_name "$$cf_release_revision_count" \\
+  $history_max
+cf_pruned_revisions=$$(echo "$$cf_release_revisions" | \\
+  awk -v keep=$history_max -v deployed=$deployed_status -v prefix=$name_prefix '
+  { version[NR] = $$1; status[NR] = $$2 }
+  END { for (i = 1; i <= NR - keep; i++) if (status[i] != deployed) print prefix version[i] }')
+if [ -n "$$cf_pruned_revisions" ]; then
+  ${echo}kubectl delete $kind$namespace_args $$cf_pruned_revisions
+else
+  echo "No revision to prune"
+fi''').substitute(kind=kind, namespace_args=' --namespace ' + shlex.quote(namespace) if namespace else '',
+                  selector=shlex.quote(selector), version_label=version_label, status_label=status_label,
+                  deployed_status=shlex.quote(deployed_status), name_prefix=shlex.quote(name_prefix),
+                  release_name=shlex.quote(release_name),
+                  history_max=int(history_max), echo='echo ' if dry_run else '').split('\n')[1:], network=True, idempotent=True)
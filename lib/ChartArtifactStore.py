@@ -0,0 +1,56 @@
+import hashlib
+import os
+
+from string import Template
+
+from lib.RepoIndexCache import RepoIndexCache
+
+CHARTS_DIR_NAME = 'charts'
+
+# Directory the pull command given to fetch_command() must download the chart archive to
+PULL_DIR = '"$cf_chart_tmp"'
+
+
+class ChartArtifactStore(object):
+    """
+    Store of packaged charts pulled from chart repos, keyed by the repo URL, chart name, version and the digest
+    published in the repo index, so a chart is downloaded and verified once and then reused by every install.
+    """
+
+    def __init__(self, cache_dir):
+        self.charts_dir = os.path.join(cache_dir, CHARTS_DIR_NAME)
+
+    @staticmethod
+    def key(repo_url, name, version, digest):
+        return hashlib.sha256('|'.join([RepoIndexCache.normalize_url(repo_url).rstrip('/'), name, version,
+                                        digest]).encode()).hexdigest()
+
+    def entry_dir(self, key):
+        return os.path.join(self.charts_dir, key)
+
+    def artifact_path(self, key, name, version):
+        return os.path.join(self.entry_dir(key), '{}-{}.tgz'.format(name, version))
+
+    def contains(self, key, name, version):
+        return os.path.isfile(self.artifact_path(key, name, version))
+
+    def fetch_command(self, key, name, version, digest, pull_command):
+        """
+        Return bash lines running `pull_command` (which must download the chart archive to PULL_DIR), checking the
+        archive against `digest` and storing it. The entry is moved in place only once complete, so a concurrent
+        reader never sees a partial archive. A failed or corrupted download is removed before failing.
+        """
+        return Template('''
+mkdir -p $charts_dir
+cf_chart_tmp=$$(mktemp -d $charts_dir/.$key.XXXXXX)
+if ! { $pull_command &&
+  cf_chart_file=$$(echo "$$cf_chart_tmp"/*.tgz) &&
+  echo "$digest  $$cf_chart_file" | sha256sum -c -; }; then
+  rm -rf "$$cf_chart_tmp"
+  exit 1
+fi
+mv "$$cf_chart_file" "$$cf_chart_tmp/$file_name"
+if [ -d $entry_dir ]; then rm -rf "$$cf_chart_tmp"; else mv "$$cf_chart_tmp" $entry_dir; fi''').substitute(
+            charts_dir=self.charts_dir, key=key, pull_command=pull_command.strip(), digest=digest,
+            file_name=os.path.basename(self.artifact_path(key, name, version)),
+            entry_dir=self.entry_dir(key)).split('\n')[1:]
@@ -0,0 +1,99 @@
+import os
+import re
+
+DEPENDENCY_FILES = ['Chart.yaml', 'requirements.yaml']
+LOCK_FILES = ['Chart.lock', 'requirements.lock']
+REPOSITORY_RE = re.compile(r'^\s*(?:-\s*)?repository:\s*(.*?)\s*$')
+DEPENDENCY_FIELD_RE = re.compile(r'^(\s*)(-\s+)?(\w[\w-]*):\s*(.*?)\s*$')
+
+
+class ChartDependencies:
+
+    @staticmethod
+    def repositories(chart_dir):
+        """
+        Return the repositories referenced by the dependencies declared in the Chart.yaml (apiVersion v2) or
+        requirements.yaml (apiVersion v1) of the chart in `chart_dir`.
+        """
+        repositories = []
+        for dependency_file in DEPENDENCY_FILES:
+            path = os.path.join(chart_dir, dependency_file)
+            if not os.path.isfile(path):
+                continue
+            with open(path) as f:
+                for line in f:
+                    match = REPOSITORY_RE.match(line)
+                    if match and match.group(1):
+                        repositories.append(match.group(1).strip('\'"'))
+        return repositories
+
+    @staticmethod
+    def locked_archives(chart_dir):
+        """
+        Return the names of the archives Helm downloads into the charts/ directory of the chart in `chart_dir` for
+        the dependencies pinned in its lock file, or None if the chart has no lock file.
+        """
+        for lock_file in LOCK_FILES:
+            path = os.path.join(chart_dir, lock_file)
+            if not os.path.isfile(path):
+                continue
+            dependencies = ChartDependencies._entries(path)
+            return ['%s-%s.tgz' % (dependency.get('name'), dependency.get('version')) for dependency in dependencies]
+        return None
+
+    @staticmethod
+    def declared(chart_dir):
+        """
+        Return the scalar fields (name, version, repository, ...) of the dependencies declared in the Chart.yaml or
+        requirements.yaml of the chart in `chart_dir`.
+        """
+        dependencies = []
+        for dependency_file in DEPENDENCY_FILES:
+            path = os.path.join(chart_dir, dependency_file)
+            if os.path.isfile(path):
+                dependencies += ChartDependencies._entries(path)
+        return dependencies
+
+    @staticmethod
+    def local_dependencies(chart_dir):
+        """
+        Return the normalized directories of the dependencies of the chart in `chart_dir` referenced with file://.
+        """
+        return [os.path.normpath(os.path.join(chart_dir, repository[len('file://'):]))
+                for repository in ChartDependencies.repositories(chart_dir) if repository.startswith('file://')]
+
+    @staticmethod
+    def references_repo(chart_dir, repo_name, repo_url):
+        """
+        Check whether dependency resolution of the chart in `chart_dir` needs the repo registered locally as
+        `repo_name` for `repo_url`, either by URL or through the "@name" / "alias:name" notation.
+        """
+        for repository in ChartDependencies.repositories(chart_dir):
+            if repository.rstrip('/') == repo_url.rstrip('/') or repository in ['@' + repo_name, 'alias:' + repo_name]:
+                return True
+        return False
+
+    @staticmethod
+    def _entries(path):
+        """
+        Return the scalar fields of the items of the top-level "dependencies" list of the YAML file at `path`. Fields
+        nested deeper in an item (tags, import-values, ...) are skipped.
+        """
+        dependencies = []
+        in_dependencies = False
+        item_column = field_column = None
+        with open(path) as f:
+            for line in f:
+                if line.strip() and not line[0].isspace() and not line.startswith('-'):
+                    in_dependencies = line.startswith('dependencies:')
+                    continue
+                match = DEPENDENCY_FIELD_RE.match(line) if in_dependencies else None
+                if match is None:
+                    continue
+                indent, dash, key, value = match.groups()
+                if dash and item_column in [None, len(indent)]:
+                    item_column, field_column = len(indent), len(indent) + len(dash)
+                    dependencies.append({})
+                if dependencies and len(indent) + len(dash or '') == field_column:
+                    dependencies[-1][key] = value.split(' #')[0].strip().strip('\'"')
+        return dependencies
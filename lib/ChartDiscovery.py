@@ -0,0 +1,60 @@
+import os
+
+from lib.ChartDependencies import ChartDependencies
+
+CHART_FILE = 'Chart.yaml'
+
+
+class ChartDiscovery:
+
+    @staticmethod
+    def discover(root):
+        """
+        Return the directories of the charts under `root`, sorted. The subcharts of a chart (in its charts/
+        directory) are packaged with it, so the directories of charts are not searched any further.
+        """
+        chart_dirs = []
+        for dir_path, dir_names, file_names in os.walk(root):
+            dir_names.sort()
+            if CHART_FILE in file_names:
+                chart_dirs.append(os.path.normpath(dir_path))
+                dir_names[:] = []
+        return sorted(chart_dirs)
+
+    @staticmethod
+    def metadata(chart_dir):
+        """
+        Return the top-level scalar fields of the Chart.yaml of the chart in `chart_dir` (name, version, ...).
+        """
+        with open(os.path.join(chart_dir, CHART_FILE)) as f:
+            return ChartDiscovery.parse_metadata(f)
+
+    @staticmethod
+    def parse_metadata(lines):
+        metadata = {}
+        for line in lines:
+            key, sep, value = line.partition(':')
+            if sep and not line[0].isspace() and not line.startswith('#'):
+                metadata[key.strip()] = value.split(' #')[0].strip().strip('\'"')
+        return metadata
+
+    @staticmethod
+    def levels(chart_dirs):
+        """
+        Order `chart_dirs` by their local (file://) dependencies: return lists of charts, every chart coming in a
+        list after the ones of all the charts it depends on. The charts of a list don't depend on each other.
+        """
+        remaining = dict((chart_dir, set(dependency for dependency in ChartDependencies.local_dependencies(chart_dir)
+                                         if dependency in chart_dirs))
+                         for chart_dir in chart_dirs)
+        levels = []
+        while remaining:
+            level = sorted(chart_dir for chart_dir, dependencies in remaining.items() if not dependencies)
+            if not level:
+                raise Exception('Circular file:// dependencies between the charts %s' % ', '.join(sorted(remaining)))
+            for chart_dir in level:
+                del remaining[chart_dir]
+            for dependencies in remaining.values():
+                dependencies.difference_update(level)
+            levels.append(level)
+        return levels
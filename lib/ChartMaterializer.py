@@ -0,0 +1,175 @@
+import base64
+import codecs
+import hashlib
+import json
+import os
+import sys
+import zlib
+
+CHUNK_SIZE = 256 * 1024
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+class ChartMaterializer(object):
+    """
+    Write the chart files described by CHART_JSON / CHART_JSON_GZIP (a JSON array of {"name": ..., "data": ...}
+    items) to a directory, decompressing and parsing the payload incrementally so that only one item at a time is
+    held in memory besides the environment variable itself.
+
+    A manifest of the content hash of every file is kept beside the chart directory, so files identical to the ones
+    written by a previous run are left untouched and files that are no longer part of the chart are removed.
+    """
+
+    def __init__(self, chart_dir):
+        self.chart_dir = chart_dir
+        self.manifest_path = chart_dir.rstrip('/') + '.manifest.json'
+        self.files = 0
+        self.bytes = 0
+        self.unchanged_files = 0
+        self.removed_files = 0
+        self.digest = None
+        self.previous_digest = None
+
+    @staticmethod
+    def iter_chart_json(env):
+        """
+        Return an iterator over the text chunks of the chart JSON found in `env`, or None if there is none.
+        """
+        if env.get('CHART_JSON') is not None:
+            return ChartMaterializer._iter_text(env.get('CHART_JSON'))
+
+        if env.get('CHART_JSON_GZIP') is not None:
+            return ChartMaterializer._iter_gzip_base64(env.get('CHART_JSON_GZIP'))
+
+        return None
+
+    @staticmethod
+    def _iter_text(text):
+        for offset in range(0, len(text), CHUNK_SIZE):
+            yield text[offset:offset + CHUNK_SIZE]
+
+    @staticmethod
+    def _iter_gzip_base64(encoded):
+        encoded = ''.join(encoded.split())
+        decompressor = zlib.decompressobj(15 + 32)
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        # Decode base64 in chunks that are a multiple of 4 characters so each one decodes on its own
+        step = CHUNK_SIZE - CHUNK_SIZE % 4
+        for offset in range(0, len(encoded), step):
+            data = decompressor.decompress(base64.b64decode(encoded[offset:offset + step]))
+            if data:
+                yield decoder.decode(data)
+        yield decoder.decode(decompressor.flush(), final=True)
+
+    @staticmethod
+    def iter_items(chunks):
+        """
+        Incrementally parse a JSON array from text `chunks`, yielding its items one by one.
+        """
+        decoder = json.JSONDecoder()
+        buffer = ''
+        pos = 0
+        started = False
+        exhausted = False
+
+        def more(size):
+            nonlocal buffer, pos, exhausted
+            buffer = buffer[pos:]
+            pos = 0
+            # Read at least as much as is already buffered, so a large item is retried a logarithmic number of times
+            target = len(buffer) + max(size, 1)
+            while len(buffer) < target:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                    break
+                buffer += chunk
+
+        chunks = iter(chunks)
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n' + (',' if started else ''):
+                pos += 1
+            if pos >= len(buffer):
+                if exhausted:
+                    raise ValueError('Unexpected end of chart JSON')
+                more(1)
+                continue
+
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError('Chart JSON must be an array of chart files')
+                started = True
+                pos += 1
+                continue
+
+            if buffer[pos] == ']':
+                return
+
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if exhausted:
+                    raise
+                more(len(buffer) - pos)
+                continue
+            pos = end
+            yield item
+
+    def materialize(self, chunks):
+        previous_manifest = self._load_manifest()
+        previous_files = previous_manifest.get('files', {})
+        self.previous_digest = previous_manifest.get('digest')
+
+        files = {}
+        created_dirs = set()
+        for item in ChartMaterializer.iter_items(chunks):
+            name = item['name']
+            if name == 'values':
+                name = 'values.yaml'
+            name = name.replace('Charts/', 'charts/')
+
+            sys.stderr.write(name + '\n')
+
+            path = '{}/{}'.format(self.chart_dir, name)
+            data = (item['data'] if 'data' in item.keys() else '').encode()
+            files[name] = hashlib.sha256(data).hexdigest()
+            if previous_files.get(name) == files[name] and os.path.isfile(path):
+                self.unchanged_files += 1
+                continue
+
+            directory = os.path.dirname(path)
+            if directory not in created_dirs:
+                os.makedirs(directory, exist_ok=True)
+                created_dirs.add(directory)
+
+            with open(path, 'wb', buffering=WRITE_BUFFER_SIZE) as file:
+                file.write(data)
+            self.files += 1
+            self.bytes += len(data)
+
+        for name in sorted(set(previous_files) - set(files)):
+            try:
+                os.remove('{}/{}'.format(self.chart_dir, name))
+                self.removed_files += 1
+            except FileNotFoundError:
+                pass
+
+        manifest_lines = ['{}\0{}\n'.format(name, digest) for name, digest in sorted(files.items())]
+        self.digest = hashlib.sha256(''.join(manifest_lines).encode()).hexdigest()
+        self._save_manifest({'digest': self.digest, 'files': files})
+
+        sys.stderr.write('Materialized {} files ({} bytes) in {}, {} unchanged, {} removed\n'.format(
+            self.files, self.bytes, self.chart_dir, self.unchanged_files, self.removed_files))
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path) as manifest_file:
+                return json.load(manifest_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self, manifest):
+        tmp_path = '%s.%d.tmp' % (self.manifest_path, os.getpid())
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(tmp_path, self.manifest_path)
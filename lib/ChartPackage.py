@@ -0,0 +1,53 @@
+import hashlib
+import io
+import tarfile
+
+from string import Template
+
+from lib.ChartDiscovery import ChartDiscovery, CHART_FILE
+
+CHUNK_SIZE = 64 * 1024
+# Output of check_chart_published
+PUBLISHED = 'published'
+NEW = 'new'
+
+
+class ChartPackage(object):
+    """
+    Packaged chart (.tgz archive), as written by "helm package".
+    """
+
+    @staticmethod
+    def metadata(path):
+        """
+        Return the top-level scalar fields of the Chart.yaml of the chart packaged at `path` (name, version, ...).
+        """
+        with tarfile.open(path, 'r:gz') as tar:
+            for member in tar:
+                if member.isfile() and member.name.count('/') == 1 and member.name.endswith('/' + CHART_FILE):
+                    return ChartDiscovery.parse_metadata(io.TextIOWrapper(tar.extractfile(member)))
+        raise Exception('No %s in the chart package %s' % (CHART_FILE, path))
+
+    @staticmethod
+    def digest(path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            chunk = f.read(CHUNK_SIZE)
+            while chunk:
+                digest.update(chunk)
+                chunk = f.read(CHUNK_SIZE)
+        return digest.hexdigest()
+
+    @staticmethod
+    def push_unless_published_command(check_command, push_command):
+        """
+        Return bash lines running `push_command` unless `check_command` (check_chart_published) reports the package
+        at $PACKAGE as already published. The lines fail if another package was published with the same version.
+        """
+        return Template('''
+cf_chart_status=$$($check_command)
+if [ "$$cf_chart_status" = "$published" ]; then
+  echo "$$(basename "$$PACKAGE") is already published"
+else
+  $push_command
+fi''').substitute(check_command=check_command, push_command=push_command, published=PUBLISHED).split('\n')[1:]
@@ -0,0 +1,332 @@
+import functools
+import gzip
+import hashlib
+import io
+import os
+import re
+import shutil
+import stat
+import tarfile
+
+from lib.ChartDependencies import ChartDependencies
+from lib.ChartDiscovery import ChartDiscovery, CHART_FILE
+from lib.ChartPackage import ChartPackage
+
+PACKAGES_DIR_NAME = 'packages'
+HELMIGNORE_FILE = '.helmignore'
+SUBCHARTS_DIR_NAME = 'charts'
+# Like Helm, hidden files of the templates directory are never packaged. Helm adds this rule after the .helmignore ones
+DEFAULT_IGNORE_RULES = [(False, False, 'templates/.?*')]
+CHART_TYPES = ['application', 'library']
+# Versions accepted by Helm (github.com/Masterminds/semver)
+VERSION_RE = re.compile(r'^v?[0-9]+(\.[0-9]+)?(\.[0-9]+)?'
+                        r'(-[0-9A-Za-z-]+(\.[0-9A-Za-z-]+)*)?(\+[0-9A-Za-z-]+(\.[0-9A-Za-z-]+)*)?$')
+# Bumped whenever the archives written change, so that packages cached by an older packager are not reused
+FORMAT_VERSION = '2'
+
+
+class ChartPackager(object):
+    """
+    Package chart directories as byte-reproducible archives, in place of "helm package": the entries are sorted and
+    written with a fixed modification time (SOURCE_DATE_EPOCH, else 0), owner and mode, and the gzip header has no
+    timestamp, so the same chart always gives the same archive and digest.
+
+    "helm dependency build" packages the file:// dependencies of a chart into its charts/ directory with the current
+    time, so those archives are packaged again here from the dependency directories, the same way as the chart.
+
+    With a `cache_dir`, packages are kept keyed by the digest of the files of the chart and the overridden versions,
+    so an unchanged chart is not packaged again.
+    """
+
+    def __init__(self, cache_dir=None, mtime=0):
+        self.packages_dir = os.path.join(cache_dir, PACKAGES_DIR_NAME) if cache_dir is not None else None
+        self.mtime = mtime
+        self.hit = None
+
+    def package(self, chart_dir, destination, version=None, app_version=None):
+        """
+        Package the chart in `chart_dir` to `destination`, optionally overriding its version and app version like
+        "helm package --version / --app-version" do. Returns the path of the package and its SHA-256 digest.
+        """
+        files, metadata, contents = self._load(chart_dir, version, app_version)
+        self.check_dependencies(chart_dir, files)
+        file_name = '%s-%s.tgz' % (metadata['name'], metadata['version'])
+        path = os.path.join(destination, file_name)
+        os.makedirs(destination, exist_ok=True)
+
+        cached_path = None
+        if self.packages_dir is not None:
+            cached_path = os.path.join(self.packages_dir, self.key(contents), file_name)
+            self.hit = os.path.isfile(cached_path)
+            if self.hit:
+                shutil.copyfile(cached_path, path)
+                return path, ChartPackage.digest(path)
+
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            self._write(contents, metadata['name'], f)
+        os.replace(tmp_path, path)
+        if cached_path is not None:
+            # Populate the cache atomically, so a concurrent reader never sees a partial package
+            os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+            tmp_path = '%s.%d.tmp' % (cached_path, os.getpid())
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, cached_path)
+        return path, ChartPackage.digest(path)
+
+    def key(self, contents):
+        digest = hashlib.sha256(('%s|%d\n' % (FORMAT_VERSION, self.mtime)).encode())
+        for rel_path, mode, data in contents:
+            digest.update(('%s %o\n' % (rel_path, mode)).encode())
+            digest.update(hashlib.sha256(data).digest())
+        return digest.hexdigest()
+
+    @staticmethod
+    def validate(chart_dir, metadata):
+        """
+        Check the Chart.yaml fields of the chart in `chart_dir` the way the Helm chart loader does.
+        """
+        if not metadata.get('name'):
+            raise Exception('The %s of %s has no name' % (CHART_FILE, chart_dir))
+        if not metadata.get('version'):
+            raise Exception('The %s of %s has no version' % (CHART_FILE, chart_dir))
+        if not VERSION_RE.match(metadata['version']):
+            raise Exception('The version "%s" of the chart %s is not a valid SemVer version'
+                            % (metadata['version'], chart_dir))
+        if metadata.get('type') and metadata['type'] not in CHART_TYPES:
+            raise Exception('The type of the chart %s must be %s' % (chart_dir, ' or '.join(CHART_TYPES)))
+
+    @staticmethod
+    def check_dependencies(chart_dir, files):
+        """
+        Like "helm package", fail if a dependency declared by the chart in `chart_dir` is not in its charts/
+        directory, i.e. "helm dependency build" was not run.
+        """
+        subcharts = set()
+        for rel_path in files:
+            parts = rel_path.split('/')
+            if parts[0] != SUBCHARTS_DIR_NAME:
+                continue
+            if len(parts) == 2 and parts[1].endswith(('.tgz', '.tar.gz')):
+                subcharts.add(ChartPackage.metadata(os.path.join(chart_dir, rel_path)).get('name'))
+            elif len(parts) == 3 and parts[2] == CHART_FILE:
+                with open(os.path.join(chart_dir, rel_path)) as f:
+                    subcharts.add(ChartDiscovery.parse_metadata(f).get('name'))
+        missing = [dependency.get('name', '') for dependency in ChartDependencies.declared(chart_dir)
+                   if dependency.get('name') not in subcharts]
+        if missing:
+            raise Exception('The dependencies %s of the chart %s are missing in its charts/ directory'
+                            % (', '.join(missing), chart_dir))
+
+    @staticmethod
+    def files(chart_dir):
+        """
+        Return the sorted paths, relative to `chart_dir`, of the files of the chart not excluded by its .helmignore.
+        Like Helm, symbolic links to directories are followed.
+        """
+        rules = []
+        helmignore_path = os.path.join(chart_dir, HELMIGNORE_FILE)
+        if os.path.isfile(helmignore_path):
+            with open(helmignore_path) as f:
+                rules += ChartPackager.parse_ignore_rules(f)
+        rules += DEFAULT_IGNORE_RULES
+
+        files = []
+        for dir_path, dir_names, file_names in os.walk(chart_dir, followlinks=True):
+            rel_dir = os.path.relpath(dir_path, chart_dir)
+            rel_dir = '' if rel_dir == '.' else rel_dir + '/'
+            real_dir = os.path.realpath(dir_path)
+            for name in dir_names:
+                real_child = os.path.realpath(os.path.join(dir_path, name))
+                if os.path.commonpath([real_child, real_dir]) == real_child:
+                    raise Exception('The symbolic link %s%s of the chart %s loops back to %s'
+                                    % (rel_dir, name, chart_dir, real_child))
+            dir_names[:] = [name for name in dir_names if not ChartPackager.ignored(rel_dir + name, True, rules)]
+            for name in file_names:
+                if ChartPackager.ignored(rel_dir + name, False, rules):
+                    continue
+                if not stat.S_ISREG(os.stat(os.path.join(dir_path, name)).st_mode):
+                    raise Exception('Cannot package the irregular file %s%s of the chart %s'
+                                    % (rel_dir, name, chart_dir))
+                files.append(rel_dir + name)
+        return sorted(files)
+
+    @staticmethod
+    def parse_ignore_rules(lines):
+        """
+        Return the (negated, directories only, pattern) rules of a .helmignore file.
+        """
+        rules = []
+        for line in lines:
+            pattern = line.strip()
+            if not pattern or pattern.startswith('#'):
+                continue
+            if '**' in pattern:
+                raise Exception('Invalid %s rule "%s": ** is not supported' % (HELMIGNORE_FILE, pattern))
+            negated = pattern.startswith('!')
+            if negated:
+                pattern = pattern[1:]
+            dir_only = pattern.endswith('/')
+            if dir_only:
+                pattern = pattern[:-1]
+            glob_regex(pattern.lstrip('/'))
+            rules.append((negated, dir_only, pattern))
+        return rules
+
+    @staticmethod
+    def ignored(rel_path, is_dir, rules):
+        """
+        Check whether `rules` exclude `rel_path` the way Helm evaluates them: the first rule matching the path wins,
+        and a negated rule excludes every path it does not match.
+        """
+        for negated, dir_only, pattern in rules:
+            if negated:
+                if dir_only and not is_dir or not ChartPackager._matches(pattern, rel_path):
+                    return True
+                continue
+            if dir_only and not is_dir:
+                continue
+            if ChartPackager._matches(pattern, rel_path):
+                return True
+        return False
+
+    @staticmethod
+    def _matches(pattern, rel_path):
+        if pattern.startswith('/'):
+            # Rooted at the chart directory
+            return glob_regex(pattern[1:]).match(rel_path) is not None
+        # Patterns without a slash match the name of a file in any directory
+        target = rel_path if '/' in pattern else rel_path.rsplit('/', 1)[-1]
+        return glob_regex(pattern).match(target) is not None
+
+    def _load(self, chart_dir, version=None, app_version=None):
+        """
+        Return the files of the chart in `chart_dir`, its metadata and the (path, mode, data) of its entries.
+        """
+        files = self.files(chart_dir)
+        if CHART_FILE not in files:
+            raise Exception('No %s in the chart directory %s' % (CHART_FILE, chart_dir))
+        chart_yaml = self._chart_yaml(chart_dir, version, app_version)
+        metadata = ChartDiscovery.parse_metadata(chart_yaml.decode().splitlines(True))
+        self.validate(chart_dir, metadata)
+
+        local_archives = self._local_dependency_archives(chart_dir, files)
+        contents = []
+        for rel_path in files:
+            if rel_path == CHART_FILE:
+                data = chart_yaml
+            elif rel_path in local_archives:
+                data = self._package_local_dependency(local_archives[rel_path])
+            else:
+                with open(os.path.join(chart_dir, rel_path), 'rb') as f:
+                    data = f.read()
+            contents.append((rel_path, self._mode(os.path.join(chart_dir, rel_path)), data))
+        return files, metadata, contents
+
+    @staticmethod
+    def _local_dependency_archives(chart_dir, files):
+        """
+        Map the archives "helm dependency build" writes into charts/ for the file:// dependencies of the chart in
+        `chart_dir` to the directories of those dependencies.
+        """
+        archives = {}
+        for dependency_dir in ChartDependencies.local_dependencies(chart_dir):
+            chart_file = os.path.join(dependency_dir, CHART_FILE)
+            if not os.path.isfile(chart_file):
+                continue
+            with open(chart_file) as f:
+                metadata = ChartDiscovery.parse_metadata(f)
+            rel_path = '%s/%s-%s.tgz' % (SUBCHARTS_DIR_NAME, metadata.get('name'), metadata.get('version'))
+            if rel_path in files:
+                archives[rel_path] = dependency_dir
+        return archives
+
+    def _package_local_dependency(self, dependency_dir):
+        # Helm does not check the dependencies of the subcharts it packages
+        _, metadata, contents = self._load(dependency_dir)
+        package = io.BytesIO()
+        self._write(contents, metadata['name'], package)
+        return package.getvalue()
+
+    def _write(self, contents, name, fileobj):
+        with gzip.GzipFile(filename='', mode='wb', fileobj=fileobj, mtime=0) as gz:
+            with tarfile.open(fileobj=gz, mode='w', format=tarfile.PAX_FORMAT) as tar:
+                for rel_path, mode, data in contents:
+                    info = tarfile.TarInfo('%s/%s' % (name, rel_path))
+                    info.size = len(data)
+                    info.mtime = self.mtime
+                    info.mode = mode
+                    info.uid = info.gid = 0
+                    info.uname = info.gname = ''
+                    tar.addfile(info, io.BytesIO(data))
+
+    @staticmethod
+    def _mode(path):
+        return 0o755 if os.stat(path).st_mode & stat.S_IXUSR else 0o644
+
+    @staticmethod
+    def _chart_yaml(chart_dir, version, app_version):
+        with open(os.path.join(chart_dir, CHART_FILE), 'rb') as f:
+            chart_yaml = f.read().decode()
+        for key, value in [('version', version), ('appVersion', app_version)]:
+            if value is None:
+                continue
+            line = '%s: %s' % (key, value)
+            key_re = re.compile(r'^%s:.*$' % key, re.MULTILINE)
+            if key_re.search(chart_yaml):
+                chart_yaml = key_re.sub(line.replace('\\', '\\\\'), chart_yaml, count=1)
+            else:
+                chart_yaml = chart_yaml.rstrip('\n') + '\n' + line + '\n'
+        return chart_yaml.encode()
+
+
+@functools.lru_cache(maxsize=None)
+def glob_regex(pattern):
+    """
+    Compile a pattern of Go's filepath.Match, which Helm matches .helmignore rules with: unlike fnmatch, "*" and "?"
+    don't match a "/", and character classes are negated with "^".
+    """
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        i += 1
+        if char == '*':
+            regex += '[^/]*'
+        elif char == '?':
+            regex += '[^/]'
+        elif char == '[':
+            char_class = ''
+            if pattern[i:i + 1] == '^':
+                char_class, i = '^', i + 1
+            ranges = 0
+            while True:
+                if i < len(pattern) and pattern[i] == ']' and ranges:
+                    i += 1
+                    break
+                low, i = _class_char(pattern, i)
+                high = low
+                if pattern[i:i + 1] == '-':
+                    high, i = _class_char(pattern, i + 1)
+                if low > high:
+                    raise Exception('Invalid %s rule "%s": bad character range' % (HELMIGNORE_FILE, pattern))
+                char_class += '%s-%s' % (re.escape(low), re.escape(high))
+                ranges += 1
+            regex += '[%s]' % char_class
+        elif char == '\\':
+            if i == len(pattern):
+                raise Exception('Invalid %s rule "%s": trailing escape' % (HELMIGNORE_FILE, pattern))
+            regex += re.escape(pattern[i])
+            i += 1
+        else:
+            regex += re.escape(char)
+    return re.compile(regex + r'\Z', re.DOTALL)
+
+
+def _class_char(pattern, i):
+    escaped = pattern[i:i + 1] == '\\'
+    if escaped:
+        i += 1
+    if i == len(pattern) or not escaped and pattern[i] in '-]':
+        raise Exception('Invalid %s rule "%s": unterminated character class' % (HELMIGNORE_FILE, pattern))
+    return pattern[i], i + 1
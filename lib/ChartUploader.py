@@ -0,0 +1,141 @@
+import base64
+import concurrent.futures
+import os
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from lib.HttpConnectionPool import HttpConnectionPool
+from lib.RepoTypeDetector import RepoTypeDetector, PUT_UPLOAD_REPO_TYPES
+
+BUFFER_SIZE = 64 * 1024
+
+
+class FileBody(object):
+    """
+    Request body streaming a file from disk `buffer_size` bytes at a time. Every iteration reads the file from the
+    start again, so that a retried request sends the whole file again without it ever being held in memory.
+    """
+
+    def __init__(self, path, buffer_size=BUFFER_SIZE):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.size = os.path.getsize(path)
+        self.sent = 0
+
+    def __iter__(self):
+        self.sent = 0
+        with open(self.path, 'rb') as f:
+            chunk = f.read(self.buffer_size)
+            while chunk:
+                self.sent += len(chunk)
+                yield chunk
+                chunk = f.read(self.buffer_size)
+
+
+class ChartUploader(object):
+    """
+    Upload chart packages to http(s) Helm repos (Artifactory, Nexus) and Azure Helm repos in place of curl.
+
+    Packages are streamed from disk with a fixed-size buffer. Requests go through a pool of keep-alive connections
+    that retries transient failures (5xx statuses and connection errors) with exponential backoff, so the upload
+    reuses the connection of the request validating the repo credentials.
+    """
+
+    def __init__(self, pool=None, buffer_size=BUFFER_SIZE, out=None):
+        self.pool = pool or HttpConnectionPool()
+        self.buffer_size = buffer_size
+        self.out = out or sys.stdout
+
+    @staticmethod
+    def split_credentials(url, username=None, password=None):
+        """
+        Return `url` without the credentials it may contain, and the credentials to use for it: the ones of the URL
+        if any, else `username` and `password`.
+        """
+        parsed_url = urllib.parse.urlsplit(url)
+        if parsed_url.username is None:
+            return url, username, password
+        netloc = parsed_url.hostname + (':%d' % parsed_url.port if parsed_url.port else '')
+        return urllib.parse.urlunsplit(parsed_url._replace(netloc=netloc)), \
+            urllib.parse.unquote(parsed_url.username), urllib.parse.unquote(parsed_url.password or '')
+
+    def validate_repo(self, repo_url, username, password):
+        """
+        Check the credentials of `repo_url` with an authenticated HEAD request and that it is a Helm repo charts are
+        uploaded to with a PUT (Artifactory, Nexus). Returns an error message, or None if the repo is valid.
+        """
+        self.out.write("Performing test of the URL '%s' making an authenticated request to it...\n" % repo_url)
+        try:
+            response = RepoTypeDetector.probe(repo_url, username, password, self.pool.open)
+        except urllib.error.HTTPError as err:
+            message = 'Failed to test your chart repository url, server responded with: %s %s' % (err.code, err.reason)
+            if err.code == 401:
+                return message + '\nPlease check the user name and password you specified for the Helm repository'
+            return message + '\nPlease make sure the repo URL is valid'
+        except urllib.error.URLError as err:
+            return '%s\nPlease make sure the repo URL is valid' % err.reason
+
+        self.out.write('The CHART_REPO_URL has been tested successfully\n')
+        repo_type = RepoTypeDetector.detect(response)
+        if repo_type is None:
+            return 'Failed to infer the Helm repository type'
+        if repo_type not in PUT_UPLOAD_REPO_TYPES:
+            return 'Pushing charts to %s Helm repositories is not supported' % RepoTypeDetector.name(repo_type)
+        self.out.write('An %s Helm repository has been recognized\n' % RepoTypeDetector.name(repo_type))
+        return None
+
+    def upload(self, path, url, username=None, password=None, methods=('PUT',)):
+        """
+        Upload the package at `path` to `url`, or to `url` followed by the name of the package if `url` ends with a
+        slash. Every method of `methods` is tried in turn until one succeeds (e.g. PUT then PATCH for Azure). Returns
+        the response, raises urllib.error.HTTPError / URLError if the package could not be uploaded.
+        """
+        if url.endswith('/'):
+            url += urllib.parse.quote(os.path.basename(path))
+        body = FileBody(path, self.buffer_size)
+        for index, method in enumerate(methods):
+            request = self._request(method, url, username, password, body)
+            request.add_header('Content-Type', 'application/octet-stream')
+            request.add_header('Content-Length', str(body.size))
+            started = time.monotonic()
+            try:
+                response = self.pool.open(request)
+            except urllib.error.HTTPError as err:
+                if index == len(methods) - 1:
+                    raise
+                self.out.write('%s %s failed (%s %s), trying %s\n' % (method, url, err.code, err.reason,
+                                                                      methods[index + 1]))
+                continue
+            duration = max(time.monotonic() - started, 1e-6)
+            self.out.write('Uploaded %s to %s (%d bytes in %.2fs, %.2f MB/s)\n' % (
+                os.path.basename(path), url, body.sent, duration, body.sent / duration / 1024 / 1024))
+            return response
+
+    def upload_all(self, paths, url, username=None, password=None, methods=('PUT',), concurrency=4):
+        """
+        Upload the packages at `paths` like upload(), at most `concurrency` at a time over the connections of the
+        pool. Returns (path, error message or None) pairs, in the order of `paths`.
+        """
+        def upload(path):
+            try:
+                self.upload(path, url, username, password, methods)
+            except urllib.error.HTTPError as err:
+                return path, 'server responded with: %s %s' % (err.code, err.reason)
+            except (urllib.error.URLError, OSError) as e:
+                return path, str(e)
+            return path, None
+
+        with concurrent.futures.ThreadPoolExecutor(max(concurrency, 1)) as executor:
+            return list(executor.map(upload, paths))
+
+    @staticmethod
+    def _request(method, url, username, password, body=None):
+        # The body is iterated by http.client, urllib only sees it as data
+        request = urllib.request.Request(url, body, method=method)
+        if username is not None and password is not None:
+            auth_b64 = base64.b64encode(('%s:%s' % (username, password)).encode()).decode()
+            request.add_header('Authorization', 'Basic %s' % auth_b64)
+        return request
@@ -0,0 +1,75 @@
+import json
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.HttpConnectionPool import HttpConnectionPool
+from lib.Tracer import Tracer, SPAN_KIND_CLIENT
+
+MAX_CONCURRENT_REQUESTS = 8
+
+
+class CodefreshApiClient(object):
+    """
+    Client of the Codefresh API used to resolve Helm repo contexts and Azure Helm repo tokens.
+
+    All the requests share a pool of keep-alive connections, so resolving several contexts and tokens costs a single
+    connection setup, and independent lookups can be resolved concurrently with `resolve_all`. Every request is
+    traced as a span of `tracer`. The `pool` may be shared with the other HTTP clients of the step.
+    """
+
+    def __init__(self, env, timeout=30, retries=3, tracer=None, pool=None):
+        self.env = env
+        self._base_url = None
+        self.api_key = env.get('CF_API_KEY')
+        self.pool = pool or HttpConnectionPool(timeout=timeout, retries=retries)
+        self.tracer = tracer or Tracer({})
+
+    def get_context(self, name):
+        query_string = urllib.parse.urlencode({'decrypt': 'true'})
+        return self._request('/api/contexts/%s?%s' % (name, query_string))
+
+    def get_azure_helm_token(self, service):
+        return self._request('/api/clusters/aks/helm/repos/%s/token' % service)['access_token']
+
+    def get_azure_service_principal_helm_token(self, service, client_id=None, client_secret=None, tenant=None):
+        data = None
+        if client_id and client_secret and tenant:
+            data = {'clientId': client_id, 'clientSecret': client_secret, 'tenant': tenant}
+            data = urllib.parse.urlencode(data).encode()
+        return self._request('/api/clusters/aks-sp/helm/repos/%s/token' % service, data)['access_token']
+
+    @staticmethod
+    def resolve_all(calls):
+        """
+        Run the independent lookups in `calls`, a list of (function, args) pairs, concurrently and return their
+        results in the same order.
+        """
+        if len(calls) <= 1:
+            return [function(*args) for function, args in calls]
+        with ThreadPoolExecutor(max_workers=min(len(calls), MAX_CONCURRENT_REQUESTS)) as executor:
+            futures = [executor.submit(function, *args) for function, args in calls]
+            return [future.result() for future in futures]
+
+    def _get_base_url(self):
+        # Only resolved on the first request, most runs of the step don't call the API at all
+        if self._base_url is None:
+            cf_build_url = self.env.get('CF_BUILD_URL', 'https://g.codefresh.io')
+            if 'local' in cf_build_url:
+                cf_build_url = 'http://' + self.env.get('CF_HOST_IP')
+            cf_build_url_parsed = urllib.parse.urlparse(cf_build_url)
+            self._base_url = '%s://%s' % (cf_build_url_parsed.scheme, cf_build_url_parsed.netloc)
+        return self._base_url
+
+    def _request(self, path, data=None):
+        base_url = self._get_base_url()
+        request = urllib.request.Request(base_url + path, data)
+        if self.api_key is not None:
+            request.add_header('Authorization', self.api_key)
+        method = request.get_method()
+        url = base_url + path.split('?')[0]
+        with self.tracer.span('%s %s' % (method, path.split('?')[0]), {'http.request.method': method, 'url.full': url},
+                              SPAN_KIND_CLIENT) as span:
+            response = self.pool.open(request)
+            span.set_attribute('http.response.status_code', response.getcode())
+            return json.load(response)
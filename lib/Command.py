@@ -0,0 +1,82 @@
+class ShellWord(str):
+    """
+    Argument already written in shell syntax (quoted, or relying on expansions such as "$PACKAGE"), which renderers
+    must pass through as is instead of quoting it.
+    """
+
+
+class Command(object):
+    """
+    A single command of the step: its arguments, literal unless given as ShellWord, and what may be assumed about
+    it when running it:
+
+    - secret: its arguments contain credentials
+    - network: it talks to remote services (repos, clusters)
+    - idempotent: running it again has the same effect, so it can be retried
+    - parallel_safe: it can run concurrently with the other parallel-safe commands of the step
+    - dry_run: it must be printed instead of run
+
+    `phase` names the part of the step the command belongs to (repo-add, dependencies, upgrade, ...).
+    """
+
+    def __init__(self, argv, secret=False, network=False, idempotent=False, parallel_safe=False, dry_run=False,
+                 phase=None):
+        self.argv = list(argv)
+        self.secret = secret
+        self.network = network
+        self.idempotent = idempotent
+        self.parallel_safe = parallel_safe
+        self.dry_run = dry_run
+        self.phase = phase
+
+    def kind(self):
+        """
+        Short description of what the command runs, e.g. "helm upgrade".
+        """
+        words = [arg for arg in self.argv[:2] if not isinstance(arg, ShellWord) and not arg.startswith('-')]
+        return ' '.join(words)
+
+    def add(self, *args):
+        self.argv.extend(args)
+        return self
+
+    def metadata(self):
+        return {
+            'phase': self.phase,
+            'kind': self.kind(),
+            'secret': self.secret,
+            'network': self.network,
+            'idempotent': self.idempotent,
+            'parallel_safe': self.parallel_safe,
+        }
+
+
+class ShellScript(Command):
+    """
+    Bash lines that don't reduce to a single command (conditionals, pipes, variable assignments, ...).
+    """
+
+    def __init__(self, lines, secret=False, network=False, idempotent=False, parallel_safe=False, dry_run=False,
+                 phase=None):
+        super().__init__([], secret, network, idempotent, parallel_safe, dry_run, phase)
+        self.lines = [lines] if isinstance(lines, str) else list(lines)
+
+    def kind(self):
+        return 'shell'
+
+
+class ParallelCommands(object):
+    """
+    Commands run concurrently, at most `concurrency` at a time, as (name, Command) `jobs`. The step fails once all of
+    them finished if any of them failed.
+    """
+
+    def __init__(self, jobs, concurrency, description, summary=False, phase=None):
+        self.jobs = list(jobs)
+        self.concurrency = concurrency
+        self.description = description
+        self.summary = summary
+        self.phase = phase
+
+    def kind(self):
+        return 'parallel'
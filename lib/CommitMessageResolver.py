@@ -1,10 +1,12 @@
 from string import Template
 
+from lib.Command import ShellScript
+
 
 class CommitMessageResolver:
     @staticmethod
     def get_command(file, message):
-        return Template('''
+        return ShellScript(Template('''
 file_path="$file_path"
 message="$message_string"
 
@@ -15,4 +17,4 @@ then
 else
   echo "commit_message:${message}" >> $file_path
 fi
-        ''').safe_substitute(file_path=file, message_string=message).split('\n')
+        ''').safe_substitute(file_path=file, message_string=message).split('\n'))
@@ -0,0 +1,80 @@
+import hashlib
+import os
+
+from lib.ChartDependencies import ChartDependencies, DEPENDENCY_FILES, LOCK_FILES
+from lib.RepoIndexCache import RepoIndexCache
+
+DEPENDENCIES_DIR_NAME = 'dependencies'
+COMPLETE_MARKER = '.complete'
+
+
+class DependencyCache(object):
+    """
+    Cache of the dependency archives Helm downloads into the charts/ directory of a chart, keyed by the digest of
+    the chart lock file, of the declared dependencies, of the content of the file:// dependencies and of the URLs of
+    the repos the dependencies may be resolved from.
+    """
+
+    def __init__(self, cache_dir):
+        self.dependencies_dir = os.path.join(cache_dir, DEPENDENCIES_DIR_NAME)
+
+    @staticmethod
+    def key(chart_dir, repo_urls):
+        """
+        Return the cache key of the dependencies of the chart in `chart_dir`, or None if the chart has no lock file
+        (its dependencies are not pinned then, so they can't be cached).
+        """
+        for lock_file in LOCK_FILES:
+            path = os.path.join(chart_dir, lock_file)
+            if os.path.isfile(path):
+                digest = hashlib.sha256()
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+                # Helm refuses to build from a lock file out of sync with the declared dependencies, so a restore
+                # must not happen then either
+                for dependency_file in DEPENDENCY_FILES:
+                    dependency_path = os.path.join(chart_dir, dependency_file)
+                    if os.path.isfile(dependency_path):
+                        with open(dependency_path, 'rb') as f:
+                            digest.update(b'\n' + dependency_file.encode() + b'\n' + f.read())
+                # The lock file pins file:// dependencies by name and version only, not by content
+                DependencyCache._update_local_dependencies_digest(digest, chart_dir, set())
+                for repo_url in sorted(set(RepoIndexCache.normalize_url(url).rstrip('/') for url in repo_urls)):
+                    digest.update(b'\n' + repo_url.encode())
+                return digest.hexdigest()
+        return None
+
+    @staticmethod
+    def _update_local_dependencies_digest(digest, chart_dir, seen):
+        for dependency_dir in sorted(ChartDependencies.local_dependencies(chart_dir)):
+            if dependency_dir in seen:
+                continue
+            seen.add(dependency_dir)
+            digest.update(b'\n' + os.path.basename(dependency_dir).encode())
+            # Helm follows symlinks when packaging the dependency
+            for dir_path, dir_names, file_names in os.walk(dependency_dir, followlinks=True):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    path = os.path.join(dir_path, file_name)
+                    with open(path, 'rb') as f:
+                        digest.update(b'\n' + os.path.relpath(path, dependency_dir).encode() + b'\0' +
+                                      hashlib.sha256(f.read()).digest())
+            DependencyCache._update_local_dependencies_digest(digest, dependency_dir, seen)
+
+    def entry_dir(self, key):
+        return os.path.join(self.dependencies_dir, key)
+
+    def contains(self, key):
+        return os.path.isfile(os.path.join(self.entry_dir(key), COMPLETE_MARKER))
+
+    def restore_command(self, key, chart_dir):
+        return 'mkdir -p {chart}/charts && cp {entry}/*.tgz {chart}/charts/'.format(
+            chart=chart_dir, entry=self.entry_dir(key))
+
+    def store_command(self, key, chart_dir):
+        # Populate a temporary directory first, so a concurrent reader never sees a partial entry
+        return ('{{ mkdir -p {dir} && cf_deps_tmp=$(mktemp -d {dir}/.{key}.XXXXXX) && '
+                'cp {chart}/charts/*.tgz "$cf_deps_tmp"/ && touch "$cf_deps_tmp"/{marker} && '
+                '{{ [ -d {entry} ] && rm -rf "$cf_deps_tmp" || mv "$cf_deps_tmp" {entry}; }}; }} || '
+                'echo "Failed to cache the dependencies of {chart}"').format(
+            dir=self.dependencies_dir, key=key, chart=chart_dir, marker=COMPLETE_MARKER, entry=self.entry_dir(key))
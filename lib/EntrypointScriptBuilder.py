@@ -1,43 +1,83 @@
-import base64
-import errno
+import hashlib
 import json
 import os
 import sys
-import urllib.parse
 import urllib.request
-import zlib
 import re
-
+import shlex
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.AzureTokenCache import AzureTokenCache
+from lib.ChartArtifactStore import ChartArtifactStore, PULL_DIR
+from lib.ChartDependencies import ChartDependencies
+from lib.ChartDiscovery import ChartDiscovery
+from lib.ChartMaterializer import ChartMaterializer
+from lib.ChartPackage import ChartPackage
+from lib.Command import Command, ParallelCommands, ShellScript, ShellWord
+from lib.CodefreshApiClient import CodefreshApiClient
 from lib.CommitMessageResolver import CommitMessageResolver
+from lib.DependencyCache import DependencyCache
+from lib.EnvironmentScanner import EnvironmentScanner
 from lib.Helm2CommandBuilder import Helm2CommandBuilder
-from lib.Helm3CommandBuilder import Helm3CommandBuilder
+from lib.Helm3CommandBuilder import Helm3CommandBuilder, STABLE_REPO_NAME, STABLE_REPO_URL
+from lib.HttpConnectionPool import HttpConnectionPool
+from lib.PlanRenderer import PlanRenderer
+from lib.ReleaseDigestStore import ReleaseDigestStore
+from lib.RepoIndex import RepoIndex
+from lib.RepoIndexCache import RepoIndexCache
+from lib.RepoTypeDetector import RepoTypeDetector, PUT_UPLOAD_REPO_TYPES
+from lib.SetValuesCompiler import SetValuesCompiler
+from lib.ShellRenderer import ShellRenderer
+from lib.StepTimings import StepTimings
+from lib.Tracer import Tracer, SPAN_KIND_CLIENT
 
 CHART_DIR = '/opt/chart'
+CHART_DEPENDENCIES_DIGEST_FILE = '/opt/chart.dependencies'
 DOWNLOAD_CHART_DIR = '/opt/chart_install_data'
+# Destination of the packages of the charts pushed from CHARTS_ROOT
+PACKAGES_DIR = '/tmp/cfstep-helm-packages'
+AZURE_REPO_SCHEMES = ('az://', 'azsp://', 'azmi://')
+# Python uploader of chart packages, installed beside build_entrypoint_script
+PUSH_CHART = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'push_chart')
+CHECK_CHART_PUBLISHED = os.path.join(os.path.dirname(PUSH_CHART), 'check_chart_published')
+PACKAGE_CHART = os.path.join(os.path.dirname(PUSH_CHART), 'package_chart')
+
+
+def shell_word(value):
+    return ShellWord(value) if value is not None else None
 
 
 class EntrypointScriptBuilder(object):
 
     def __init__(self, env):
+        # Trace the step to CFSTEP_TRACE_FILE, starting with the initialization of the builder
+        self.tracer = Tracer(env)
+        init_span = self.tracer.start_span('init')
+
         self.action = env.get('ACTION', 'install').lower()
+        # Step inputs are passed on to the commands as shell words, the shell expands them ($VAR, ~) as it always did
         self.kube_context = env.get('KUBE_CONTEXT')
         self.chart_name = env.get('CHART_NAME')
-        self.chart_ref = env.get('CHART_REF', env.get('CHART_NAME'))
+        self.chart_ref = shell_word(env.get('CHART_REF', env.get('CHART_NAME')))
         self.chart_subdir = env.get('CHART_SUBDIR') #optional Artifactory subfolder (inside Helm repo)
         self.chart_repo_url = env.get('CHART_REPO_URL')
         self.skip_repo_credentials_validation = env.get('SKIP_REPO_CREDENTIALS_VALIDATION', 'false')
         self.helm_repo_username = env.get('HELMREPO_USERNAME')
         self.helm_repo_password = env.get('HELMREPO_PASSWORD')
-        self.chart_version = env.get('CHART_VERSION')
-        self.app_version = env.get('APP_VERSION')
-        self.release_name = env.get('RELEASE_NAME')
-        self.namespace = env.get('NAMESPACE')
-        self.tiller_namespace = env.get('TILLER_NAMESPACE')
-        self.set_file = env.get('SET_FILE')
+        self.chart_version = shell_word(env.get('CHART_VERSION'))
+        self.app_version = shell_word(env.get('APP_VERSION'))
+        self.release_name = shell_word(env.get('RELEASE_NAME'))
+        self.namespace = shell_word(env.get('NAMESPACE'))
+        self.tiller_namespace = shell_word(env.get('TILLER_NAMESPACE'))
+        self.set_file = shell_word(env.get('SET_FILE'))
         self.dry_run = env.get('DRY_RUN')
         self.recreate_pods = env.get('RECREATE_PODS')
         self.wait = env.get('WAIT', 'false')
-        self.timeout = env.get('TIMEOUT')
+        self.timeout = shell_word(env.get('TIMEOUT'))
+        # Number of revisions of a release kept on upgrade (Helm 3, 0 for no limit) and by the prune action
+        self.history_max = env.get('HISTORY_MAX') or None
+        if self.history_max is not None and not self.history_max.isdigit():
+            raise Exception('HISTORY_MAX must be a number of revisions to keep')
         self.cmd_ps = env.get('CMD_PS')
         self.commit_message = env.get('COMMIT_MESSAGE')
         self.google_application_credentials_json = env.get('GOOGLE_APPLICATION_CREDENTIALS_JSON')
@@ -51,6 +91,11 @@ class EntrypointScriptBuilder(object):
         self.primary_helm_context = env.get('PRIMARY_HELM_CONTEXT')
         self.use_repos_for_auth_action = (env.get('USE_REPOS_FOR_AUTH_ACTION', '').upper() == 'TRUE')
         self.azure_helm_token = None
+        self.azure_token_cache = self._create_azure_token_cache(env)
+        # Keep-alive connections shared by the requests to the Codefresh API and to Helm repos
+        self.http_pool = HttpConnectionPool(timeout=int(env.get('CF_API_TIMEOUT', '30')),
+                                            retries=int(env.get('CF_API_RETRIES', '3')))
+        self.codefresh_api = CodefreshApiClient(os.environ, tracer=self.tracer, pool=self.http_pool)
 
         credentials_in_arguments_str = env.get('CREDENTIALS_IN_ARGUMENTS', 'false')
         if credentials_in_arguments_str.upper() == 'TRUE':
@@ -64,6 +109,53 @@ class EntrypointScriptBuilder(object):
         else:
             self.skip_stable = False
 
+        # Deploy the chart to several releases/namespaces/clusters at once instead of the single RELEASE_NAME
+        release_targets = env.get('RELEASE_TARGETS')
+        self.release_targets = None
+        if release_targets:
+            self.release_targets = json.loads(release_targets)
+            if not isinstance(self.release_targets, list) or not all(
+                    isinstance(target, dict) and target.get('release') for target in self.release_targets):
+                raise Exception('RELEASE_TARGETS must be a JSON list of targets, each with a "release" name')
+        self.release_targets_parallelism = int(env.get('RELEASE_TARGETS_PARALLELISM', '4'))
+
+        # Pass the --set / --set-string overrides to Helm as a single generated values file
+        self.set_values_as_file = (env.get('SET_VALUES_AS_FILE', 'false').upper() == 'TRUE')
+        self.set_values_dir = env.get('SET_VALUES_DIR', '/tmp')
+        # Path -> content of the values files of the overrides, written by the script
+        self.set_values_files = {}
+
+        # Upload packages to http(s) and Azure Helm repos with push_chart instead of curl
+        self.python_uploader = (env.get('CFSTEP_UPLOADER', 'curl').lower() == 'python')
+        # Package charts as reproducible archives with package_chart instead of helm package
+        self.python_packager = (env.get('CFSTEP_PACKAGER', 'helm').lower() == 'python')
+
+        # Don't push packages whose version is already in the index of the repo with the same digest
+        self.skip_published_charts = (env.get('SKIP_PUBLISHED_CHARTS', 'false').upper() == 'TRUE')
+
+        # Push every chart found under this directory instead of CHART_REF
+        self.charts_root = env.get('CHARTS_ROOT')
+        self.charts_parallelism = int(env.get('CHARTS_PARALLELISM', '4'))
+
+        self.parallel_repo_add = (env.get('PARALLEL_REPO_ADD', 'false').upper() == 'TRUE')
+        self.parallel_repo_add_concurrency = int(env.get('PARALLEL_REPO_ADD_CONCURRENCY', '4'))
+
+        # Optional cache directory persisted between step invocations (e.g. on the Codefresh volume)
+        self.cache_dir = env.get('CFSTEP_CACHE_DIR')
+        self.repo_index_cache_size = int(env.get('CFSTEP_REPO_INDEX_CACHE_SIZE_MB', '1024')) * 1024 * 1024
+        self.repo_type_cache_ttl = int(env.get('CFSTEP_REPO_TYPE_CACHE_TTL', '3600'))
+        # Cached index of every repo registered from the repo index cache, keyed by repo name
+        self.cached_repo_indexes = {}
+        # Skip upgrades deploying the same manifests and values as the deployed revision (Helm 3, needs the cache)
+        self.skip_unchanged_upgrade = (env.get('SKIP_UNCHANGED_UPGRADE', 'false').upper() == 'TRUE')
+        self.helm_repository_config = env.get('HELM_REPOSITORY_CONFIG') or os.path.join(
+            env.get('XDG_CONFIG_HOME', os.path.expanduser('~/.config')), 'helm', 'repositories.yaml')
+        self.helm_repository_cache = env.get('HELM_REPOSITORY_CACHE') or os.path.join(
+            env.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'helm', 'repository')
+
+        # Time every phase of the step, reported at the end of the run and written as JSON
+        self.timings_file = StepTimings.path(env) if StepTimings.enabled(env) else None
+
         if self.helm_repository_context:
             context_integration = self._get_variables_from_helm_repo_integration(self.helm_repository_context)
             repo_url = context_integration.get('repositoryUrl')
@@ -85,78 +177,34 @@ class EntrypointScriptBuilder(object):
                 _, self.helm_repo_username, self.helm_repo_password = \
                     self._get_repo_credentials(integration_name, variables)
 
+        # Classify the prefixed variables (values, values files, repo contexts) in a single pass
+        self.environment = EnvironmentScanner(env)
         self._extract_helm_repos(env)
 
         if self.helm_version.startswith('2'):
             print("\033[93mCodefresh discontinued support for Helm 2 on July 16 2021\033[0m")
 
         # Save chart data in files
+        self.chart_digest = None
         if self.chart is not None:
-            self.chart = json.loads(self.chart)
-
             self.chart_ref = CHART_DIR
-            if not os.path.exists(CHART_DIR):
-                os.mkdir(CHART_DIR)
-
             sys.stderr.write('Chart files will be placed in {}\n'.format(CHART_DIR))
-            for item in self.chart:
-                if item['name'] == 'values':
-                    item['name'] = 'values.yaml'
-                item['name'] = item['name'].replace('Charts/', 'charts/')
-
-                sys.stderr.write(item['name'] + '\n')
-
-                if not os.path.exists(os.path.dirname('{}/{}'.format(CHART_DIR, item['name']))):
-                    try:
-                        os.makedirs(os.path.dirname('{}/{}'.format(CHART_DIR, item['name'])))
-                    except OSError as exc:
-                        if exc.errno != errno.EEXIST:
-                            raise
-
-                file = open('{}/{}'.format(CHART_DIR, item['name']), 'w')
-                data = item['data'] if 'data' in item.keys() else ''
-                file.write(data)
-                file.close()
-
-        # Values files (-f/--values) sourced from vars prefixed with "CUSTOMFILE_" or "VALUESFILE_"
-        custom_valuesfiles = []
-        for key, val in sorted(env.items()):
-            key_upper = key.upper()
-            if key_upper.startswith('CUSTOMFILE_') or key_upper.startswith('VALUESFILE_'):
-                custom_valuesfiles.append(val)
-        self.custom_valuesfiles = custom_valuesfiles
-
-        # Specific value overrides (--set) sourced from vars prefixed with "CUSTOM_" or "VALUE_"
-        custom_values = {}
-        for key, val in sorted(env.items()):
-            key_upper = key.upper()
-            if key_upper.startswith('CUSTOM_'):
-                cli_set_key = key[7:]
-            elif key_upper.startswith('VALUE_'):
-                cli_set_key = key[6:]
-            else:
-                continue
-            cli_set_key = cli_set_key.replace('_', '.')
-            cli_set_key = cli_set_key.replace('..', '_')
-            custom_values[cli_set_key] = val
-        self.custom_values = custom_values
-
-        # Specific value overrides (--set-string) sourced from vars prefixed with or "VALUESTRING_"
-        string_values = {}
-        for key, val in sorted(env.items()):
-            key_upper = key.upper()
-            if key_upper.startswith('VALUESTRING_'):
-                cli_set_key = key[12:]
-            else:
-                continue
-            cli_set_key = cli_set_key.replace('_', '.')
-            cli_set_key = cli_set_key.replace('..', '_')
-            string_values[cli_set_key] = val
-        self.string_values = string_values
+            chart_materializer = ChartMaterializer(CHART_DIR)
+            with self.tracer.span('materialize chart') as span:
+                chart_materializer.materialize(self.chart)
+                span.set_attribute('cfstep.chart.files', chart_materializer.files)
+                span.set_attribute('cfstep.chart.bytes', chart_materializer.bytes)
+                span.set_attribute('cfstep.cache.hit', chart_materializer.digest == chart_materializer.previous_digest)
+            self.chart_digest = chart_materializer.digest
+
+        # Values files (-f/--values), value overrides (--set) and string value overrides (--set-string)
+        self.custom_valuesfiles = [ShellWord(valuesfile) for valuesfile in self.environment.valuesfiles]
+        self.custom_values = self.environment.values
+        self.string_values = self.environment.string_values
 
         if (self.primary_helm_context is not None) and (self.helm_repository_context is None):
             self.chart_repo_url, self.helm_repo_username, self.helm_repo_password = \
-                self._get_repo_credentials(self.primary_helm_context, env)
+                self.environment.repo_credentials(self.primary_helm_context)
 
         # Workaround a bug in Helm where url that doesn't end with / breaks --repo flags
         if self.chart_repo_url is not None and not self.chart_repo_url.endswith('/'):
@@ -164,6 +212,28 @@ class EntrypointScriptBuilder(object):
 
         self.helm_command_builder = self._select_helm_command_builder()
 
+        self.tracer.attributes = {
+            'cfstep.action': self.action,
+            'helm.release': self.release_name,
+            'helm.chart': self.chart_name or self.chart_ref,
+            'helm.chart.version': self.chart_version,
+            'helm.repo.scheme': self.chart_repo_url.split('://')[0] if self.chart_repo_url else None,
+        }
+        init_span.end()
+
+    def _create_azure_token_cache(self, env):
+        token_ttl = int(env.get('AZURE_HELM_TOKEN_TTL', '600'))
+        if self.dry_run or env.get('PERSIST_AZURE_HELM_TOKENS', 'false').upper() != 'TRUE':
+            return AzureTokenCache(default_ttl=token_ttl)
+        # Tokens are only shared between the steps of the same build, the volume itself outlives the build
+        build_id = env.get('CF_BUILD_ID')
+        if build_id is None:
+            sys.stderr.write('CF_BUILD_ID is not set, Azure Helm repo tokens will not be persisted\n')
+            return AzureTokenCache(default_ttl=token_ttl)
+        token_cache_dir = env.get('CFSTEP_TOKEN_CACHE_DIR', env.get('CF_VOLUME_PATH', '/codefresh/volume'))
+        token_cache_path = os.path.join(token_cache_dir, '.cfstep-helm', 'azure-helm-tokens-%s.json' % build_id)
+        return AzureTokenCache(token_cache_path, token_ttl)
+
     def _get_repo_credentials(self, context_name, env):
         chart_repo_url = env.get('CF_CTX_' + context_name + '_URL')
         helm_repo_username = env.get('CF_CTX_' + context_name.upper() + '_HELMREPO_USERNAME')
@@ -179,86 +249,91 @@ class EntrypointScriptBuilder(object):
         helm_repos = {}
         chart_repo_url = self.chart_repo_url
 
-        if chart_repo_url and chart_repo_url.startswith('az://'):
-            if not self.azure_helm_token:
-                self.azure_helm_token = self._get_azure_helm_token(chart_repo_url)
-            chart_repo_url = chart_repo_url.strip('/').replace('az://',
-                                                               'https://00000000-0000-0000-0000-000000000000:%s@' % self.azure_helm_token,
-                                                               1) + '/helm/v1/repo'
-
-        if chart_repo_url and chart_repo_url.startswith('azsp://'):
-            if self.helm_repo_token is not None:
-                self.azure_helm_token = self.helm_repo_token
-            if not self.azure_helm_token:
-                self.azure_helm_token = self._get_azure_service_principal_helm_token(chart_repo_url)
-            chart_repo_url = chart_repo_url.strip('/').replace('azsp://',
-                                                               'https://00000000-0000-0000-0000-000000000000:%s@' % self.azure_helm_token,
-                                                               1) + '/helm/v1/repo'
-
-        if chart_repo_url and chart_repo_url.startswith('azmi://'):
-            self.azure_helm_token = self.helm_repo_token
-            chart_repo_url = chart_repo_url.strip('/').replace('azmi://',
-                                                               'https://00000000-0000-0000-0000-000000000000:%s@' % self.azure_helm_token,
-                                                               1) + '/helm/v1/repo'
-
-        for key, val in sorted(env.items()):
-            if key.startswith('CF_CTX_') and key.endswith('_URL'):
-                repo_name = key[7:len(key) - 4]  # CF_CTX_repo_name_URL
-                repo_url, repo_username, repo_password = self._get_repo_credentials(repo_name, env)
-
-                if not repo_url.endswith('/'):
-                    repo_url += '/'
-
-                if repo_url.startswith('http://') or repo_url.startswith('https://'):
-                    if not self.credentials_in_arguments and (repo_username is not None) and (
-                            repo_password is not None):
-                        repo_url = repo_url.replace('://', '://%s:%s@' % (repo_username, repo_password), 1)
-
-                # Modify azure URL to use https and contain token
-                elif repo_url.startswith('az://'):
-                    if not self.azure_helm_token:
-                        self.azure_helm_token = self._get_azure_helm_token(repo_url)
-                    repo_url = repo_url.replace('az://',
-                                                'https://00000000-0000-0000-0000-000000000000:%s@' % self.azure_helm_token,
-                                                1) + 'helm/v1/repo'
-
-                elif repo_url.startswith('azsp://'):
-                    if self.helm_repo_token is not None:
-                        self.azure_helm_token = self.helm_repo_token
-                    if not self.azure_helm_token:
-                        self.azure_helm_token = self._get_azure_service_principal_helm_token(repo_url)
-                    repo_url = repo_url.replace('azsp://',
-                                                'https://00000000-0000-0000-0000-000000000000:%s@' % self.azure_helm_token,
-                                                1) + 'helm/v1/repo'
-
-                elif repo_url.startswith('azmi://'):
-                    self.azure_helm_token = self.helm_repo_token
-                    repo_url = repo_url.replace('azmi://',
-                                                'https://00000000-0000-0000-0000-000000000000:%s@' % self.azure_helm_token,
-                                                1) + 'helm/v1/repo'
-
-                helm_repos[repo_name] = repo_url
-                if self.chart_repo_url is None:
-                    chart_repo_url = repo_url
-                    self.helm_repo_username = repo_username
-                    self.helm_repo_password = repo_password
+        context_repo_names = self.environment.context_repo_names
+
+        # Tokens of distinct Azure Helm repo services don't depend on each other, obtain them all at once
+        self._prefetch_azure_helm_tokens([chart_repo_url] + [env.get('CF_CTX_' + name + '_URL')
+                                                             for name in context_repo_names])
+
+        if chart_repo_url and chart_repo_url.startswith(AZURE_REPO_SCHEMES):
+            chart_repo_url = chart_repo_url.strip('/')
+            scheme = chart_repo_url.split('://')[0] + '://'
+            chart_repo_url = chart_repo_url.replace(scheme,
+                                                    'https://00000000-0000-0000-0000-000000000000:%s@' %
+                                                    self._get_azure_repo_token(chart_repo_url),
+                                                    1) + '/helm/v1/repo'
+
+        for repo_name in context_repo_names:
+            repo_url, repo_username, repo_password = self.environment.repo_credentials(repo_name)
+
+            if not repo_url.endswith('/'):
+                repo_url += '/'
+
+            if repo_url.startswith('http://') or repo_url.startswith('https://'):
+                if not self.credentials_in_arguments and (repo_username is not None) and (
+                        repo_password is not None):
+                    repo_url = repo_url.replace('://', '://%s:%s@' % (repo_username, repo_password), 1)
+
+            # Modify azure URL to use https and contain token
+            elif repo_url.startswith(AZURE_REPO_SCHEMES):
+                scheme = repo_url.split('://')[0] + '://'
+                repo_url = repo_url.replace(scheme,
+                                            'https://00000000-0000-0000-0000-000000000000:%s@' %
+                                            self._get_azure_repo_token(repo_url),
+                                            1) + 'helm/v1/repo'
+
+            helm_repos[repo_name] = repo_url
+            if self.chart_repo_url is None:
+                chart_repo_url = repo_url
+                self.helm_repo_username = repo_username
+                self.helm_repo_password = repo_password
 
         self.chart_repo_url = chart_repo_url
         self.helm_repos = helm_repos
 
+    def _azure_token_cache_key(self, repo_url):
+        scheme, service = repo_url.split('://', 1)
+        if scheme == 'azsp':
+            return AzureTokenCache.key(scheme, service.strip('/'), self.tenant, self.client_id)
+        return AzureTokenCache.key(scheme, service.strip('/'))
+
+    def _prefetch_azure_helm_tokens(self, repo_urls):
+        missing_repo_urls = {}
+        for repo_url in repo_urls:
+            if not repo_url or not repo_url.startswith(('az://', 'azsp://')):
+                continue
+            if repo_url.startswith('azsp://') and self.helm_repo_token is not None:
+                continue
+            key = self._azure_token_cache_key(repo_url)
+            if key not in missing_repo_urls and self.azure_token_cache.get(key) is None:
+                missing_repo_urls[key] = repo_url
+
+        calls = []
+        for repo_url in missing_repo_urls.values():
+            if repo_url.startswith('az://'):
+                calls.append((self._get_azure_helm_token, [repo_url]))
+            else:
+                calls.append((self._get_azure_service_principal_helm_token, [repo_url]))
+        tokens = self.codefresh_api.resolve_all(calls)
+        for key, token in zip(missing_repo_urls.keys(), tokens):
+            self.azure_token_cache.put(key, token)
+
+    def _get_azure_repo_token(self, repo_url):
+        if repo_url.startswith('azmi://'):
+            self.azure_helm_token = self.helm_repo_token
+        elif repo_url.startswith('azsp://') and self.helm_repo_token is not None:
+            self.azure_helm_token = self.helm_repo_token
+        else:
+            key = self._azure_token_cache_key(repo_url)
+            if self.azure_token_cache.get(key) is None:
+                self._prefetch_azure_helm_tokens([repo_url])
+            self.azure_helm_token = self.azure_token_cache.get(key)
+        return self.azure_helm_token
+
     def _get_variables_from_helm_repo_integration(self, helm_repo_integration):
         if self.dry_run:
             return 'xXxXx'
-        cf_build_url = os.getenv('CF_BUILD_URL', 'https://g.codefresh.io')
-        if 'local' in cf_build_url:
-            cf_build_url = 'http://' + os.getenv('CF_HOST_IP')
-        cf_build_url_parsed = urllib.parse.urlparse(cf_build_url)
-        query_string = urllib.parse.urlencode({'decrypt': 'true'})
-        token_url = '%s://%s/api/contexts/%s?%s' % (
-            cf_build_url_parsed.scheme, cf_build_url_parsed.netloc, helm_repo_integration, query_string)
-        request = urllib.request.Request(token_url)
-        request.add_header('Authorization', os.getenv('CF_API_KEY'))
-        data = json.load(urllib.request.urlopen(request))
+        data = self.codefresh_api.get_context(helm_repo_integration)
         return {
             "name": data.get("metadata", {}).get("name"),
             "repositoryUrl": data.get('spec', {}).get('data', {}).get('repositoryUrl'),
@@ -270,47 +345,26 @@ class EntrypointScriptBuilder(object):
         sys.stderr.write('Obtaining one-time token for Azure Helm repo service %s ...\n' % service)
         if self.dry_run:
             return 'xXxXx'
-        cf_build_url = os.getenv('CF_BUILD_URL', 'https://g.codefresh.io')
-        if 'local' in cf_build_url:
-            cf_build_url = 'http://' + os.getenv('CF_HOST_IP')
-        cf_build_url_parsed = urllib.parse.urlparse(cf_build_url)
-        token_url = '%s://%s/api/clusters/aks/helm/repos/%s/token' % (
-            cf_build_url_parsed.scheme, cf_build_url_parsed.netloc, service)
-        request = urllib.request.Request(token_url)
-        request.add_header('Authorization', os.getenv('CF_API_KEY'))
-        data = json.load(urllib.request.urlopen(request))
-        return data['access_token']
+        return self.codefresh_api.get_azure_helm_token(service)
 
     def _get_azure_service_principal_helm_token(self, repo_url):
         service = repo_url.replace('azsp://', '').strip('/')
         sys.stderr.write('Obtaining one-time token for Azure Helm repo service %s ...\n' % service)
         if self.dry_run:
             return 'xXxXx'
-        cf_build_url = os.getenv('CF_BUILD_URL', 'https://g.codefresh.io')
-        if 'local' in cf_build_url:
-            cf_build_url = 'http://' + os.getenv('CF_HOST_IP')
-        cf_build_url_parsed = urllib.parse.urlparse(cf_build_url)
-        token_url = '%s://%s/api/clusters/aks-sp/helm/repos/%s/token' % (
-            cf_build_url_parsed.scheme, cf_build_url_parsed.netloc, service)
-        request = urllib.request.Request(token_url)
-        if self.client_id and self.client_secret and self.tenant:
-            data = {'clientId': self.client_id, 'clientSecret': self.client_secret, 'tenant': self.tenant}
-            data = urllib.parse.urlencode(data).encode()
-            request = urllib.request.Request(token_url, data)
-        request.add_header('Authorization', os.getenv('CF_API_KEY'))
-        data = json.load(urllib.request.urlopen(request))
-        return data['access_token']
+        return self.codefresh_api.get_azure_service_principal_helm_token(service, self.client_id, self.client_secret,
+                                                                         self.tenant)
 
     def _build_kubectl_commands(self):
         lines = []
-        if self.action in ['install', 'promotion', 'auth']:
+        if self.action in ['install', 'promotion', 'auth', 'prune']:
             if self.kube_context is not None:
-                kubectl_cmd = 'kubectl config use-context "%s"' % self.kube_context
-                if self.dry_run:
-                    kubectl_cmd = 'echo ' + kubectl_cmd
-                lines.append(kubectl_cmd)
+                lines.append(Command(['kubectl', 'config', 'use-context', ShellWord('"%s"' % self.kube_context)],
+                                     dry_run=self.dry_run))
 
-            if self.kube_context is None and self.action != 'auth':
+            if self.kube_context is None and self.action != 'auth' and not (
+                    self.action == 'install' and self.release_targets is not None and
+                    all(target.get('context') for target in self.release_targets)):
                 raise Exception(
                     'Must set KUBE_CONTEXT in environment (Name of Kubernetes cluster as named in Codefresh)')
 
@@ -318,33 +372,21 @@ class EntrypointScriptBuilder(object):
 
     @staticmethod
     def _resolve_chart(env):
-        if env.get('CHART_JSON') is not None:
-            return env.get('CHART_JSON')
-
-        if env.get('CHART_JSON_GZIP') is not None:
-            return zlib.decompress(base64.b64decode(env.get('CHART_JSON_GZIP')), 15 + 32)
-
-        return None
+        return ChartMaterializer.iter_chart_json(env)
 
     def _build_helm_commands(self):
         lines = []
 
-        if (self.chart_ref is None) and (self.action != 'auth'):
+        if self.action == 'prune':
+            return self._in_phase('prune', [self._build_helm_prune_command()])
+
+        if (self.chart_ref is None) and (self.action != 'auth') and not self._push_charts_root():
             raise Exception(
                 'Must set CHART_REF in the environment (this should be a reference to the chart as Helm CLI expects)')
 
         # Add Helm repos locally
         if self.use_repos_for_auth_action or (self.action != 'auth'):
-            for repo_name, repo_url in sorted(self.helm_repos.items()):
-                _, helm_repo_username, helm_repo_password = self._get_repo_credentials(repo_name, os.environ)
-                if self.credentials_in_arguments and (helm_repo_username is not None) and (helm_repo_password is not None):
-                    helm_repo_add_cmd = 'helm repo add %s %s --username %s --password %s ' % (
-                        repo_name, repo_url, helm_repo_username, helm_repo_password)
-                else:
-                    helm_repo_add_cmd = 'helm repo add %s %s' % (repo_name, repo_url)
-                if self.dry_run:
-                    helm_repo_add_cmd = 'echo ' + helm_repo_add_cmd
-                lines.append(helm_repo_add_cmd)
+            lines += self._in_phase('repo-add', self._build_helm_repo_add_commands())
 
         if self.action == 'auth':
             return lines
@@ -353,142 +395,454 @@ class EntrypointScriptBuilder(object):
             lines += self._build_helm_install_commands()
         if self.action == 'promotion':
             lines += self._build_helm_promotion_commands()
+        elif self.action == 'push' and self._push_charts_root():
+            lines += self._build_helm_push_charts_commands()
         elif self.action == 'push':
             lines += self._build_helm_push_commands()
 
         return lines
 
+    def _build_helm_repo_add_commands(self):
+        lines, cached_repo_indexes = self._register_cached_helm_repos()
+        self.cached_repo_indexes = cached_repo_indexes
+
+        repo_add_cmds = []
+        for repo_name, repo_url in sorted(self.helm_repos.items()):
+            if repo_name in cached_repo_indexes:
+                continue
+            _, helm_repo_username, helm_repo_password = self._get_repo_credentials(repo_name, os.environ)
+            helm_repo_add_cmd = Command(['helm', 'repo', 'add', repo_name, repo_url], secret='@' in repo_url,
+                                        network=True, idempotent=True, parallel_safe=True, dry_run=self.dry_run)
+            if self.credentials_in_arguments and (helm_repo_username is not None) and (helm_repo_password is not None):
+                helm_repo_add_cmd.add('--username', helm_repo_username, '--password', helm_repo_password)
+                helm_repo_add_cmd.secret = True
+            repo_add_cmds.append((repo_name, helm_repo_add_cmd))
+
+        if not self.parallel_repo_add or not repo_add_cmds:
+            return lines + [cmd for _, cmd in repo_add_cmds]
+
+        # Register the repos concurrently. Helm versions without locking of repositories.yaml may lose entries
+        # written at the same time, so re-add (serially) any repo missing from the local repo list afterwards
+        lines.append(ParallelCommands(repo_add_cmds, self.parallel_repo_add_concurrency, 'add Helm repos'))
+        if not self.dry_run:
+            for repo_name, helm_repo_add_cmd in repo_add_cmds:
+                lines.append(ShellScript('helm repo list 2>/dev/null | grep -q "^%s[[:space:]]" || %s' % (
+                    repo_name, ShellRenderer.render_command(helm_repo_add_cmd)), secret=helm_repo_add_cmd.secret,
+                    network=True, idempotent=True))
+        return lines
+
+    def _register_cached_helm_repos(self):
+        """
+        Return the commands registering the http(s) repos whose index could be obtained through the persistent index
+        cache directly in the Helm repositories file, so that Helm uses the cached indexes instead of downloading them
+        with "helm repo add", and the cached index path of every registered repo, keyed by repo name. The script
+        writes the file, building it has no side effect.
+        """
+        if self.cache_dir is None or self.dry_run or not self._helm_3() or not self.helm_repos:
+            return [], {}
+        if os.path.exists(self.helm_repository_config):
+            sys.stderr.write('Helm repositories file %s already exists, not using the repo index cache\n' %
+                             self.helm_repository_config)
+            return [], {}
+
+        fetches = []
+        for repo_name, repo_url in sorted(self.helm_repos.items()):
+            if not (repo_url.startswith('http://') or repo_url.startswith('https://')):
+                continue
+            _, helm_repo_username, helm_repo_password = self._get_repo_credentials(repo_name, os.environ)
+            if not self.credentials_in_arguments:
+                helm_repo_username = helm_repo_password = None
+            fetches.append((repo_name, repo_url, helm_repo_username, helm_repo_password))
+        if not fetches:
+            return [], {}
+
+        # The indexes don't depend on each other, fetch them all at once over the shared connection pool
+        with ThreadPoolExecutor(max_workers=min(len(fetches), self.parallel_repo_add_concurrency)) as executor:
+            index_paths = list(executor.map(lambda fetch: self._fetch_repo_index(*fetch[1:]), fetches))
+
+        cached_repo_indexes = {}
+        repositories = []
+        for (repo_name, repo_url, helm_repo_username, helm_repo_password), index_path in zip(fetches, index_paths):
+            if index_path is None:
+                continue
+            repository = {'name': repo_name, 'url': repo_url}
+            if helm_repo_username is not None and helm_repo_password is not None:
+                repository['username'] = helm_repo_username
+                repository['password'] = helm_repo_password
+            repositories.append(repository)
+            cached_repo_indexes[repo_name] = index_path
+
+        if not repositories:
+            return [], {}
+
+        # JSON is valid YAML, Helm reads this file the same way as one written by "helm repo add"
+        repositories_json = json.dumps({'apiVersion': '', 'repositories': repositories})
+        commands = [Command(['mkdir', '-p', os.path.dirname(self.helm_repository_config),
+                             self.helm_repository_cache], idempotent=True),
+                    # Only readable by the current user, it holds the credentials of the repos
+                    ShellScript("(umask 077 && printf '%%s\\n' %s > %s)" % (
+                        shlex.quote(repositories_json), shlex.quote(self.helm_repository_config)),
+                        secret=any('password' in repository for repository in repositories), idempotent=True)]
+        for repo_name, index_path in sorted(cached_repo_indexes.items()):
+            commands.append(Command(['cp', index_path, '%s/%s-index.yaml' % (self.helm_repository_cache, repo_name)],
+                                    idempotent=True))
+        return commands, cached_repo_indexes
+
     def _build_helm_promotion_commands(self):
-        lines = ['cd {} && helm dep update'.format(CHART_DIR)]
+        lines = self._in_phase('dependencies', self._build_helm_promotion_dependency_commands())
 
         if self.release_name is None:
             raise Exception('Must set RELEASE_NAME in the environment (desired Helm release name)')
 
-        helm_promote_cmd = 'helm upgrade %s %s --install ' % (self.release_name, self.chart_ref)
+        helm_promote_cmd = Command(['helm', 'upgrade', self.release_name, self.chart_ref, '--install'], network=True,
+                                   idempotent=True, dry_run=self.dry_run, phase='upgrade')
         if self.tiller_namespace is not None:
-            helm_promote_cmd += '--tiller-namespace %s ' % self.tiller_namespace
+            helm_promote_cmd.add('--tiller-namespace', self.tiller_namespace)
         if self.namespace is not None:
-            helm_promote_cmd += '--namespace %s ' % self.namespace
+            helm_promote_cmd.add('--namespace', self.namespace)
         for custom_valuesfile in self.custom_valuesfiles:
-            helm_promote_cmd += '--values %s ' % custom_valuesfile
-        for cli_set_key, val in sorted(self.custom_values.items()):
-            helm_promote_cmd += '--set %s=%s ' % (cli_set_key, self._normalize_value_string(val))
-        for cli_set_key, val in sorted(self.string_values.items()):
-            helm_promote_cmd += '--set-string %s=%s ' % (cli_set_key, val)
+            helm_promote_cmd.add('--values', custom_valuesfile)
+        helm_promote_cmd.add(*self._build_set_values_args(self.custom_values, self.string_values))
         if self.recreate_pods:
-            helm_promote_cmd += '--recreate-pods '
+            helm_promote_cmd.add('--recreate-pods')
         if self.cmd_ps is not None:
-            helm_promote_cmd += self.cmd_ps
-        if self.dry_run:
-            helm_promote_cmd = 'echo ' + helm_promote_cmd
+            helm_promote_cmd.add(ShellWord(self.cmd_ps))
         lines.append(helm_promote_cmd)
 
         return lines
 
+    def _build_helm_promotion_dependency_commands(self):
+        if self.chart_digest is None:
+            lines = [ShellScript('cd {} && helm dep update{}'.format(CHART_DIR, self._skip_refresh_arg()), network=True,
+                                 idempotent=True)]
+        else:
+            # Dependencies last updated for the very same chart content are still in place, unless their archives
+            # were removed from the charts/ directory since
+            try:
+                with open(CHART_DEPENDENCIES_DIGEST_FILE) as f:
+                    if f.read().strip() == self.chart_digest and self._dependency_archives_present(CHART_DIR):
+                        return [Command(['echo', 'Chart {} is unchanged, skipping dependency update'.format(CHART_DIR)])]
+            except OSError:
+                pass
+            lines = [ShellScript('cd {} && helm dep update{} && echo {} > {}'.format(
+                CHART_DIR, self._skip_refresh_arg(), self.chart_digest, CHART_DEPENDENCIES_DIGEST_FILE), network=True,
+                idempotent=True)]
+
+        key = self._dependency_cache_key(CHART_DIR)
+        if key is None:
+            return lines
+        dependency_cache = DependencyCache(self.cache_dir)
+        if self._dependency_cache_contains(dependency_cache, key):
+            return [Command(['echo', 'Restoring cached dependencies of {}'.format(CHART_DIR)]),
+                    ShellScript(dependency_cache.restore_command(key, CHART_DIR), idempotent=True)]
+        return lines + [ShellScript(dependency_cache.store_command(key, CHART_DIR), idempotent=True)]
+
+    @staticmethod
+    def _dependency_archives_present(chart_dir):
+        archives = ChartDependencies.locked_archives(chart_dir)
+        if archives is None:
+            # Helm writes a lock file for any chart with dependencies
+            return not ChartDependencies.repositories(chart_dir)
+        return all(os.path.isfile(os.path.join(chart_dir, 'charts', archive)) for archive in archives)
+
+    def _dependency_cache_contains(self, dependency_cache, key):
+        with self.tracer.span('dependency cache lookup') as span:
+            hit = dependency_cache.contains(key)
+            span.set_attribute('cfstep.cache.hit', hit)
+        return hit
+
+    def _fetch_repo_index(self, repo_url, username, password):
+        repo_index_cache = RepoIndexCache(self.cache_dir, self.repo_index_cache_size)
+        with self.tracer.span('fetch repo index', {'url.full': RepoIndexCache.normalize_url(repo_url)},
+                              SPAN_KIND_CLIENT) as span:
+            index_path = repo_index_cache.fetch(repo_url, username, password, self.http_pool.open)
+            span.set_attribute('cfstep.cache.hit', repo_index_cache.hit)
+        return index_path
+
+    def _dependency_cache_key(self, chart_dir):
+        if self.cache_dir is None or self.dry_run or not os.path.isdir(chart_dir):
+            return None
+        repo_urls = list(self.helm_repos.values())
+        if self.chart_repo_url is not None:
+            repo_urls.append(self.chart_repo_url)
+        return DependencyCache.key(chart_dir, repo_urls)
+
     def _build_helm_install_commands(self):
         lines = []
 
-        if self.release_name is None:
+        if self.release_name is None and self.release_targets is None:
             raise Exception('Must set RELEASE_NAME in the environment (desired Helm release name)')
 
         # Only build dependencies if CHART_REPO_URL is not specified. Skip for helm3
         if self.chart_repo_url is None and not self._helm_3():
-            helm_dep_build_cmd = 'helm dependency build %s' % self.chart_ref
-            if self.dry_run:
-                helm_dep_build_cmd = 'echo ' + helm_dep_build_cmd
-            lines.append(helm_dep_build_cmd)
+            lines += self._in_phase('dependencies', self._build_helm_dependency_build_commands())
 
         chart_path = self.chart_ref
 
-        if self.commit_message is not None and self.helm_command_builder.need_pull(self.chart_ref, self.chart_name,
-                                                                                   self.chart_repo_url,
-                                                                                   self.chart_version):
+        # A chart deployed to several targets is pulled once and shared by all of them
+        pull_chart = self.commit_message is not None or self.release_targets is not None
+        upgrade_from_repo = True
+        chart_artifact = self._build_chart_artifact_commands()
+        if chart_artifact is not None:
+            upgrade_from_repo = False
+            chart_path, artifact_lines = chart_artifact
+            lines += self._in_phase('pull', artifact_lines)
+            if self.commit_message is not None:
+                # The commit message is written into the chart, so work on an extracted copy of the stored one
+                lines.append(Command(['mkdir', '-p', DOWNLOAD_CHART_DIR], idempotent=True, phase='pull'))
+                lines.append(Command(['tar', '-xzf', chart_path, '-C', DOWNLOAD_CHART_DIR], idempotent=True,
+                                     phase='pull'))
+                chart_path = "{}/{}".format(DOWNLOAD_CHART_DIR, self.chart_ref.split("/")[-1])
+        elif pull_chart and self.helm_command_builder.need_pull(self.chart_ref, self.chart_name, self.chart_repo_url,
+                                                                self.chart_version):
+            upgrade_from_repo = False
             chart_path = "{}/{}".format(DOWNLOAD_CHART_DIR, self.chart_ref.split("/")[-1])
-            pull_args = ' {} --untar --untardir {} '.format(self.chart_ref, DOWNLOAD_CHART_DIR)
-            helm_pull_cmd = self.helm_command_builder.build_pull_command() + pull_args
-            if self.chart_repo_url is not None:
-                if self.credentials_in_arguments and (
-                        self.chart_repo_url.startswith('http://') or self.chart_repo_url.startswith('https://')) and (
-                        self.helm_repo_username is not None) and (self.helm_repo_password is not None):
-                    helm_pull_cmd += '--repo %s --username %s --password %s ' % (
-                    self.chart_repo_url, self.helm_repo_username, self.helm_repo_password)
-                else:
-                    helm_pull_cmd += '--repo %s ' % self.chart_repo_url
-            if self.chart_version is not None:
-                helm_pull_cmd += '--version %s ' % self.chart_version
-            if self.dry_run:
-                helm_pull_cmd = 'echo ' + helm_pull_cmd
+            helm_pull_cmd = self._build_helm_pull_command([self._repo_chart_ref(self.chart_ref), '--untar', '--untardir', DOWNLOAD_CHART_DIR])
+            helm_pull_cmd.dry_run = self.dry_run
+            helm_pull_cmd.phase = 'pull'
             lines.append(helm_pull_cmd)
 
         if self.commit_message is not None:
-            lines.extend(CommitMessageResolver.get_command(chart_path + '/templates/NOTES.txt', self.commit_message))
-
-        helm_upgrade_cmd = self.helm_command_builder.build_helm_upgrade_command(self.release_name, chart_path)
-
-        if not self.helm_command_builder.need_pull(self.chart_ref, self.chart_name, self.chart_repo_url,
-                                                   self.chart_version) or self.commit_message is None:
-            if self.chart_repo_url is not None:
-                if self.credentials_in_arguments and (
-                        self.chart_repo_url.startswith('http://') or self.chart_repo_url.startswith('https://')) and (
-                        self.helm_repo_username is not None) and (self.helm_repo_password is not None):
-                    helm_upgrade_cmd += '--repo %s --username %s --password %s ' % (
-                    self.chart_repo_url, self.helm_repo_username, self.helm_repo_password)
-                else:
-                    helm_upgrade_cmd += '--repo %s ' % self.chart_repo_url
+            lines += self._in_phase('commit-message', [
+                CommitMessageResolver.get_command(chart_path + '/templates/NOTES.txt', self.commit_message)])
+
+        if self.release_targets is not None:
+            return lines + self._in_phase('upgrade', self._build_release_targets_commands(chart_path, upgrade_from_repo))
+
+        lines += self._in_phase('upgrade', [self._build_helm_upgrade_command(self.release_name, chart_path,
+                                                                             upgrade_from_repo, self.namespace)])
+        return lines
+
+    def _build_helm_dependency_build_commands(self):
+        helm_dep_build_cmd = Command(['helm', 'dependency', 'build', self.chart_ref], network=True, idempotent=True,
+                                     dry_run=self.dry_run)
+        key = self._dependency_cache_key(self.chart_ref)
+        if key is None:
+            return [helm_dep_build_cmd]
+        dependency_cache = DependencyCache(self.cache_dir)
+        if self._dependency_cache_contains(dependency_cache, key):
+            return [ShellScript(dependency_cache.restore_command(key, self.chart_ref), idempotent=True)]
+        return [helm_dep_build_cmd, ShellScript(dependency_cache.store_command(key, self.chart_ref), idempotent=True)]
+
+    def _build_helm_pull_command(self, pull_args):
+        helm_pull_cmd = self.helm_command_builder.build_pull_command().add(*pull_args)
+        self._add_chart_repo_args(helm_pull_cmd)
+        if self.chart_version is not None:
+            helm_pull_cmd.add('--version', self.chart_version)
+        return helm_pull_cmd
+
+    def _cached_chart_repo_name(self):
+        """
+        Name of the repo registered from the repo index cache that CHART_REPO_URL points to, if any.
+        """
+        for repo_name in sorted(self.cached_repo_indexes):
+            if self.helm_repos.get(repo_name) == self.chart_repo_url:
+                return repo_name
+        return None
+
+    def _repo_chart_ref(self, chart_ref):
+        # Helm downloads the index of a --repo on every command, a registered repo is resolved with its cached index
+        cached_chart_repo_name = self._cached_chart_repo_name()
+        if cached_chart_repo_name is None:
+            return chart_ref
+        return '%s/%s' % (cached_chart_repo_name, chart_ref)
+
+    def _add_chart_repo_args(self, command):
+        if self.chart_repo_url is None or self._cached_chart_repo_name() is not None:
+            return
+        command.secret = command.secret or '@' in self.chart_repo_url
+        if self.credentials_in_arguments and (
+                self.chart_repo_url.startswith('http://') or self.chart_repo_url.startswith('https://')) and (
+                self.helm_repo_username is not None) and (self.helm_repo_password is not None):
+            command.add('--repo', self.chart_repo_url, '--username', self.helm_repo_username,
+                        '--password', self.helm_repo_password)
+            command.secret = True
+        else:
+            command.add('--repo', self.chart_repo_url)
+
+    def _build_chart_artifact_commands(self):
+        """
+        Return the path of the chart archive in the chart artifact store together with the lines pulling it there
+        when it is not stored yet, or None if the chart can't be taken from the store (no cache directory, no
+        explicit chart version, or no digest for it in the repo index).
+        """
+        if self.cache_dir is None or self.dry_run or self.chart_version is None or self.chart_repo_url is None:
+            return None
+        if not (self.chart_repo_url.startswith('http://') or self.chart_repo_url.startswith('https://')):
+            return None
+
+        helm_repo_username = helm_repo_password = None
+        if self.credentials_in_arguments:
+            helm_repo_username, helm_repo_password = self.helm_repo_username, self.helm_repo_password
+        cached_chart_repo_name = self._cached_chart_repo_name()
+        if cached_chart_repo_name is not None:
+            # Just revalidated when registering the repo
+            index_path = self.cached_repo_indexes[cached_chart_repo_name]
+        else:
+            index_path = self._fetch_repo_index(self.chart_repo_url, helm_repo_username, helm_repo_password)
+        if index_path is None:
+            return None
+        name = self.chart_ref.split('/')[-1]
+        entry = RepoIndex.find(index_path, name, self.chart_version)
+        if entry is None or not entry.get('digest'):
+            sys.stderr.write('No digest of chart %s %s in the index of %s, not using the chart artifact store\n' % (
+                name, self.chart_version, self.chart_repo_url))
+            return None
+
+        chart_artifact_store = ChartArtifactStore(self.cache_dir)
+        key = ChartArtifactStore.key(self.chart_repo_url, name, self.chart_version, entry['digest'])
+        artifact_path = chart_artifact_store.artifact_path(key, name, self.chart_version)
+        with self.tracer.span('chart artifact store lookup') as span:
+            stored = chart_artifact_store.contains(key, name, self.chart_version)
+            span.set_attribute('cfstep.cache.hit', stored)
+        if stored:
+            return artifact_path, [Command(['echo', 'Using stored chart {}'.format(artifact_path)])]
+        pull_command = self._build_helm_pull_command([self._repo_chart_ref(self.chart_ref), '--destination', ShellWord(PULL_DIR)])
+        return artifact_path, [ShellScript(chart_artifact_store.fetch_command(
+            key, name, self.chart_version, entry['digest'], ShellRenderer.render_command(pull_command)),
+            secret=pull_command.secret, network=True, idempotent=True)]
+
+    def _build_release_targets_commands(self, chart_path, upgrade_from_repo):
+        jobs = []
+        for target in self.release_targets:
+            namespace = shell_word(target.get('namespace', self.namespace))
+            kube_context = shell_word(target.get('context'))
+            valuesfiles = [ShellWord(valuesfile) for valuesfile in target.get('values', [])]
+            values = self._flatten_set_values(target.get('set', {}))
+            helm_upgrade_cmd = self._build_helm_upgrade_command(shell_word(target['release']), chart_path,
+                                                                upgrade_from_repo, namespace, kube_context,
+                                                                valuesfiles, values, target.get('setString', {}))
+            name = target['release']
+            if namespace is not None:
+                name += '@' + namespace
+            if kube_context is not None:
+                name += '@' + kube_context
+            jobs.append((name, helm_upgrade_cmd))
+        return [ParallelCommands(jobs, self.release_targets_parallelism, 'deploy releases', summary=True)]
+
+    @staticmethod
+    def _flatten_set_values(values, prefix=''):
+        """
+        Turn the JSON "set" overrides of a release target into --set assignments: maps nest as dotted keys, lists of
+        scalars become "{a,b}" lists and other lists are set item by item ("name[0].key"). Scalars may be given as
+        JSON numbers, booleans or null, Helm parses them back from their JSON form.
+        """
+        assignments = {}
+        for key, val in values.items():
+            # Keys of "set" itself may already be dotted paths, nested keys are taken literally
+            if prefix and any(char in key for char in '.=,[]\\'):
+                raise Exception('Key "%s" of %s in RELEASE_TARGETS can\'t be passed to --set' % (key, prefix[:-1]))
+            key = prefix + key
+            if isinstance(val, dict) and val:
+                assignments.update(EntrypointScriptBuilder._flatten_set_values(val, key + '.'))
+            elif isinstance(val, list) and val and not any(isinstance(item, (dict, list)) for item in val):
+                items = [item if isinstance(item, str) else json.dumps(item) for item in val]
+                if any(char in item for item in items for char in ',{}\\'):
+                    raise Exception('Items of the list %s in RELEASE_TARGETS can\'t contain ",", "{", "}" or "\\"'
+                                    % key)
+                assignments[key] = '{%s}' % ','.join(items)
+            elif isinstance(val, list) and val:
+                assignments.update(EntrypointScriptBuilder._flatten_set_values(
+                    dict(('%s[%d]' % (key, index), item) for index, item in enumerate(val))))
+            elif isinstance(val, (dict, list)):
+                raise Exception('Empty %s in RELEASE_TARGETS can\'t be passed to --set' % key)
+            else:
+                assignments[key] = val if isinstance(val, str) else json.dumps(val)
+        return assignments
+
+    def _build_helm_upgrade_command(self, release_name, chart_path, upgrade_from_repo, namespace, kube_context=None,
+                                    valuesfiles=(), values=None, string_values=None):
+        if upgrade_from_repo:
+            chart_path = self._repo_chart_ref(chart_path)
+        helm_upgrade_cmd = self.helm_command_builder.build_helm_upgrade_command(release_name, chart_path)
+
+        if upgrade_from_repo:
+            self._add_chart_repo_args(helm_upgrade_cmd)
             if self.chart_version is not None:
-                helm_upgrade_cmd += '--version %s ' % self.chart_version
+                helm_upgrade_cmd.add('--version', self.chart_version)
+
+        custom_values = dict(self.custom_values)
+        custom_values.update(values or {})
+        set_string_values = dict(self.string_values)
+        set_string_values.update(string_values or {})
 
         if self.tiller_namespace is not None:
-            helm_upgrade_cmd += '--tiller-namespace %s ' % self.tiller_namespace
-        if self.namespace is not None:
-            helm_upgrade_cmd += '--namespace %s ' % self.namespace
-        for custom_valuesfile in self.custom_valuesfiles:
-            helm_upgrade_cmd += '--values %s ' % custom_valuesfile
-        for cli_set_key, val in sorted(self.custom_values.items()):
-            helm_upgrade_cmd += '--set %s=%s ' % (cli_set_key, self._normalize_value_string(val))
-        for cli_set_key, val in sorted(self.string_values.items()):
-            helm_upgrade_cmd += '--set-string %s=%s ' % (cli_set_key, val)
+            helm_upgrade_cmd.add('--tiller-namespace', self.tiller_namespace)
+        if namespace is not None:
+            helm_upgrade_cmd.add('--namespace', namespace)
+        if kube_context is not None:
+            helm_upgrade_cmd.add('--kube-context', kube_context)
+        for custom_valuesfile in list(self.custom_valuesfiles) + list(valuesfiles):
+            helm_upgrade_cmd.add('--values', custom_valuesfile)
+        set_values_args = self._build_set_values_args(custom_values, set_string_values)
+        helm_upgrade_cmd.add(*set_values_args)
         if self.recreate_pods:
-            helm_upgrade_cmd += '--recreate-pods '
+            helm_upgrade_cmd.add('--recreate-pods')
         if self.wait.upper() == 'TRUE':
-            helm_upgrade_cmd += '--wait '
+            helm_upgrade_cmd.add('--wait')
         if self.timeout is not None:
-            helm_upgrade_cmd += '--timeout %s ' % self.timeout
+            helm_upgrade_cmd.add('--timeout', self.timeout)
+        if self.history_max is not None:
+            helm_upgrade_cmd.add(*self.helm_command_builder.build_history_max_args(self.history_max))
         if self.cmd_ps is not None:
-            helm_upgrade_cmd += self.cmd_ps
+            helm_upgrade_cmd.add(ShellWord(self.cmd_ps))
         if self.set_file is not None:
-            helm_upgrade_cmd += '--set-file %s ' % self.set_file
-        if self.dry_run:
-            helm_upgrade_cmd = 'echo ' + helm_upgrade_cmd
-        lines.append(helm_upgrade_cmd)
-
-        return lines
+            helm_upgrade_cmd.add('--set-file', self.set_file)
+        helm_upgrade_cmd.dry_run = self.dry_run
+
+        if self.skip_unchanged_upgrade and self.cache_dir is not None and self._helm_3() and not self.dry_run and \
+                not self.recreate_pods:
+            helm_template_cmd = Command(['helm', 'template', release_name, chart_path])
+            if upgrade_from_repo:
+                self._add_chart_repo_args(helm_template_cmd)
+                if self.chart_version is not None:
+                    helm_template_cmd.add('--version', self.chart_version)
+            helm_history_cmd = Command(['helm', 'history', release_name, '--max', '1', '--output', 'json'])
+            for command in [helm_template_cmd, helm_history_cmd]:
+                if namespace is not None:
+                    command.add('--namespace', namespace)
+                if kube_context is not None:
+                    command.add('--kube-context', kube_context)
+            for custom_valuesfile in list(self.custom_valuesfiles) + list(valuesfiles):
+                helm_template_cmd.add('--values', custom_valuesfile)
+            helm_template_cmd.add(*set_values_args)
+            if self.set_file is not None:
+                helm_template_cmd.add('--set-file', self.set_file)
+            release_digest_store = ReleaseDigestStore(self.cache_dir)
+            key = ReleaseDigestStore.key(kube_context or self.kube_context, namespace, release_name)
+            return ShellScript(release_digest_store.upgrade_command(
+                key, release_name, ShellRenderer.render_command(helm_template_cmd),
+                ShellRenderer.render_command(helm_history_cmd), ShellRenderer.render_command(helm_upgrade_cmd),
+                [ShellRenderer.quote(arg) for arg in helm_upgrade_cmd.argv]),
+                secret=helm_upgrade_cmd.secret, network=True, idempotent=True, parallel_safe=True)
+        return helm_upgrade_cmd
+
+    def _build_helm_prune_command(self):
+        if self.release_name is None:
+            raise Exception('Must set RELEASE_NAME in the environment (Helm release to prune the history of)')
+        history_max = self.history_max or '10'
+        if int(history_max) < 1:
+            raise Exception('HISTORY_MAX must be a positive number of revisions to keep')
+        # The revisions are still listed in a dry run, only their deletion is printed
+        return self.helm_command_builder.build_prune_history_command(
+            self.release_name, self.namespace, self.tiller_namespace, history_max, bool(self.dry_run))
 
     def _build_helm_push_commands(self):
-        lines = []
-
-        if self.chart_repo_url is None:
-            raise Exception(
-                'Must set CHART_REPO_URL in the environment, otherwise attach a Helm Repo context (prefixed with CF_CTX_)')
-
-        if self.credentials_in_arguments and (self.helm_repo_username is not None) and (
-                self.helm_repo_password is not None):
-            helm_repo_add_cmd = 'helm repo add remote %s --username %s --password %s ' % (
-            self.chart_repo_url, self.helm_repo_username, self.helm_repo_password)
-        else:
-            helm_repo_add_cmd = 'helm repo add remote %s' % self.chart_repo_url
-        if self.dry_run:
-            helm_repo_add_cmd = 'echo ' + helm_repo_add_cmd
-        lines.append(helm_repo_add_cmd)
-
-        helm_dep_build_cmd = 'helm dependency build {} || ' \
-                             'helm dependency update {} || ' \
-                             'echo "dependencies cannot be updated"'.format(self.chart_ref, self.chart_ref)
-        if not self._helm_3() and self.dry_run:
-            helm_dep_build_cmd = 'echo ' + helm_dep_build_cmd
-        lines.append(helm_dep_build_cmd)
+        lines = [self._build_helm_repo_add_remote_command()]
+        lines += self._build_helm_push_dependency_commands(self.chart_ref)
 
-        if self.dry_run:
+        if self.python_packager and not self.dry_run:
+            options = ['--export']
+            if self.chart_version is not None:
+                options += ['--version', self.chart_version]
+            if self.app_version is not None:
+                options += ['--app-version', self.app_version]
+            package_chart_cmd = self._build_package_chart_command(self.chart_ref, '/tmp', options)
+            # Fail on a failed packaging, which "eval" on its own would ignore
+            lines.append(ShellScript(['cf_package=$(%s)' % ShellRenderer.render_command(package_chart_cmd),
+                                      'eval "$cf_package"'], phase='package'))
+            package_var = None
+        elif self.dry_run:
             package_var = 'dryrun-0.0.1.tgz'
         else:
             package_var = '$(helm package %s ' % self.chart_ref
@@ -497,37 +851,189 @@ class EntrypointScriptBuilder(object):
             if self.app_version is not None:
                 package_var += '--app-version ' + self.app_version + ' '
             package_var += '--destination /tmp | cut -d " " -f 8)'
-        lines.append('PACKAGE="%s"' % package_var)
+        if package_var is not None:
+            lines.append(ShellScript('PACKAGE="%s"' % package_var, phase='package'))
+
+        helm_push_command = self._build_helm_push_command()
+        if self._check_published_charts():
+            helm_push_command = ShellScript(self._build_push_unless_published_lines(helm_push_command),
+                                            secret=helm_push_command.secret, network=True, phase='push')
+        lines.append(helm_push_command)
+        return lines
+
+    def _build_helm_push_charts_commands(self):
+        """
+        Push every chart found under CHARTS_ROOT: the charts are packaged in parallel, level by level in the order of
+        their file:// dependencies, then uploaded concurrently, with a report of the result of every chart.
+        """
+        chart_dirs = ChartDiscovery.discover(self.charts_root)
+        if not chart_dirs:
+            raise Exception('No chart found under CHARTS_ROOT %s' % self.charts_root)
+        lines = [self._build_helm_repo_add_remote_command()]
+
+        packages = []
+        for level in ChartDiscovery.levels(chart_dirs):
+            jobs = []
+            for chart_dir in level:
+                metadata = ChartDiscovery.metadata(chart_dir)
+                name = '%s-%s' % (metadata.get('name'), metadata.get('version'))
+                package_lines = []
+                for command in self._build_helm_push_dependency_commands(chart_dir):
+                    package_lines += ShellRenderer.render_lines(command)
+                if self.python_packager:
+                    package_lines.append(ShellRenderer.render_command(
+                        self._build_package_chart_command(chart_dir, PACKAGES_DIR)))
+                else:
+                    package_lines.append(ShellRenderer.render_command(Command(
+                        ['helm', 'package', chart_dir, '--destination', PACKAGES_DIR])))
+                jobs.append((name, ShellScript(package_lines, network=True, idempotent=True, dry_run=self.dry_run)))
+                packages.append((name, os.path.join(PACKAGES_DIR, name + '.tgz')))
+            lines.append(ParallelCommands(jobs, self.charts_parallelism, 'package charts', phase='package'))
+
+        if self.python_uploader and self.cmd_ps is None and self.azure_helm_token is None and \
+                not self._check_published_charts() and re.match('^(http|https):\/\/', self.chart_repo_url):
+            # A single uploader sends all the packages concurrently over its pool of connections
+            helm_push_command = self._build_chart_upload_command([package for _, package in packages])
+            helm_push_command.network = True
+            helm_push_command.dry_run = self.dry_run
+            helm_push_command.phase = 'push'
+            lines.append(helm_push_command)
+            return lines
+
+        helm_push_command = self._build_helm_push_command()
+        push_lines = [ShellRenderer.render_command(helm_push_command)]
+        if self._check_published_charts():
+            push_lines = self._build_push_unless_published_lines(helm_push_command)
+        jobs = [(name, ShellScript(['PACKAGE=%s' % shlex.quote(package)] + push_lines,
+                                   secret=helm_push_command.secret, network=True)) for name, package in packages]
+        lines.append(ParallelCommands(jobs, self.charts_parallelism, 'push charts', summary=True, phase='push'))
+        return lines
+
+    def _build_package_chart_command(self, chart_dir, destination, options=()):
+        package_chart_cmd = Command([PACKAGE_CHART, '--destination', destination], idempotent=True, phase='package')
+        if self.cache_dir is not None:
+            package_chart_cmd.add('--cache-dir', self.cache_dir)
+        return package_chart_cmd.add(*options).add(chart_dir)
+
+    def _check_published_charts(self):
+        if self.skip_published_charts and not self.python_packager:
+            # "helm package" gives a new digest on every run, so a published version would never match its package
+            raise Exception('SKIP_PUBLISHED_CHARTS requires the reproducible packages of CFSTEP_PACKAGER=python')
+        return self.skip_published_charts and not self.dry_run
+
+    def _build_push_unless_published_lines(self, helm_push_command):
+        """
+        Return bash lines running `helm_push_command` unless the package at $PACKAGE is already published, according
+        to the index of the remote repo downloaded by "helm repo add".
+        """
+        if self._helm_3():
+            index_path = os.path.join(self.helm_repository_cache, 'remote-index.yaml')
+        else:
+            index_path = ShellWord('"$(helm home)/repository/cache/remote-index.yaml"')
+        check_command = Command([CHECK_CHART_PUBLISHED, ShellWord('"$PACKAGE"'), index_path])
+        return ChartPackage.push_unless_published_command(ShellRenderer.render_command(check_command),
+                                                          ShellRenderer.render_command(helm_push_command))
 
-        if self.azure_helm_token is not None:
+    def _build_helm_repo_add_remote_command(self):
+        if self.chart_repo_url is None:
+            raise Exception(
+                'Must set CHART_REPO_URL in the environment, otherwise attach a Helm Repo context (prefixed with CF_CTX_)')
+
+        helm_repo_add_cmd = Command(['helm', 'repo', 'add', 'remote', self.chart_repo_url],
+                                    secret='@' in self.chart_repo_url, network=True, idempotent=True,
+                                    dry_run=self.dry_run, phase='repo-add')
+        if self.credentials_in_arguments and (self.helm_repo_username is not None) and (
+                self.helm_repo_password is not None):
+            helm_repo_add_cmd.add('--username', self.helm_repo_username, '--password', self.helm_repo_password)
+            helm_repo_add_cmd.secret = True
+        return helm_repo_add_cmd
+
+    def _build_helm_push_dependency_commands(self, chart_dir):
+        skip_refresh = self._skip_refresh_arg()
+        helm_dep_build_cmd = ShellScript('helm dependency build {chart}{skip_refresh} || '
+                                         'helm dependency update {chart}{skip_refresh} || '
+                                         'echo "dependencies cannot be updated"'.format(chart=chart_dir,
+                                                                                        skip_refresh=skip_refresh),
+                                         network=True, idempotent=True,
+                                         dry_run=not self._helm_3() and self.dry_run, phase='dependencies')
+        key = self._dependency_cache_key(chart_dir)
+        dependency_cache = DependencyCache(self.cache_dir) if key is not None else None
+        if key is None:
+            return [helm_dep_build_cmd]
+        elif self._dependency_cache_contains(dependency_cache, key):
+            return [ShellScript(dependency_cache.restore_command(key, chart_dir), idempotent=True,
+                                phase='dependencies')]
+        else:
+            # Only cache dependencies that were actually resolved
+            return [ShellScript('if helm dependency build {chart}{skip_refresh} || '
+                                'helm dependency update {chart}{skip_refresh}; then {store}; '
+                                'else echo "dependencies cannot be updated"; fi'.format(
+                chart=chart_dir, skip_refresh=skip_refresh, store=dependency_cache.store_command(key, chart_dir)),
+                network=True,
+                idempotent=True, phase='dependencies')]
+
+    def _skip_refresh_arg(self):
+        # The indexes of the repos were just revalidated through the repo index cache, don't download them again
+        return ' --skip-refresh' if self.cached_repo_indexes else ''
+
+    def _build_helm_push_command(self):
+        """
+        Return the command uploading the package at $PACKAGE to CHART_REPO_URL.
+        """
+        package = ShellWord('$PACKAGE')
+        # CMD_PS holds extra curl arguments for these repos
+        python_uploader = self.python_uploader and self.cmd_ps is None
+        if self.azure_helm_token is not None and python_uploader:
+            helm_push_command = Command([PUSH_CHART, '--method', 'PUT', '--method', 'PATCH', ShellWord('"$PACKAGE"'),
+                                         self.chart_repo_url + '_blobs/'], secret=True, idempotent=True)
+        elif self.azure_helm_token is not None:
             helm_push_command = 'curl --fail -X PUT --data-binary "@${PACKAGE}" ' + self.chart_repo_url + '_blobs/$(basename $PACKAGE)' + ' || curl --fail -X PATCH --data-binary "@${PACKAGE}" ' + self.chart_repo_url + '_blobs/$(basename $PACKAGE)'
         elif self.chart_repo_url.startswith('cm://'):
-            helm_push_command = 'helm push $PACKAGE remote'
+            helm_push_command = Command(['helm', 'push', package, 'remote'])
         elif self.chart_repo_url.startswith('s3://'):
-            helm_push_command = 'helm s3 push $PACKAGE remote'
+            helm_push_command = Command(['helm', 's3', 'push', package, 'remote'])
         elif self.chart_repo_url.startswith('gs://'):
-            helm_push_command = 'helm gcs push $PACKAGE remote'
+            helm_push_command = Command(['helm', 'gcs', 'push', package, 'remote'])
         elif re.match('^(http|https):\/\/', self.chart_repo_url):
             print("CHART_REPO_URL protocol is http/https")
-            helm_push_command = self.handle_non_plugin_repos()
+            if python_uploader:
+                helm_push_command = self._build_chart_upload_command()
+            else:
+                helm_push_command = self.handle_non_plugin_repos()
         else:
             raise Exception('Unsupported protocol in CHART_REPO_URL')
 
+        if isinstance(helm_push_command, str):
+            helm_push_command = ShellScript(helm_push_command, secret=self.azure_helm_token is not None)
         if self.cmd_ps is not None:
-            helm_push_command += ' ' + self.cmd_ps
-
-        if self.dry_run:
-            helm_push_command = 'echo ' + helm_push_command
-
-        lines.append(helm_push_command)
-
-        return lines
+            if isinstance(helm_push_command, ShellScript):
+                helm_push_command.lines[-1] += ' ' + self.cmd_ps
+            else:
+                helm_push_command.add(ShellWord(self.cmd_ps))
+        helm_push_command.network = True
+        helm_push_command.dry_run = self.dry_run
+        helm_push_command.phase = 'push'
+
+        return helm_push_command
+
+    def _build_chart_upload_command(self, packages=None):
+        """
+        Upload the package at $PACKAGE, or the `packages`, to an Artifactory repo with push_chart, which validates
+        the credentials of the repo unless SKIP_REPO_CREDENTIALS_VALIDATION is set, on the connections used for the
+        upload.
+        """
+        upload_url = self.chart_repo_url
+        if self.chart_subdir is not None:
+            upload_url += self.chart_subdir if self.chart_subdir.endswith('/') else self.chart_subdir + '/'
+        command = Command([PUSH_CHART], secret='@' in self.chart_repo_url, idempotent=True)
+        if self.skip_repo_credentials_validation.upper() != 'TRUE':
+            command.add('--validate-artifactory', self._get_normalized_chart_repo_url())
+        if packages is None:
+            return command.add(ShellWord('"$PACKAGE"'), upload_url)
+        return command.add('--concurrency', str(self.charts_parallelism), *packages).add(upload_url)
 
     def _get_normalized_chart_repo_url(self):
-        normalized_repo_url = self.chart_repo_url
-        if normalized_repo_url and '@' in normalized_repo_url:
-            normalized_repo_url = normalized_repo_url.split('//')[0] + '//' + normalized_repo_url.split('@')[1]
-        return normalized_repo_url
+        return RepoIndexCache.normalize_url(self.chart_repo_url)
 
     def handle_non_plugin_repos(self):
         helm_push_command = 'curl -u $HELMREPO_USERNAME:$HELMREPO_PASSWORD -T $PACKAGE ' + self.chart_repo_url
@@ -541,15 +1047,37 @@ class EntrypointScriptBuilder(object):
         if self.skip_repo_credentials_validation.upper() == 'TRUE':
             return helm_push_command
 
+        detector = RepoTypeDetector(self.cache_dir, self.repo_type_cache_ttl)
+        key = RepoTypeDetector.key(normalized_repo_url, self.helm_repo_username)
+        repo_type = detector.cached_type(key)
+        if repo_type is not None:
+            print("\033[92mThe CHART_REPO_URL has been tested successfully (cached)\033[0m")
+        else:
+            repo_type = self._detect_repo_type(normalized_repo_url)
+            detector.store(key, repo_type)
+        print("\033[94mAn %s Helm repository has been recognized\033[0m" % RepoTypeDetector.name(repo_type))
+
+        if repo_type not in PUT_UPLOAD_REPO_TYPES:
+            raise Exception("\033[91mPushing charts to %s Helm repositories is not supported\033[0m" %
+                            RepoTypeDetector.name(repo_type))
+        return helm_push_command
+
+    def _detect_repo_type(self, normalized_repo_url):
+        """
+        Validate the credentials of the repo with a HEAD request to it and infer its type from the response headers.
+        The request goes through the shared pool of connections, like the uploads of push_chart.
+        """
         try:
-            request = urllib.request.Request(normalized_repo_url)
-            authB64 = base64.b64encode(('%s:%s' % (self.helm_repo_username, self.helm_repo_password)).encode()).decode()
-            request.add_header('Authorization', 'Basic %s' % authB64)
-            response = urllib.request.urlopen(request)
+            with self.tracer.span('HEAD repo', {'http.request.method': 'HEAD', 'url.full': normalized_repo_url},
+                                  SPAN_KIND_CLIENT):
+                response = RepoTypeDetector.probe(normalized_repo_url, self.helm_repo_username,
+                                                  self.helm_repo_password, self.http_pool.open)
         except urllib.error.URLError as err:
+            # The pool raises connection failures as URLError, without a status
+            code = getattr(err, 'code', None)
             print("\033[91mFailed to test your chart repository url, server responded with: %s %s \033[0m" % (
-            err.code, err.reason))
-            if err.code == 401:
+            code, err.reason))
+            if code == 401:
                 print("\033[91mPlease check the user name and password you specified for the Helm repository\033[0m")
             else:
                 print("\033[91mPlease make sure the repo URL is valid\033[0m")
@@ -562,24 +1090,11 @@ class EntrypointScriptBuilder(object):
         print("\033[92mThe CHART_REPO_URL has been tested successfully\033[0m")
         print("Trying to infer Helm repository type from the response headers...")
 
-        if self.is_artifactory_repo(response):
-            return helm_push_command
-        else:
+        repo_type = RepoTypeDetector.detect(response)
+        if repo_type is None:
+            print("\033[91mNot found Helm repository type headers\033[0m")
             raise Exception("\033[91mFailed to infer the Helm repository type\033[0m")
-
-    def is_artifactory_repo(self, repoResponse):
-        try:
-            headers = repoResponse.info()._headers
-            for h in headers:
-                if ("X-Artifactory-Id" in h) or ("Server" in h and "Artifactory" in h[1]) or \
-                        ("x-artifactory-id" in h) or ("server" in h and "artifactory" in h[1]):
-                    print("\033[94mAn Artifactory Helm repository has been recognized\033[0m")
-                    return True
-            print("\033[91mNot found Artifactory Helm repository headers\033[0m")
-        except Exception as e:
-            print('\033[91m%s\033[0m' % e)
-            return None
-        return False
+        return repo_type
 
     def _helm_3(self):
         return self.helm_version.startswith('3.')
@@ -590,23 +1105,109 @@ class EntrypointScriptBuilder(object):
         else:
             return Helm2CommandBuilder()
 
-    def _build_version_command(self):
-        build_command = 'helm version --short -c'
-        if self.dry_run:
-            build_command = 'echo ' + build_command
+    def _push_charts_root(self):
+        return self.action == 'push' and self.charts_root is not None
+
+    def _needs_stable_repo(self):
+        if self.action == 'prune':
+            return False
+        if self._push_charts_root():
+            return any(ChartDependencies.references_repo(chart_dir, STABLE_REPO_NAME, STABLE_REPO_URL)
+                       for chart_dir in ChartDiscovery.discover(self.charts_root))
+        # Keep registering the stable repo for the auth action, later steps may rely on it
+        if self.action == 'auth' or self.chart_ref is None:
+            return True
+        if self.chart_ref.split('/')[0] == STABLE_REPO_NAME:
+            return True
+        # Local chart (including one materialized from CHART_JSON), only dependency resolution may need the repo
+        if os.path.isdir(self.chart_ref):
+            return ChartDependencies.references_repo(self.chart_ref, STABLE_REPO_NAME, STABLE_REPO_URL)
+        # Packaged chart fetched from a remote repo, its dependencies are already bundled
+        if self.chart_repo_url is not None or self.helm_command_builder.need_pull(
+                self.chart_ref, self.chart_name, self.chart_repo_url, self.chart_version):
+            return False
+        return True
 
-        return [build_command]
+    def _build_version_command(self):
+        return [Command(['helm', 'version', '--short', '-c'], idempotent=True, dry_run=self.dry_run)]
+
+    def _build_set_values_args(self, values, string_values):
+        args = []
+        if self.set_values_as_file and (values or string_values):
+            # Integers of 7 digits or more only stay exact as --set flags, keep those overrides (and the
+            # --set-string overrides of the same keys, which must still win over them) out of the file
+            try:
+                exact_keys = set(key for key, val in values.items()
+                                 if SetValuesCompiler.has_exponent_form_integers(key, val))
+            except ValueError as e:
+                raise Exception('Invalid value override: %s' % e)
+            file_values = dict((key, val) for key, val in values.items() if key not in exact_keys)
+            file_string_values = dict((key, val) for key, val in string_values.items() if key not in exact_keys)
+            if file_values or file_string_values:
+                args += ['--values', self._set_values_file(file_values, file_string_values)]
+            values = dict((key, val) for key, val in values.items() if key in exact_keys)
+            string_values = dict((key, val) for key, val in string_values.items() if key in exact_keys)
+        # Values are passed on as shell words, the shell expands them as it always did
+        for cli_set_key, val in sorted(values.items()):
+            args += ['--set', ShellWord('%s=%s' % (cli_set_key, self._normalize_value_string(val)))]
+        for cli_set_key, val in sorted(string_values.items()):
+            args += ['--set-string', ShellWord('%s=%s' % (cli_set_key, val))]
+        return args
+
+    def _set_values_file(self, values, string_values):
+        """
+        Return the path of the values file of the --set / --set-string overrides, named after its content so that
+        release targets with distinct overrides get distinct files. The script writes it before the helm commands.
+        """
+        try:
+            content = SetValuesCompiler.compile(values, string_values)
+        except ValueError as e:
+            raise Exception('Invalid value override: %s' % e)
+        path = os.path.join(self.set_values_dir, 'cfstep-helm-set-values-%s.json' %
+                            hashlib.sha256(content.encode()).hexdigest()[:16])
+        self.set_values_files[path] = content
+        return path
+
+    def _build_set_values_file_commands(self):
+        """
+        Return the commands writing the values files of the overrides. They are written by the script, where they are
+        used, and not by a dry run, whose helm commands are only printed.
+        """
+        if not self.set_values_files or self.dry_run:
+            return []
+        lines = ['mkdir -p %s' % shlex.quote(self.set_values_dir)]
+        lines += ["printf '%%s\\n' %s > %s" % (shlex.quote(content), shlex.quote(path))
+                  for path, content in sorted(self.set_values_files.items())]
+        return [ShellScript(lines, idempotent=True)]
 
     def _normalize_value_string(self, val):
-        if ';' in val:
+        # Quote lists ("{a,b}") too, bash would brace-expand them into several words
+        if ';' in val or val.startswith('{'):
             val = '"' + val + '"'
         return val.replace(" ", "\\ ")
 
+    def build_commands(self):
+        commands = self._in_phase('setup', self.helm_command_builder.build_export_commands(
+            self.google_application_credentials_json))
+        commands += self._in_phase('kube-context', self._build_kubectl_commands())
+        commands += self._in_phase('helm-version', self._build_version_command())
+        commands += self._in_phase('repo-add', self.helm_command_builder.build_repo_commands(
+            self.skip_stable or not self._needs_stable_repo(), self.dry_run))
+        self.set_values_files = {}
+        helm_commands = self._build_helm_commands()
+        commands += self._in_phase('set-values', self._build_set_values_file_commands())
+        commands += helm_commands
+        return commands
+
+    @staticmethod
+    def _in_phase(phase, commands):
+        for command in commands:
+            if command.phase is None:
+                command.phase = phase
+        return commands
+
     def build(self):
-        lines = ['#!/bin/bash -e']
-        lines += self.helm_command_builder.build_export_commands(self.google_application_credentials_json)
-        lines += self._build_kubectl_commands()
-        lines += self._build_version_command()
-        lines += self.helm_command_builder.build_repo_commands(self.skip_stable, self.dry_run)
-        lines += self._build_helm_commands()
-        return '\n'.join(lines)
+        return ShellRenderer.render(self.build_commands(), self.timings_file, self.tracer)
+
+    def build_plan(self):
+        return PlanRenderer.render(self.build_commands())
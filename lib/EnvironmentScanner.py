@@ -0,0 +1,82 @@
+CONTEXT_PREFIX = 'CF_CTX_'
+CONTEXT_URL_SUFFIX = '_URL'
+CONTEXT_USERNAME_SUFFIX = '_HELMREPO_USERNAME'
+CONTEXT_PASSWORD_SUFFIX = '_HELMREPO_PASSWORD'
+
+
+class EnvironmentScanner(object):
+    """
+    Classify the prefixed variables the step is configured with in a single pass over the environment:
+
+    - values files (-f/--values) from vars prefixed with "CUSTOMFILE_" or "VALUESFILE_"
+    - value overrides (--set) from vars prefixed with "CUSTOM_" or "VALUE_"
+    - string value overrides (--set-string) from vars prefixed with "VALUESTRING_"
+    - attached Helm repo contexts from vars named "CF_CTX_<name>_URL", with their optional
+      "CF_CTX_<NAME>_HELMREPO_USERNAME" / "CF_CTX_<NAME>_HELMREPO_PASSWORD" credentials
+
+    Only the (small) buckets are sorted, by variable name, so the result is the same as walking the whole sorted
+    environment once per kind of variable.
+    """
+
+    def __init__(self, env):
+        self.env = env
+        valuesfiles = []
+        values = []
+        string_values = []
+        context_repo_names = []
+        self.context_usernames = {}
+        self.context_passwords = {}
+
+        for key, val in env.items():
+            first = key[:1]
+            if first in 'Cc':
+                key_upper = key.upper()
+                if key_upper.startswith('CUSTOMFILE_'):
+                    valuesfiles.append((key, val))
+                elif key_upper.startswith('CUSTOM_'):
+                    values.append((key, key[7:], val))
+                elif key.startswith(CONTEXT_PREFIX):
+                    if key.endswith(CONTEXT_URL_SUFFIX):
+                        context_repo_names.append(key[len(CONTEXT_PREFIX):-len(CONTEXT_URL_SUFFIX)])
+                    elif key.endswith(CONTEXT_USERNAME_SUFFIX):
+                        self.context_usernames[key[len(CONTEXT_PREFIX):-len(CONTEXT_USERNAME_SUFFIX)]] = val
+                    elif key.endswith(CONTEXT_PASSWORD_SUFFIX):
+                        self.context_passwords[key[len(CONTEXT_PREFIX):-len(CONTEXT_PASSWORD_SUFFIX)]] = val
+            elif first in 'Vv':
+                key_upper = key.upper()
+                if key_upper.startswith('VALUESFILE_'):
+                    valuesfiles.append((key, val))
+                elif key_upper.startswith('VALUESTRING_'):
+                    string_values.append((key, key[12:], val))
+                elif key_upper.startswith('VALUE_'):
+                    values.append((key, key[6:], val))
+
+        self.valuesfiles = [val for _, val in sorted(valuesfiles)]
+        self.values = self._to_cli_set_values(values)
+        self.string_values = self._to_cli_set_values(string_values)
+        # In the order of the variable names, which is not the order of the context names ("a2_URL" < "a_URL")
+        self.context_repo_names = sorted(context_repo_names, key=lambda name: name + CONTEXT_URL_SUFFIX)
+
+    @staticmethod
+    def _to_cli_set_values(values):
+        cli_set_values = {}
+        # Later variables win when several map to the same key, as when walking the sorted environment
+        for _, cli_set_key, val in sorted(values, key=lambda value: value[0]):
+            cli_set_key = cli_set_key.replace('_', '.')
+            cli_set_key = cli_set_key.replace('..', '_')
+            cli_set_values[cli_set_key] = val
+        return cli_set_values
+
+    def repo_credentials(self, context_name):
+        """
+        Same as EntrypointScriptBuilder._get_repo_credentials() for the scanned environment, without probing it.
+        """
+        name_upper = context_name.upper()
+        helm_repo_username = self.context_usernames.get(name_upper)
+        if helm_repo_username is None:
+            helm_repo_username = self.env.get('HELMREPO_USERNAME')
+        helm_repo_password = self.context_passwords.get(name_upper)
+        if helm_repo_password is None:
+            helm_repo_password = self.env.get('HELMREPO_PASSWORD')
+        return [self.env.get(CONTEXT_PREFIX + context_name + CONTEXT_URL_SUFFIX), helm_repo_username,
+                helm_repo_password]
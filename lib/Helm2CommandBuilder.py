@@ -1,4 +1,5 @@
 from lib.BaseCommandBuilder import BaseCommandBuilder
+from lib.Command import Command
 
 
 class Helm2CommandBuilder(BaseCommandBuilder):
@@ -7,10 +8,21 @@ class Helm2CommandBuilder(BaseCommandBuilder):
         return super().build_export_commands(google_application_credentials_json)
 
     def build_helm_upgrade_command(self, release_name, chart_ref):
-        return 'helm upgrade %s %s --install --reset-values ' % (release_name, chart_ref)
+        return Command(['helm', 'upgrade', release_name, chart_ref, '--install', '--reset-values'], network=True,
+                       idempotent=True, parallel_safe=True)
+
+    def build_history_max_args(self, history_max):
+        # Tiller bounds the history of every release itself (helm init --history-max)
+        return []
+
+    def build_prune_history_command(self, release_name, namespace, tiller_namespace, history_max, dry_run):
+        # Revisions are stored as config maps in the namespace of Tiller
+        return self._build_prune_history_command('configmaps', tiller_namespace or 'kube-system',
+                                                 'OWNER=TILLER,NAME=' + release_name, 'VERSION', 'STATUS', 'DEPLOYED',
+                                                 '%s.v' % release_name, release_name, history_max, dry_run)
 
     def build_repo_commands(self, skip_stable, dry_run):
         return []
 
     def build_pull_command(self):
-        return 'helm fetch'
\ No newline at end of file
+        return Command(['helm', 'fetch'], network=True, idempotent=True, parallel_safe=True)
@@ -1,4 +1,8 @@
 from lib.BaseCommandBuilder import BaseCommandBuilder
+from lib.Command import Command
+
+STABLE_REPO_NAME = 'cf-stable'
+STABLE_REPO_URL = 'https://charts.helm.sh/stable'
 
 
 class Helm3CommandBuilder(BaseCommandBuilder):
@@ -8,16 +12,24 @@ class Helm3CommandBuilder(BaseCommandBuilder):
         return lines
 
     def build_helm_upgrade_command(self, release_name, chart_ref):
-        return 'helm upgrade %s %s --install --reset-values ' % (release_name, chart_ref)
+        return Command(['helm', 'upgrade', release_name, chart_ref, '--install', '--reset-values'], network=True,
+                       idempotent=True, parallel_safe=True)
+
+    def build_history_max_args(self, history_max):
+        return ['--history-max', history_max]
+
+    def build_prune_history_command(self, release_name, namespace, tiller_namespace, history_max, dry_run):
+        # Revisions are stored as secrets in the namespace of the release
+        return self._build_prune_history_command('secrets', namespace, 'owner=helm,name=' + release_name,
+                                                 'version', 'status', 'deployed', 'sh.helm.release.v1.%s.v' % release_name,
+                                                 release_name, history_max, dry_run)
 
     def build_repo_commands(self, skip_stable, dry_run):
         lines = []
         if not skip_stable:
-            add_stable_command = 'helm repo add cf-stable https://charts.helm.sh/stable'
-            if dry_run:
-                add_stable_command = 'echo ' + add_stable_command
-            lines.append(add_stable_command)
+            lines.append(Command(['helm', 'repo', 'add', STABLE_REPO_NAME, STABLE_REPO_URL], network=True,
+                                 idempotent=True, dry_run=dry_run))
         return lines
 
     def build_pull_command(self):
-        return 'helm pull'
+        return Command(['helm', 'pull'], network=True, idempotent=True, parallel_safe=True)
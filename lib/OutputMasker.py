@@ -0,0 +1,23 @@
+import re
+
+# Same as the sed expression of bin/release_chart: hide the password of URLs with credentials ("://user:pass@")
+MASK_PATTERNS = [
+    (re.compile(rb':[^/\n][^@\n]*@'), b':*****@'),
+]
+
+
+class OutputMasker(object):
+    """
+    Mask credentials in output lines, in process, instead of piping the output through sed.
+    """
+
+    def __init__(self, patterns=None):
+        self.patterns = MASK_PATTERNS if patterns is None else patterns
+
+    def mask(self, line):
+        for pattern, replacement in self.patterns:
+            line = pattern.sub(replacement, line)
+        return line
+
+    def mask_text(self, text):
+        return b''.join(self.mask(line) for line in text.encode().splitlines(True)).decode()
@@ -0,0 +1,61 @@
+from string import Template
+
+
+class ParallelJobsResolver:
+    @staticmethod
+    def get_command(jobs, concurrency, description, summary=False):
+        """
+        Render bash lines running `jobs` (a list of (name, command) pairs) in the background with at most
+        `concurrency` of them in flight. The output of every job is printed in submission order once all of them
+        finished, optionally followed by a summary of the result of each job, and the script fails listing every
+        job that exited with a non-zero status.
+        """
+        lines = Template('''
+cf_jobs_dir=$$(mktemp -d)
+cf_run_job() {
+  local cf_job_id="$$1"
+  shift
+  if "$$@" > "$$cf_jobs_dir/$$cf_job_id.log" 2>&1; then
+    echo 0 > "$$cf_jobs_dir/$$cf_job_id.rc"
+  else
+    echo $$? > "$$cf_jobs_dir/$$cf_job_id.rc"
+  fi
+}
+cf_throttle_jobs() {
+  while [ "$$(jobs -rp | wc -l)" -ge "$$1" ]; do
+    wait -n || true
+  done
+}''').substitute().split('\n')[1:]
+
+        for job_id, (_, command) in enumerate(jobs):
+            lines.append('cf_throttle_jobs %d' % max(int(concurrency), 1))
+            lines.append('cf_run_job %d %s &' % (job_id, command))
+
+        lines.append('wait')
+        lines.append('cf_failed_jobs=""')
+        for job_id, (name, _) in enumerate(jobs):
+            lines += Template('''
+cat "$$cf_jobs_dir/$job_id.log"
+if [ "$$(cat "$$cf_jobs_dir/$job_id.rc")" != "0" ]; then
+  echo "$name failed with exit code $$(cat "$$cf_jobs_dir/$job_id.rc")" >&2
+  cf_failed_jobs="$$cf_failed_jobs $name"
+fi''').substitute(job_id=job_id, name=name).split('\n')[1:]
+
+        if summary:
+            lines.append('echo "Results:"')
+            for job_id, (name, _) in enumerate(jobs):
+                lines += Template('''
+if [ "$$(cat "$$cf_jobs_dir/$job_id.rc")" = "0" ]; then
+  echo "  $name: succeeded"
+else
+  echo "  $name: failed (exit code $$(cat "$$cf_jobs_dir/$job_id.rc"))"
+fi''').substitute(job_id=job_id, name=name).split('\n')[1:]
+
+        lines += Template('''
+rm -rf "$$cf_jobs_dir"
+if [ -n "$$cf_failed_jobs" ]; then
+  echo "Failed to $description:$$cf_failed_jobs" >&2
+  exit 1
+fi''').substitute(description=description).split('\n')[1:]
+
+        return lines
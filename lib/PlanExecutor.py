@@ -0,0 +1,183 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.OutputMasker import OutputMasker
+
+# Run shell steps with errexit like the bash entrypoint script, exporting every variable they assign so that the
+# environment they leave behind (e.g. PACKAGE=...) can be passed on to the following steps through file descriptor 3
+SHELL_STEP_TEMPLATE = '''set -ae
+%s
+printf '%%s\\0' "$PWD" >&3
+env -0 >&3
+'''
+
+
+class PlanExecutor(object):
+    """
+    Run an execution plan (see PlanRenderer) directly with subprocess instead of through the bash entrypoint script:
+    exec steps are spawned without a shell, shell steps with bash, and the output of every step is streamed through
+    an in-process masking filter. The phase, kind, start time (Unix time in nanoseconds), duration and exit code of
+    every step is recorded in `timings`.
+    """
+
+    def __init__(self, env, stdout=None, stderr=None, masker=None):
+        self.env = dict(env)
+        self.cwd = os.getcwd()
+        self.stdout = stdout or sys.stdout.buffer
+        self.stderr = stderr or sys.stderr.buffer
+        self.masker = masker or OutputMasker()
+        self.timings = []
+        self._output_lock = threading.Lock()
+
+    def run(self, plan):
+        """
+        Run the steps of `plan` in order, stopping at the first one that fails. Returns the exit code of the run.
+        """
+        for index, step in enumerate(plan):
+            exit_code = self.run_step(index, step)
+            if exit_code != 0:
+                return exit_code
+        return 0
+
+    def run_step(self, index, step):
+        start_time = time.time_ns()
+        started = time.monotonic()
+        if step['type'] == 'parallel':
+            exit_code = self._run_parallel(step)
+        else:
+            exit_code = self._run(step, self.stdout, self.stderr, update_env=True)
+        self.timings.append({
+            'step': index,
+            'type': step['type'],
+            'phase': step.get('phase'),
+            'kind': step.get('kind'),
+            'command': self.masker.mask_text(self._describe(step)),
+            'start_time': start_time,
+            'duration': time.monotonic() - started,
+            'exit_code': exit_code,
+        })
+        return exit_code
+
+    def _run(self, step, stdout, stderr, update_env=False):
+        pass_fds = ()
+        state_read = state_write = None
+        if step['type'] == 'exec':
+            args = step['argv']
+        else:
+            # bash writes its state to fd 3, whatever number the pipe got here
+            state_target = '/dev/null'
+            if update_env:
+                state_read, state_write = os.pipe()
+                pass_fds = (state_write,)
+                state_target = '&%d' % state_write
+            args = ['bash', '-c', 'exec 3>%s\n' % state_target + SHELL_STEP_TEMPLATE % step['script']]
+
+        try:
+            process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self.env,
+                                       cwd=self.cwd, pass_fds=pass_fds)
+        except OSError as e:
+            self._write(stderr, ('%s: %s\n' % (args[0], e.strerror)).encode())
+            if state_write is not None:
+                os.close(state_write)
+                os.close(state_read)
+            return 127
+
+        state = []
+        if state_write is not None:
+            os.close(state_write)
+            state_reader = threading.Thread(target=lambda: state.append(self._read_all(state_read)))
+            state_reader.start()
+        pumps = [threading.Thread(target=self._pump, args=(process.stdout, stdout)),
+                 threading.Thread(target=self._pump, args=(process.stderr, stderr))]
+        for pump in pumps:
+            pump.start()
+        for pump in pumps:
+            pump.join()
+        exit_code = process.wait()
+
+        if state_write is not None:
+            state_reader.join()
+            if exit_code == 0 and state and state[0]:
+                self._update_state(state[0])
+        return exit_code
+
+    def _run_parallel(self, step):
+        def run_job(job):
+            output = _Buffer()
+            return self._run(job, output, output), output.getvalue()
+
+        with ThreadPoolExecutor(max_workers=max(int(step['concurrency']), 1)) as executor:
+            results = list(executor.map(run_job, step['jobs']))
+
+        failed = []
+        for job, (exit_code, output) in zip(step['jobs'], results):
+            self._write(self.stdout, output)
+            if exit_code != 0:
+                self._write(self.stderr, ('%s failed with exit code %d\n' % (job['name'], exit_code)).encode())
+                failed.append(job['name'])
+        if step.get('summary'):
+            lines = ['Results:']
+            for job, (exit_code, _) in zip(step['jobs'], results):
+                lines.append('  %s: %s' % (job['name'], 'succeeded' if exit_code == 0 else
+                                           'failed (exit code %d)' % exit_code))
+            self._write(self.stdout, ('\n'.join(lines) + '\n').encode())
+        if failed:
+            self._write(self.stderr, ('Failed to %s: %s\n' % (step['description'], ' '.join(failed))).encode())
+            return 1
+        return 0
+
+    def _pump(self, source, target):
+        for line in iter(source.readline, b''):
+            self._write(target, self.masker.mask(line))
+        source.close()
+
+    def _write(self, target, data):
+        with self._output_lock:
+            target.write(data)
+            target.flush()
+
+    @staticmethod
+    def _read_all(fd):
+        with os.fdopen(fd, 'rb') as f:
+            return f.read()
+
+    def _update_state(self, state):
+        fields = state.split(b'\0')
+        self.cwd = fields[0].decode()
+        env = {}
+        for field in fields[1:]:
+            name, sep, value = field.partition(b'=')
+            if sep:
+                env[name.decode()] = value.decode()
+        # Variables bash maintains itself are not part of the state of the run
+        for name in ['PWD', 'OLDPWD', 'SHLVL', '_']:
+            env.pop(name, None)
+        self.env = env
+
+    @staticmethod
+    def _describe(step):
+        if step['type'] == 'exec':
+            return ' '.join(step['argv'][:3])
+        if step['type'] == 'parallel':
+            return step['description']
+        return step['script'].strip().split('\n')[0][:40]
+
+
+class _Buffer(object):
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return b''.join(self.chunks)
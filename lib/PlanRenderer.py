@@ -0,0 +1,58 @@
+import re
+import shlex
+
+from lib.Command import ParallelCommands, ShellScript, ShellWord
+from lib.ShellRenderer import ShellRenderer
+
+# Shell words with any of these may expand to something else than their literal value, they need a real shell
+SHELL_SYNTAX_RE = re.compile(r'[$`*?\[\]{}~|&;<>()!#]')
+
+
+class PlanRenderer(object):
+    """
+    Render commands as an execution plan, a JSON-serializable list of steps a Python runner can run directly:
+
+    - {"type": "exec", "argv": [...]} for commands that reduce to an argument list
+    - {"type": "shell", "script": "..."} for the ones that need bash
+    - {"type": "parallel", "jobs": [...], ...} for commands run concurrently
+
+    Every exec and shell step also carries the metadata of its command ("secret", "network", ...).
+    """
+
+    @staticmethod
+    def render(commands):
+        return [PlanRenderer.render_step(command) for command in commands]
+
+    @staticmethod
+    def render_step(command):
+        if isinstance(command, ParallelCommands):
+            jobs = []
+            for name, job in command.jobs:
+                step = PlanRenderer.render_step(job)
+                step['name'] = name
+                jobs.append(step)
+            return {'type': 'parallel', 'description': command.description, 'concurrency': command.concurrency,
+                    'summary': command.summary, 'jobs': jobs, 'phase': command.phase, 'kind': command.kind()}
+
+        step = {'type': 'shell', 'script': ShellRenderer.render_command(command)}
+        if not isinstance(command, ShellScript):
+            argv = PlanRenderer.argv(command)
+            if argv is not None:
+                step = {'type': 'exec', 'argv': ['echo'] + argv if command.dry_run else argv}
+        step.update(command.metadata())
+        return step
+
+    @staticmethod
+    def argv(command):
+        """
+        Return the literal arguments of `command`, or None if some of its shell words need a shell to be expanded.
+        """
+        argv = []
+        for arg in command.argv:
+            if isinstance(arg, ShellWord):
+                if SHELL_SYNTAX_RE.search(arg):
+                    return None
+                argv += shlex.split(arg)
+            else:
+                argv.append(arg)
+        return argv
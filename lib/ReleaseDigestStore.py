@@ -0,0 +1,54 @@
+import hashlib
+import os
+
+from string import Template
+
+RELEASES_DIR_NAME = 'releases'
+
+
+class ReleaseDigestStore(object):
+    """
+    Store of the digest of what was last deployed to every release by the step (the manifests rendered by
+    `helm template` and the arguments of `helm upgrade`, values included) along with the revision it was deployed
+    as, so that an upgrade deploying the same thing again over that same revision is skipped.
+    """
+
+    def __init__(self, cache_dir):
+        self.releases_dir = os.path.join(cache_dir, RELEASES_DIR_NAME)
+
+    @staticmethod
+    def key(kube_context, namespace, release_name):
+        return hashlib.sha256('|'.join([kube_context or '', namespace or '', release_name]).encode()).hexdigest()
+
+    def state_path(self, key):
+        return os.path.join(self.releases_dir, key)
+
+    def upgrade_command(self, key, release_name, template_command, history_command, upgrade_command, upgrade_args):
+        """
+        Return bash lines running `upgrade_command` unless the digest of the output of `template_command` and of
+        `upgrade_args`, the rendered arguments of `upgrade_command`, is the one stored for the revision
+        `history_command` (a `helm history --max 1 --output json` command) reports as deployed. The arguments are
+        hashed here as written, not as the shell splits and expands them again, so the digest doesn't depend on the
+        files a glob matches. The digest is stored along with the new revision once the upgrade succeeded. If the
+        manifests can't be rendered, the upgrade is always run.
+        """
+        args_digest = hashlib.sha256('\0'.join(upgrade_args).encode()).hexdigest()
+        return Template('''
+if cf_release_manifests=$$($template_command 2>/dev/null); then
+  cf_release_digest=$$({ echo "$$cf_release_manifests"; echo $args_digest; } | sha256sum | cut -d' ' -f1)
+else
+  cf_release_digest=
+fi
+cf_release_revision=$$($history_command 2>/dev/null | grep '"status":"deployed"' | grep -o '"revision":[0-9]*' | cut -d: -f2)
+if [ -n "$$cf_release_digest" ] && [ -n "$$cf_release_revision" ] && [ "$$(cat $state_path 2>/dev/null)" = "$$cf_release_digest $$cf_release_revision" ]; then
+  echo "Release $release_name is unchanged since revision $$cf_release_revision, skipping the upgrade"
+else
+  $upgrade_command
+  if [ -n "$$cf_release_digest" ]; then
+    cf_release_revision=$$($history_command | grep -o '"revision":[0-9]*' | cut -d: -f2)
+    mkdir -p $releases_dir
+    echo "$$cf_release_digest $$cf_release_revision" > $state_path.$$$$ && mv $state_path.$$$$ $state_path
+  fi
+fi''').substitute(template_command=template_command, history_command=history_command,
+                  upgrade_command=upgrade_command, args_digest=args_digest, release_name=release_name,
+                  releases_dir=self.releases_dir, state_path=self.state_path(key)).split('\n')[1:]
@@ -0,0 +1,101 @@
+import re
+
+KEY_VALUE_RE = re.compile(r'^(\s*)(-\s+)?([^\s:#][^:]*):\s*(.*?)\s*$')
+LIST_ITEM_RE = re.compile(r'^(\s*)-\s+(.*?)\s*$')
+
+
+class RepoIndex(object):
+    """
+    Minimal reader of the index.yaml files of Helm repositories, as written by Helm and the common chart servers.
+    """
+
+    @staticmethod
+    def find(index_path, name, version):
+        """
+        Return the entry of chart `name` at `version` in the index at `index_path` as a dict with its "version",
+        "digest" and "urls", or None if the index has no such chart version.
+        """
+        for entry in RepoIndex.entries(index_path, name):
+            if entry.get('version') == version:
+                return entry
+        return None
+
+    @staticmethod
+    def entries(index_path, name):
+        """
+        Iterate over the entries of chart `name` in the index at `index_path`, skipping the other charts without
+        parsing them.
+        """
+        in_entries = False
+        chart_indent = None
+        in_chart = False
+        entry_indent = None
+        entry = None
+        list_key = None
+
+        with open(index_path) as index_file:
+            for line in index_file:
+                if not line.strip() or line.lstrip().startswith('#'):
+                    continue
+                indent = len(line) - len(line.lstrip(' '))
+
+                if indent == 0:
+                    if entry is not None:
+                        yield entry
+                        entry = None
+                    in_entries = line.startswith('entries:')
+                    in_chart = False
+                    continue
+                if not in_entries:
+                    continue
+
+                if chart_indent is None:
+                    chart_indent = indent
+                if indent == chart_indent and not line.lstrip().startswith('-'):
+                    if entry is not None:
+                        yield entry
+                        entry = None
+                    if in_chart:
+                        return
+                    in_chart = RepoIndex._unquote(line.strip()[:-1]) == name
+                    entry_indent = None
+                    continue
+                if not in_chart:
+                    continue
+
+                match = KEY_VALUE_RE.match(line)
+                if match and match.group(2) and (entry_indent is None or indent == entry_indent):
+                    # "- key: value" starting a new chart version entry
+                    if entry is not None:
+                        yield entry
+                    entry_indent = indent
+                    entry = {'urls': []}
+                    RepoIndex._set(entry, match.group(3), match.group(4))
+                    list_key = match.group(3) if not match.group(4) else None
+                    continue
+                if entry is None:
+                    continue
+
+                if match and not match.group(2) and indent == entry_indent + 2:
+                    RepoIndex._set(entry, match.group(3), match.group(4))
+                    list_key = match.group(3) if not match.group(4) else None
+                    continue
+                item = LIST_ITEM_RE.match(line)
+                if item and list_key == 'urls' and indent >= entry_indent + 2:
+                    entry['urls'].append(RepoIndex._unquote(item.group(2)))
+
+        if entry is not None:
+            yield entry
+
+    @staticmethod
+    def _set(entry, key, value):
+        if key in ['version', 'digest', 'name', 'appVersion']:
+            entry[key] = RepoIndex._unquote(value)
+        elif key == 'urls' and value.startswith('['):
+            entry['urls'] = [RepoIndex._unquote(url.strip()) for url in value.strip('[]').split(',') if url.strip()]
+
+    @staticmethod
+    def _unquote(value):
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in '\'"':
+            return value[1:-1]
+        return value
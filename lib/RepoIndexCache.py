@@ -0,0 +1,148 @@
+import base64
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+INDEX_DIR_NAME = 'repository-index'
+METADATA_FILE_NAME = 'metadata.json'
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+# Indexes of distinct repos are fetched concurrently, the metadata file they share is updated under this lock
+METADATA_LOCK = threading.Lock()
+
+
+class RepoIndexCache(object):
+    """
+    On-disk cache of Helm repository index files, keyed by the repository URL with credentials stripped.
+
+    Cached indexes are revalidated with conditional requests (ETag / Last-Modified) and the cache is kept under
+    `max_bytes` by evicting the least recently used indexes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.index_dir = os.path.join(cache_dir, INDEX_DIR_NAME)
+        self.metadata_file = os.path.join(self.index_dir, METADATA_FILE_NAME)
+        self.max_bytes = max_bytes
+        # Whether the last fetched index was up to date in the cache, None if it could not be fetched
+        self.hit = None
+
+    @staticmethod
+    def normalize_url(repo_url):
+        normalized_repo_url = repo_url
+        if normalized_repo_url and '@' in normalized_repo_url:
+            normalized_repo_url = normalized_repo_url.split('//')[0] + '//' + normalized_repo_url.split('@')[1]
+        return normalized_repo_url
+
+    @staticmethod
+    def key(repo_url):
+        normalized_repo_url = RepoIndexCache.normalize_url(repo_url).rstrip('/') + '/'
+        return hashlib.sha256(normalized_repo_url.encode()).hexdigest()
+
+    def index_path(self, repo_url):
+        return os.path.join(self.index_dir, RepoIndexCache.key(repo_url) + '.yaml')
+
+    def fetch(self, repo_url, username=None, password=None, opener=None):
+        """
+        Return the path of an up to date copy of the index of `repo_url`, downloading it only if the cached copy
+        is missing or stale. Returns None if the index could not be obtained.
+
+        Requests are sent with `opener`, e.g. the `open` method of a shared HttpConnectionPool (default:
+        urllib.request.urlopen).
+        """
+        opener = opener or urllib.request.urlopen
+        self.hit = None
+        key = RepoIndexCache.key(repo_url)
+        path = self.index_path(repo_url)
+        metadata = self._load_metadata()
+        entry = metadata.get(key) if os.path.exists(path) else None
+
+        parsed_url = urllib.parse.urlsplit(repo_url)
+        if parsed_url.username is not None and username is None:
+            username = urllib.parse.unquote(parsed_url.username)
+            password = urllib.parse.unquote(parsed_url.password or '')
+        index_url = RepoIndexCache.normalize_url(repo_url).rstrip('/') + '/index.yaml'
+
+        request = urllib.request.Request(index_url)
+        if username is not None and password is not None:
+            auth_b64 = base64.b64encode(('%s:%s' % (username, password)).encode()).decode()
+            request.add_header('Authorization', 'Basic %s' % auth_b64)
+        if entry is not None:
+            if entry.get('etag'):
+                request.add_header('If-None-Match', entry['etag'])
+            if entry.get('last_modified'):
+                request.add_header('If-Modified-Since', entry['last_modified'])
+
+        try:
+            response = opener(request)
+            if response.getcode() == 304:
+                # Connection pools hand back "Not Modified" responses, urlopen raises them
+                raise urllib.error.HTTPError(index_url, 304, 'Not Modified', response.headers, None)
+            os.makedirs(self.index_dir, exist_ok=True)
+            tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+            size = 0
+            with open(tmp_path, 'wb') as index_file:
+                chunk = response.read(CHUNK_SIZE)
+                while chunk:
+                    index_file.write(chunk)
+                    size += len(chunk)
+                    chunk = response.read(CHUNK_SIZE)
+            os.replace(tmp_path, path)
+            entry = {
+                'url': RepoIndexCache.normalize_url(repo_url),
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'size': size,
+            }
+            sys.stderr.write('Downloaded index of Helm repo %s (%d bytes)\n' % (entry['url'], size))
+            self.hit = False
+        except urllib.error.HTTPError as err:
+            if err.code != 304 or entry is None:
+                sys.stderr.write('Failed to fetch index of Helm repo %s: %s %s\n' % (
+                    RepoIndexCache.normalize_url(repo_url), err.code, err.reason))
+                return None
+            sys.stderr.write('Index of Helm repo %s is up to date\n' % entry['url'])
+            self.hit = True
+        except Exception as e:
+            sys.stderr.write('Failed to fetch index of Helm repo %s: %s\n' % (RepoIndexCache.normalize_url(repo_url), e))
+            return None
+
+        entry['last_used'] = time.time()
+        with METADATA_LOCK:
+            metadata = self._load_metadata()
+            metadata[key] = entry
+            self._evict(metadata, keep=key)
+            self._save_metadata(metadata)
+        return path
+
+    def _evict(self, metadata, keep):
+        total_size = sum(entry.get('size', 0) for entry in metadata.values())
+        for key, entry in sorted(metadata.items(), key=lambda item: item[1].get('last_used', 0)):
+            if total_size <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.index_dir, key + '.yaml'))
+            except FileNotFoundError:
+                pass
+            total_size -= entry.get('size', 0)
+            del metadata[key]
+
+    def _load_metadata(self):
+        try:
+            with open(self.metadata_file) as metadata_file:
+                return json.load(metadata_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_metadata(self, metadata):
+        tmp_path = '%s.%d.tmp' % (self.metadata_file, os.getpid())
+        with open(tmp_path, 'w') as metadata_file:
+            json.dump(metadata, metadata_file)
+        os.replace(tmp_path, self.metadata_file)
@@ -0,0 +1,118 @@
+import base64
+import hashlib
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+
+REPO_TYPES_FILE_NAME = 'repo-types.json'
+DEFAULT_TTL = 3600
+# Servers that don't implement HEAD are probed with a GET of a single byte instead
+HEAD_UNSUPPORTED_STATUSES = [405, 501]
+
+
+def _header(headers, name):
+    for key, value in headers.items():
+        if key.lower() == name.lower():
+            return value or ''
+    return None
+
+
+# (type, name, function telling from the response headers whether the repo is of that type), in detection order.
+# Detection of other servers is added by extending this list.
+DETECTORS = [
+    ('artifactory', 'Artifactory',
+     lambda headers: _header(headers, 'X-Artifactory-Id') is not None or
+     'artifactory' in (_header(headers, 'Server') or '').lower()),
+    ('nexus', 'Nexus', lambda headers: 'nexus' in (_header(headers, 'Server') or '').lower()),
+    ('harbor', 'Harbor', lambda headers: _header(headers, 'X-Harbor-Csrf-Token') is not None),
+]
+# Types of the repos charts are pushed to with a plain authenticated PUT of the package ("curl -T")
+PUT_UPLOAD_REPO_TYPES = ['artifactory', 'nexus']
+
+
+class RepoTypeDetector(object):
+    """
+    Detect the server type (Artifactory, Nexus, Harbor, ...) of an http(s) Helm repo from the headers of a cheap
+    authenticated probe of the repo, a HEAD request, which also validates the credentials of the repo.
+
+    With a `cache_dir`, the detected type of a repo is cached for `ttl` seconds in a file only readable by the current
+    user, keyed by the repo URL and user name (never the password, which could otherwise be guessed offline from the
+    key), so that the credentials of a repo are only validated again once the entry expired.
+    """
+
+    def __init__(self, cache_dir=None, ttl=DEFAULT_TTL):
+        self.path = os.path.join(cache_dir, REPO_TYPES_FILE_NAME) if cache_dir is not None else None
+        self.ttl = ttl
+
+    @staticmethod
+    def key(repo_url, username):
+        return hashlib.sha256('\0'.join([repo_url.rstrip('/') + '/', username or '']).encode()).hexdigest()
+
+    @staticmethod
+    def name(repo_type):
+        return dict((detected_type, name) for detected_type, name, _ in DETECTORS).get(repo_type, repo_type)
+
+    @staticmethod
+    def probe(repo_url, username, password, opener=None):
+        """
+        Return the response of an authenticated HEAD request of `repo_url`, or of a GET of its first byte when the
+        server doesn't implement HEAD, opened with `opener` (urllib.request.urlopen by default). Failures are raised
+        as urllib.error.HTTPError / URLError.
+        """
+        opener = opener or urllib.request.urlopen
+        try:
+            return opener(RepoTypeDetector._request(repo_url, username, password, 'HEAD'))
+        except urllib.error.HTTPError as err:
+            if err.code not in HEAD_UNSUPPORTED_STATUSES:
+                raise
+        request = RepoTypeDetector._request(repo_url, username, password, 'GET')
+        request.add_header('Range', 'bytes=0-0')
+        return opener(request)
+
+    @staticmethod
+    def detect(response):
+        """
+        Return the type of the repo that sent `response`, or None if it is not recognized.
+        """
+        headers = response.info()
+        for repo_type, _, detector in DETECTORS:
+            if detector(headers):
+                return repo_type
+        return None
+
+    def cached_type(self, key):
+        entry = self._load().get(key)
+        if entry is None or entry['expires_at'] <= time.time():
+            return None
+        return entry['type']
+
+    def store(self, key, repo_type):
+        if self.path is None:
+            return
+        entries = dict((entry_key, entry) for entry_key, entry in self._load().items()
+                       if entry['expires_at'] > time.time())
+        entries[key] = {'type': repo_type, 'expires_at': time.time() + self.ttl}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _request(repo_url, username, password, method):
+        request = urllib.request.Request(repo_url, method=method)
+        auth_b64 = base64.b64encode(('%s:%s' % (username, password)).encode()).decode()
+        request.add_header('Authorization', 'Basic %s' % auth_b64)
+        return request
+
+    def _load(self):
+        if self.path is None:
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
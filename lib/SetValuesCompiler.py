@@ -0,0 +1,166 @@
+import json
+import re
+
+INTEGER_RE = re.compile(r'^[+-]?[0-9]+$')
+# Helm reads the numbers of values files as float64, which render in exponent form from 1e+06 on
+EXPONENT_FORM_MIN = 10 ** 6
+
+
+class SetValuesCompiler(object):
+    """
+    Compile --set / --set-string overrides into a single values document, following the parsing rules Helm applies
+    to those flags (strvals): dotted keys nest maps, "name[0]" indexes lists, "{a,b}" is a list, "," separates
+    several assignments, "\\" escapes the next character, and --set values are typed (true/false/null/integers)
+    while --set-string values are always strings.
+
+    The document is written as JSON, which Helm reads as any YAML values file. As with any values file, Helm reads
+    its integers as floating point numbers, so integers of 7 digits or more would render in exponent form in
+    templates: overrides holding such integers must be kept as --set flags (see `has_exponent_form_integers`).
+    """
+
+    def __init__(self):
+        self.values = {}
+
+    def set(self, key, val):
+        _StrvalsParser('%s=%s' % (key, val), self.values, False).parse()
+
+    def set_string(self, key, val):
+        _StrvalsParser('%s=%s' % (key, val), self.values, True).parse()
+
+    def dumps(self):
+        return json.dumps(self.values, sort_keys=True, separators=(',', ':'))
+
+    @staticmethod
+    def has_exponent_form_integers(key, val):
+        """
+        Check whether the --set override `key`=`val` holds an integer that Helm keeps exact as a --set flag but would
+        render in exponent form (e.g. 1.234567e+06) when read from a values file.
+        """
+        values = {}
+        _StrvalsParser('%s=%s' % (key, val), values, False).parse()
+        pending = [values]
+        while pending:
+            value = pending.pop()
+            if isinstance(value, dict):
+                pending += value.values()
+            elif isinstance(value, list):
+                pending += value
+            elif isinstance(value, int) and not isinstance(value, bool) and abs(value) >= EXPONENT_FORM_MIN:
+                return True
+        return False
+
+    @staticmethod
+    def compile(values, string_values):
+        """
+        Return the values document of `values` (--set) and `string_values` (--set-string), both applied in the
+        order of their keys, as Helm applies the flags built from them.
+        """
+        compiler = SetValuesCompiler()
+        for key, val in sorted(values.items()):
+            compiler.set(key, val)
+        for key, val in sorted(string_values.items()):
+            compiler.set_string(key, val)
+        return compiler.dumps()
+
+
+class _StrvalsParser(object):
+
+    def __init__(self, text, data, string_typed):
+        self.text = text
+        self.pos = 0
+        self.data = data
+        self.string_typed = string_typed
+
+    def parse(self):
+        while self._key(self.data):
+            pass
+
+    def _until(self, stop):
+        chars = []
+        while self.pos < len(self.text):
+            char = self.text[self.pos]
+            self.pos += 1
+            if char == '\\' and self.pos < len(self.text):
+                chars.append(self.text[self.pos])
+                self.pos += 1
+            elif char in stop:
+                return ''.join(chars), char
+            else:
+                chars.append(char)
+        return ''.join(chars), None
+
+    def _typed(self, val):
+        if self.string_typed:
+            return val
+        lower = val.lower()
+        if lower == 'true':
+            return True
+        if lower == 'false':
+            return False
+        if lower == 'null':
+            return None
+        if val == '0':
+            return 0
+        # Like Go's strconv.ParseInt(val, 10, 64), values with a leading zero are kept as strings
+        if INTEGER_RE.match(val) and val[0] != '0' and -2 ** 63 <= int(val) < 2 ** 63:
+            return int(val)
+        return val
+
+    def _value(self):
+        # "{a,b}" is a list of values, anything else a single value up to the next ","
+        if self.text.startswith('{', self.pos):
+            self.pos += 1
+            items = []
+            while True:
+                item, last = self._until(',}')
+                if last is None:
+                    raise ValueError('list must terminate with "}": %s' % self.text)
+                items.append(self._typed(item))
+                if last == '}':
+                    break
+            self._until(',')
+            return items
+        val, _ = self._until(',')
+        return self._typed(val)
+
+    def _key(self, data):
+        key, last = self._until('=[,.')
+        if last is None:
+            if key:
+                raise ValueError('key "%s" has no value' % key)
+            return False
+        if last == ',':
+            raise ValueError('key "%s" has no value (cannot end with ,)' % key)
+        if last == '=':
+            data[key] = self._value()
+            return True
+        if last == '.':
+            inner = data.get(key)
+            if not isinstance(inner, dict):
+                inner = data[key] = {}
+            self._key(inner)
+            return True
+
+        # "name[index]" followed by "=value" or ".key=value"
+        index, _ = self._until(']')
+        try:
+            index = int(index)
+        except ValueError:
+            raise ValueError('invalid list index in key "%s[%s]"' % (key, index))
+        if index < 0:
+            raise ValueError('negative list index in key "%s[%d]"' % (key, index))
+        items = data.get(key)
+        if not isinstance(items, list):
+            items = data[key] = []
+        items.extend([None] * (index + 1 - len(items)))
+        if self.text.startswith('=', self.pos):
+            self.pos += 1
+            items[index] = self._value()
+        elif self.text.startswith('.', self.pos):
+            self.pos += 1
+            if not isinstance(items[index], dict):
+                items[index] = {}
+            self._key(items[index])
+        else:
+            raise ValueError('unexpected data after "%s[%d]"' % (key, index))
+        return True
@@ -0,0 +1,90 @@
+import shlex
+
+from lib.Command import ParallelCommands, ShellScript, ShellWord
+from lib.ParallelJobsResolver import ParallelJobsResolver
+from lib.StepTimings import StepTimings
+
+SHEBANG = '#!/bin/bash -e'
+
+
+class ShellRenderer(object):
+    """
+    Render commands as the bash entrypoint script.
+    """
+
+    @staticmethod
+    def render(commands, timings_file=None, tracer=None):
+        """
+        With a `timings_file`, every command is timed and the timings are written to that file (see StepTimings).
+        With an enabled `tracer`, every command is traced as a span exported to its trace file (see Tracer).
+        """
+        lines = [SHEBANG]
+        tracer = tracer if tracer is not None and tracer.enabled else None
+        if timings_file is None and tracer is None:
+            for command in commands:
+                lines += ShellRenderer.render_lines(command)
+            return '\n'.join(lines)
+
+        reports = []
+        if timings_file is not None:
+            lines += StepTimings.shell_prelude(timings_file)
+            reports.append('  cf_timings_report "$1"')
+        if tracer is not None:
+            lines += tracer.shell_prelude()
+            reports.append('  cf_trace_report "$1"')
+        # Report on exit too, the phase a failing command belongs to is reported along with the ones that completed
+        lines += ['cf_report() {', '  trap - EXIT'] + reports + ['}', "trap 'cf_report $?' EXIT"]
+
+        for command in commands:
+            if timings_file is not None:
+                lines.append(StepTimings.shell_phase_start(command.phase, command.kind()))
+            if tracer is not None:
+                lines.append(tracer.shell_span_start(ShellRenderer.span_name(command.phase, command.kind()), {
+                    'cfstep.phase': command.phase, 'cfstep.command': command.kind()}))
+            lines += ShellRenderer.render_lines(command)
+            if timings_file is not None:
+                lines.append('cf_phase_end')
+            if tracer is not None:
+                lines.append('cf_span_end')
+        lines.append('cf_report 0')
+        return '\n'.join(lines)
+
+    @staticmethod
+    def span_name(phase, kind):
+        """
+        Name of the span of a command: what it runs, or the phase it belongs to for bash lines.
+        """
+        if kind in ['', 'shell', 'parallel'] and phase is not None:
+            return phase
+        return kind or 'command'
+
+    @staticmethod
+    def render_lines(command):
+        if isinstance(command, ParallelCommands):
+            jobs = [(name, ShellRenderer.render_job(job)) for name, job in command.jobs]
+            return ParallelJobsResolver.get_command(jobs, command.concurrency, command.description, command.summary)
+        if isinstance(command, ShellScript):
+            return ['echo ' + line if command.dry_run else line for line in command.lines]
+        return [ShellRenderer.render_command(command)]
+
+    @staticmethod
+    def render_job(command):
+        # Jobs are run as the arguments of a function, bash lines need a shell of their own
+        if isinstance(command, ShellScript):
+            return 'bash -ec ' + shlex.quote(ShellRenderer.render_command(command))
+        return ShellRenderer.render_command(command)
+
+    @staticmethod
+    def render_command(command):
+        if isinstance(command, ShellScript):
+            return '\n'.join(ShellRenderer.render_lines(command))
+        text = ' '.join(ShellRenderer.quote(arg) for arg in command.argv)
+        if command.dry_run:
+            text = 'echo ' + text
+        return text
+
+    @staticmethod
+    def quote(arg):
+        if isinstance(arg, ShellWord):
+            return arg
+        return shlex.quote(arg)
@@ -0,0 +1,126 @@
+import json
+import os
+import shlex
+import sys
+
+from string import Template
+
+TIMINGS_FILE_NAME = 'cfstep-helm-timings.json'
+
+# Bash helpers timing every phase of the entrypoint script. /proc/uptime is a monotonic clock readable without forking
+# (centiseconds once its dot is removed), $SECONDS is the fallback where it cannot be read. cf_timings_report also
+# reports the phase the script failed in along with the ones that completed.
+SHELL_PRELUDE = Template('''
+cf_timings_file=$timings_file
+cf_timing_phases=()
+cf_timing_kinds=()
+cf_timing_durations=()
+cf_timing_exit_codes=()
+cf_phase=""
+cf_now() {
+  local cf_uptime
+  { read -r cf_uptime _ < /proc/uptime; } 2>/dev/null || cf_uptime="$$SECONDS.00"
+  cf_now_cs=$$((10#$${cf_uptime/./}))
+}
+cf_seconds() {
+  printf '%d.%02d' $$(($$1 / 100)) $$(($$1 % 100))
+}
+cf_json_string() {
+  local cf_value="$${1//\\\\/\\\\\\\\}"
+  printf '"%s"' "$${cf_value//\\"/\\\\\\"}"
+}
+cf_phase_start() {
+  cf_phase="$$1"
+  cf_phase_kind="$$2"
+  cf_now
+  cf_phase_started=$$cf_now_cs
+}
+cf_phase_end() {
+  cf_now
+  cf_timing_phases+=("$$cf_phase")
+  cf_timing_kinds+=("$$cf_phase_kind")
+  cf_timing_durations+=($$((cf_now_cs - cf_phase_started)))
+  cf_timing_exit_codes+=("$${1:-0}")
+  cf_phase=""
+}
+cf_timings_report() {
+  local cf_exit_code="$$1" cf_index cf_total
+  if [ -n "$$cf_phase" ]; then
+    cf_phase_end "$$cf_exit_code"
+  fi
+  cf_now
+  cf_total=$$((cf_now_cs - cf_timings_started))
+  {
+    printf '{"phases": ['
+    for cf_index in "$${!cf_timing_phases[@]}"; do
+      [ "$$cf_index" = "0" ] || printf ', '
+      printf '{"phase": %s, "kind": %s, "duration": %s, "exit_code": %d}' \\
+        "$$(cf_json_string "$${cf_timing_phases[$$cf_index]}")" "$$(cf_json_string "$${cf_timing_kinds[$$cf_index]}")" \\
+        "$$(cf_seconds "$${cf_timing_durations[$$cf_index]}")" "$${cf_timing_exit_codes[$$cf_index]}"
+    done
+    printf '], "total": %s, "exit_code": %d}\\n' "$$(cf_seconds $$cf_total)" "$$cf_exit_code"
+  } > "$$cf_timings_file" || echo "Cannot write timings to $$cf_timings_file" >&2
+  echo ""
+  echo "Timings:"
+  printf '  %-16s %-24s %10s %s\\n' PHASE COMMAND DURATION EXIT
+  for cf_index in "$${!cf_timing_phases[@]}"; do
+    printf '  %-16s %-24s %9ss %s\\n' "$${cf_timing_phases[$$cf_index]}" "$${cf_timing_kinds[$$cf_index]}" \\
+      "$$(cf_seconds "$${cf_timing_durations[$$cf_index]}")" "$${cf_timing_exit_codes[$$cf_index]}"
+  done
+  printf '  %-41s %9ss\\n' total "$$(cf_seconds $$cf_total)"
+}
+cf_now
+cf_timings_started=$$cf_now_cs''')
+
+
+class StepTimings(object):
+    """
+    Opt-in (CFSTEP_TIMINGS=true) timing of the phases of the step (kube-context, helm-version, repo-add, dependencies,
+    pull, upgrade, push, ...). Both the bash entrypoint script and the Python executor print a summary table at the
+    end of the run and write the timings as JSON to `path(env)`:
+
+        {"phases": [{"phase": ..., "kind": ..., "duration": ..., "exit_code": ...}, ...], "total": ..., "exit_code": ...}
+
+    Durations are in seconds. The file lands in the shared volume by default so that later steps can collect it.
+    """
+
+    @staticmethod
+    def enabled(env):
+        return env.get('CFSTEP_TIMINGS', 'false').upper() == 'TRUE'
+
+    @staticmethod
+    def path(env):
+        if 'CFSTEP_TIMINGS_FILE' in env:
+            return env['CFSTEP_TIMINGS_FILE']
+        return os.path.join(env.get('CF_VOLUME_PATH', '/tmp'), TIMINGS_FILE_NAME)
+
+    @staticmethod
+    def shell_prelude(path):
+        return SHELL_PRELUDE.substitute(timings_file=shlex.quote(path)).split('\n')[1:]
+
+    @staticmethod
+    def shell_phase_start(phase, kind):
+        return 'cf_phase_start %s %s' % (shlex.quote(phase or 'other'), shlex.quote(kind))
+
+    @staticmethod
+    def report(path, timings, exit_code, total, out=None):
+        """
+        Write `timings`, the (phase, kind, duration, exit code) of every step the Python executor ran, to `path`
+        and print their summary.
+        """
+        out = out or sys.stdout
+        phases = [{'phase': timing['phase'] or 'other', 'kind': timing['kind'],
+                   'duration': round(timing['duration'], 2), 'exit_code': timing['exit_code']} for timing in timings]
+        try:
+            with open(path, 'w') as f:
+                json.dump({'phases': phases, 'total': round(total, 2), 'exit_code': exit_code}, f)
+                f.write('\n')
+        except OSError as e:
+            sys.stderr.write('Cannot write timings to %s: %s\n' % (path, e.strerror))
+        out.write('\nTimings:\n')
+        out.write('  %-16s %-24s %10s %s\n' % ('PHASE', 'COMMAND', 'DURATION', 'EXIT'))
+        for phase in phases:
+            out.write('  %-16s %-24s %9.2fs %s\n' % (phase['phase'], phase['kind'], phase['duration'],
+                                                     phase['exit_code']))
+        out.write('  %-41s %9.2fs\n' % ('total', total))
+        out.flush()
@@ -0,0 +1,232 @@
+import json
+import os
+import re
+import shlex
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+from string import Template
+
+SERVICE_NAME = 'cfstep-helm'
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+# W3C trace context of the build the step belongs to, e.g. 00-<trace id>-<parent span id>-01
+TRACEPARENT_RE = re.compile(r'^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+# Bash helpers emitting a span for every command of the entrypoint script. The spans are collected as JSON and
+# appended to the trace file as one more OTLP request, along with the root span of the step, when the script exits.
+# $EPOCHREALTIME gives microseconds without forking (bash 5), whole seconds from date are the fallback.
+SHELL_PRELUDE = Template('''
+cf_trace_file=$trace_file
+cf_trace_spans=""
+cf_span=""
+cf_trace_now() {
+  if [ -n "$${EPOCHREALTIME:-}" ]; then
+    cf_trace_now_ns="$${EPOCHREALTIME/[.,]/}000"
+  else
+    cf_trace_now_ns="$$(date +%s)000000000"
+  fi
+}
+cf_span_start() {
+  cf_span="$$1"
+  cf_trace_now
+  cf_span_started=$$cf_trace_now_ns
+}
+cf_span_json() {
+  local cf_status='{"code": $status_ok}'
+  if [ "$$4" != "0" ]; then
+    cf_status="{\\"code\\": $status_error, \\"message\\": \\"exit code $$4\\"}"
+  fi
+  cf_span_json="$${1%\\}}, \\"startTimeUnixNano\\": \\"$$2\\", \\"endTimeUnixNano\\": \\"$$3\\", \\"status\\": $$cf_status}"
+}
+cf_span_end() {
+  cf_trace_now
+  cf_span_json "$$cf_span" "$$cf_span_started" "$$cf_trace_now_ns" "$${1:-0}"
+  cf_trace_spans="$$cf_trace_spans$${cf_trace_spans:+, }$$cf_span_json"
+  cf_span=""
+}
+cf_trace_report() {
+  if [ -n "$$cf_span" ]; then
+    cf_span_end "$$1"
+  fi
+  cf_trace_now
+  cf_span_json $root_span $root_started "$$cf_trace_now_ns" "$$1"
+  printf '%s%s%s]}]}]}\\n' $request_head "$$cf_trace_spans$${cf_trace_spans:+, }" "$$cf_span_json" \\
+    >> "$$cf_trace_file" || echo "Cannot write trace to $$cf_trace_file" >&2
+}''')
+
+
+class Span(object):
+    """
+    A timed operation of the step, with its attributes. `end` records it in its tracer.
+    """
+
+    def __init__(self, tracer, name, span_id, parent_span_id, kind=SPAN_KIND_INTERNAL, attributes=None,
+                 start_time=None):
+        self.tracer = tracer
+        self.name = name
+        self.span_id = span_id
+        self.parent_span_id = parent_span_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start_time = start_time if start_time is not None else time.time_ns()
+        self.end_time = None
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, error=None, end_time=None):
+        self.end_time = end_time if end_time is not None else time.time_ns()
+        self.error = error
+        self.tracer.finish(self)
+
+
+class Tracer(object):
+    """
+    Record spans of the phases of the step (builder initialization, Codefresh API and Helm repo requests, chart
+    materialization, helm and kubectl commands, ...) and export them to CFSTEP_TRACE_FILE in the OTLP JSON file
+    format: one ExportTraceServiceRequest JSON object per line, as written by the file exporter of the
+    OpenTelemetry collector.
+
+    All the spans are children of a root span of the step, itself a child of the span given in TRACEPARENT if any,
+    so that the step shows up in the trace of the build. The `attributes` (release, chart, ...) are set on every span.
+    """
+
+    def __init__(self, env):
+        self.trace_file = env.get('CFSTEP_TRACE_FILE')
+        self.enabled = bool(self.trace_file)
+        self.attributes = {}
+        self.finished = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        traceparent = TRACEPARENT_RE.match(env.get('TRACEPARENT', '').strip().lower())
+        if traceparent is not None:
+            self.trace_id, parent_span_id = traceparent.group(1), traceparent.group(2)
+        else:
+            self.trace_id, parent_span_id = os.urandom(16).hex(), None
+        self.root = Span(self, SERVICE_NAME, self.new_span_id(), parent_span_id)
+
+    @staticmethod
+    def new_span_id():
+        return os.urandom(8).hex()
+
+    def start_span(self, name, attributes=None, kind=SPAN_KIND_INTERNAL):
+        stack = self._stack()
+        parent = stack[-1] if stack else self.root
+        span = Span(self, name, self.new_span_id(), parent.span_id, kind, attributes)
+        stack.append(span)
+        return span
+
+    def finish(self, span):
+        stack = self._stack()
+        if span in stack:
+            stack.remove(span)
+        with self._lock:
+            self.finished.append(span)
+
+    @contextmanager
+    def span(self, name, attributes=None, kind=SPAN_KIND_INTERNAL):
+        span = self.start_span(name, attributes, kind)
+        try:
+            yield span
+        except BaseException as e:
+            span.end(error=str(e) or e.__class__.__name__)
+            raise
+        span.end()
+
+    def add_span(self, name, start_time, end_time, attributes=None, exit_code=0):
+        """
+        Record a span measured elsewhere (e.g. a command run by the executor) as a child of the root span.
+        """
+        span = Span(self, name, self.new_span_id(), self.root.span_id, attributes=attributes, start_time=start_time)
+        span.end(error='exit code %d' % exit_code if exit_code != 0 else None, end_time=end_time)
+
+    def export(self):
+        """
+        Append the spans finished so far to the trace file as one OTLP request.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            spans, self.finished = self.finished, []
+        if not spans:
+            return
+        request = self.request([self.otlp_span(span) for span in spans])
+        try:
+            with open(self.trace_file, 'a') as f:
+                f.write(json.dumps(request) + '\n')
+        except OSError as e:
+            sys.stderr.write('Cannot write trace to %s: %s\n' % (self.trace_file, e.strerror))
+
+    def request(self, spans):
+        return {'resourceSpans': [{
+            'resource': {'attributes': self.otlp_attributes({'service.name': SERVICE_NAME})},
+            'scopeSpans': [{'scope': {'name': SERVICE_NAME}, 'spans': spans}],
+        }]}
+
+    def otlp_span(self, span):
+        otlp_span = self.otlp_span_head(span.name, span.span_id, span.parent_span_id, span.kind, span.attributes)
+        otlp_span['startTimeUnixNano'] = str(span.start_time)
+        if span.end_time is not None:
+            otlp_span['endTimeUnixNano'] = str(span.end_time)
+            otlp_span['status'] = {'code': STATUS_OK} if span.error is None else {'code': STATUS_ERROR,
+                                                                                  'message': span.error}
+        return otlp_span
+
+    def otlp_span_head(self, name, span_id, parent_span_id, kind=SPAN_KIND_INTERNAL, attributes=None):
+        otlp_span = {'traceId': self.trace_id, 'spanId': span_id, 'name': name, 'kind': kind}
+        if parent_span_id is not None:
+            otlp_span['parentSpanId'] = parent_span_id
+        all_attributes = dict(self.attributes)
+        all_attributes.update(attributes or {})
+        otlp_span['attributes'] = self.otlp_attributes(all_attributes)
+        return otlp_span
+
+    @staticmethod
+    def otlp_attributes(attributes):
+        otlp_attributes = []
+        for key, value in sorted(attributes.items()):
+            if value is None:
+                continue
+            if isinstance(value, bool):
+                otlp_value = {'boolValue': value}
+            elif isinstance(value, int):
+                otlp_value = {'intValue': str(value)}
+            elif isinstance(value, float):
+                otlp_value = {'doubleValue': value}
+            else:
+                otlp_value = {'stringValue': str(value)}
+            otlp_attributes.append({'key': key, 'value': otlp_value})
+        return otlp_attributes
+
+    def shell_prelude(self):
+        """
+        Bash lines defining the cf_span_start / cf_span_end / cf_trace_report helpers of the entrypoint script.
+        cf_trace_report ends the root span, which started when the tracer was created.
+        """
+        request_head = json.dumps(self.request([]))
+        return SHELL_PRELUDE.substitute(
+            trace_file=shlex.quote(self.trace_file),
+            status_ok=STATUS_OK,
+            status_error=STATUS_ERROR,
+            root_span=shlex.quote(json.dumps(self.otlp_span_head(self.root.name, self.root.span_id,
+                                                                 self.root.parent_span_id))),
+            root_started=self.root.start_time,
+            request_head=shlex.quote(request_head[:request_head.rindex('[]')] + '['),
+        ).split('\n')[1:]
+
+    def shell_span_start(self, name, attributes):
+        head = self.otlp_span_head(name, self.new_span_id(), self.root.span_id, attributes=attributes)
+        return 'cf_span_start %s' % shlex.quote(json.dumps(head))
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
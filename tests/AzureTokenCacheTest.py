@@ -0,0 +1,51 @@
+import unittest
+import base64
+import json
+import os
+import stat
+import sys
+import tempfile
+import time
+
+parent_dir_name = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(parent_dir_name)
+from lib.AzureTokenCache import AzureTokenCache
+
+
+def jwt_token(expires_at):
+    payload = base64.urlsafe_b64encode(json.dumps({'exp': expires_at}).encode()).decode().rstrip('=')
+    return 'header.%s.signature' % payload
+
+
+class AzureTokenCacheTest(unittest.TestCase):
+
+    def test_key_depends_on_service_principal(self):
+        self.assertNotEqual(AzureTokenCache.key('azsp', 'test.azure.io', 'tenant', 'client1'),
+                            AzureTokenCache.key('azsp', 'test.azure.io', 'tenant', 'client2'))
+        self.assertNotEqual(AzureTokenCache.key('azsp', 'test.azure.io'), AzureTokenCache.key('az', 'test.azure.io'))
+
+    def test_jwt_expiry(self):
+        cache = AzureTokenCache()
+        valid_token = jwt_token(time.time() + 3600)
+        cache.put('valid', valid_token)
+        cache.put('expiring', jwt_token(time.time() + 30))
+
+        self.assertEqual(cache.get('valid'), valid_token)
+        self.assertIsNone(cache.get('expiring'))
+        self.assertIsNone(cache.get('unknown'))
+
+    def test_default_ttl(self):
+        cache = AzureTokenCache(default_ttl=0)
+        cache.put('opaque', 'accessToken')
+        self.assertIsNone(cache.get('opaque'))
+
+        cache = AzureTokenCache(default_ttl=600)
+        cache.put('opaque', 'accessToken')
+        self.assertEqual(cache.get('opaque'), 'accessToken')
+
+    def test_persistence(self):
+        path = os.path.join(tempfile.mkdtemp(), 'tokens', 'azure-helm-tokens-build.json')
+        AzureTokenCache(path).put('key', 'accessToken')
+
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
+        self.assertEqual(AzureTokenCache(path).get('key'), 'accessToken')
@@ -0,0 +1,58 @@
+import unittest
+import os
+import sys
+import tempfile
+
+parent_dir_name = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(parent_dir_name)
+from lib.ChartDiscovery import ChartDiscovery
+
+
+class ChartDiscoveryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def add_chart(self, path, name, dependencies=()):
+        chart_dir = os.path.join(self.root, path)
+        os.makedirs(chart_dir)
+        with open(os.path.join(chart_dir, 'Chart.yaml'), 'w') as f:
+            f.write('apiVersion: v2\nname: %s\nversion: "1.0.0" # released\n' % name)
+            if dependencies:
+                f.write('dependencies:\n')
+            for dependency in dependencies:
+                f.write('  - name: %s\n    version: 1.0.0\n    repository: "%s"\n' % (dependency, dependency))
+        return chart_dir
+
+    def test_discover(self):
+        api = self.add_chart('services/api', 'api')
+        self.add_chart('services/api/charts/redis', 'redis')
+        common = self.add_chart('common', 'common')
+        os.makedirs(os.path.join(self.root, 'docs'))
+        self.assertEqual(ChartDiscovery.discover(self.root), [common, api])
+        self.assertEqual(ChartDiscovery.metadata(api), {'apiVersion': 'v2', 'name': 'api', 'version': '1.0.0'})
+
+    def test_levels(self):
+        common = self.add_chart('common', 'common')
+        lib = self.add_chart('lib', 'lib', ['file://../common'])
+        api = self.add_chart('api', 'api', ['file://../lib', 'file://../common', 'https://charts.example.com/'])
+        web = self.add_chart('web', 'web', ['file://../common'])
+        worker = self.add_chart('worker', 'worker')
+        self.assertEqual(ChartDiscovery.levels(ChartDiscovery.discover(self.root)),
+                         [[common, worker], [lib, web], [api]])
+
+    def test_circular_dependencies(self):
+        self.add_chart('a', 'a', ['file://../b'])
+        self.add_chart('b', 'b', ['file://../a'])
+        self.add_chart('c', 'c')
+        with self.assertRaises(Exception) as exc:
+            ChartDiscovery.levels(ChartDiscovery.discover(self.root))
+        self.assertIn('Circular file:// dependencies', str(exc.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
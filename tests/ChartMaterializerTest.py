@@ -0,0 +1,80 @@
+import unittest
+import base64
+import gzip
+import json
+import os
+import sys
+import tempfile
+
+parent_dir_name = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(parent_dir_name)
+from lib import ChartMaterializer as chart_materializer_module
+from lib.ChartMaterializer import ChartMaterializer
+
+CHART = [
+    {'name': 'Chart.yaml', 'data': 'apiVersion: v2\nname: mychart\nversion: 0.1.0\n'},
+    {'name': 'values', 'data': 'image: nginx # é\n'},
+    {'name': 'templates/deployment.yaml', 'data': 'kind: Deployment\n' * 1000},
+    {'name': 'Charts/sub/Chart.yaml', 'data': 'name: sub\n'},
+    {'name': 'templates/empty.yaml'},
+]
+
+
+class ChartMaterializerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.chart_dir = tempfile.mkdtemp()
+
+    def assert_materialized(self, materializer):
+        self.assertEqual(materializer.files, 5)
+        with open(self.chart_dir + '/values.yaml', encoding='utf-8') as f:
+            self.assertEqual(f.read(), 'image: nginx # é\n')
+        with open(self.chart_dir + '/charts/sub/Chart.yaml') as f:
+            self.assertEqual(f.read(), 'name: sub\n')
+        self.assertEqual(os.path.getsize(self.chart_dir + '/templates/deployment.yaml'), 17000)
+        self.assertEqual(os.path.getsize(self.chart_dir + '/templates/empty.yaml'), 0)
+
+    def test_chart_json(self):
+        materializer = ChartMaterializer(self.chart_dir)
+        materializer.materialize(ChartMaterializer.iter_chart_json({'CHART_JSON': json.dumps(CHART, indent=2)}))
+        self.assert_materialized(materializer)
+        self.assertEqual(materializer.bytes, 45 + 17 + 17000 + 10)
+
+    def test_chart_json_gzip(self):
+        encoded = base64.b64encode(gzip.compress(json.dumps(CHART).encode())).decode()
+        materializer = ChartMaterializer(self.chart_dir)
+        materializer.materialize(ChartMaterializer.iter_chart_json({'CHART_JSON_GZIP': encoded}))
+        self.assert_materialized(materializer)
+
+    def test_items_spanning_chunks(self):
+        original_chunk_size = chart_materializer_module.CHUNK_SIZE
+        chart_materializer_module.CHUNK_SIZE = 7
+        try:
+            chunks = ChartMaterializer.iter_chart_json({'CHART_JSON': json.dumps(CHART)})
+            self.assertEqual(list(ChartMaterializer.iter_items(chunks)), CHART)
+        finally:
+            chart_materializer_module.CHUNK_SIZE = original_chunk_size
+
+    def test_truncated_chart_json(self):
+        with self.assertRaises(ValueError):
+            list(ChartMaterializer.iter_items(iter(['[{"name": "Chart.yaml"}, {"name"'])))
+
+    def test_incremental_materialization(self):
+        first = ChartMaterializer(self.chart_dir)
+        first.materialize(iter([json.dumps(CHART)]))
+
+        unchanged = ChartMaterializer(self.chart_dir)
+        unchanged.materialize(iter([json.dumps(CHART)]))
+        self.assertEqual((unchanged.files, unchanged.unchanged_files, unchanged.removed_files), (0, 5, 0))
+        self.assertEqual(unchanged.digest, first.digest)
+        self.assertEqual(unchanged.previous_digest, first.digest)
+
+        changed_chart = [dict(item) for item in CHART[:3]]
+        changed_chart[1]['data'] = 'image: httpd\n'
+        changed = ChartMaterializer(self.chart_dir)
+        changed.materialize(iter([json.dumps(changed_chart)]))
+        self.assertEqual((changed.files, changed.unchanged_files, changed.removed_files), (1, 2, 2))
+        self.assertNotEqual(changed.digest, first.digest)
+        self.assertFalse(os.path.exists(self.chart_dir + '/charts/sub/Chart.yaml'))
+        with open(self.chart_dir + '/values.yaml') as f:
+            self.assertEqual(f.read(), 'image: httpd\n')
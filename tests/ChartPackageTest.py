@@ -0,0 +1,96 @@
+import unittest
+import io
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+parent_dir_name = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(parent_dir_name)
+from lib.ChartPackage import ChartPackage
+from lib.EntrypointScriptBuilder import EntrypointScriptBuilder, CHECK_CHART_PUBLISHED
+
+
+def write_package(path, version, values=''):
+    with tarfile.open(path, 'w:gz') as tar:
+        for name, data in [('tomcat/Chart.yaml', 'apiVersion: v2\nname: tomcat\nversion: %s\n' % version),
+                           ('tomcat/values.yaml', values)]:
+            info = tarfile.TarInfo(name)
+            info.size = len(data.encode())
+            tar.addfile(info, io.BytesIO(data.encode()))
+    return path
+
+
+class ChartPackageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.package = write_package(os.path.join(self.tmp.name, 'tomcat-0.4.3.tgz'), '0.4.3')
+        # Index of the repo the package was published to
+        self.index = os.path.join(self.tmp.name, 'remote-index.yaml')
+        with open(self.index, 'w') as f:
+            f.write('apiVersion: v1\nentries:\n  tomcat:\n  - name: tomcat\n    version: 0.4.3\n'
+                    '    digest: %s\n    urls:\n    - charts/tomcat-0.4.3.tgz\n' % ChartPackage.digest(self.package))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def check(self, package):
+        return subprocess.run([CHECK_CHART_PUBLISHED, package, self.index], stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, universal_newlines=True)
+
+    def test_metadata(self):
+        self.assertEqual(ChartPackage.metadata(self.package),
+                         {'apiVersion': 'v2', 'name': 'tomcat', 'version': '0.4.3'})
+
+    def test_check_chart_published(self):
+        self.assertEqual(self.check(self.package).stdout, 'published\n')
+        new_version = write_package(os.path.join(self.tmp.name, 'tomcat-0.4.4.tgz'), '0.4.4')
+        self.assertEqual(self.check(new_version).stdout, 'new\n')
+
+        os.makedirs(os.path.join(self.tmp.name, 'other'))
+        conflicting = write_package(os.path.join(self.tmp.name, 'other', 'tomcat-0.4.3.tgz'), '0.4.3', 'replicas: 2\n')
+        result = self.check(conflicting)
+        self.assertEqual(result.returncode, 1)
+        self.assertIn('Chart tomcat version 0.4.3 is already published with digest %s' %
+                      ChartPackage.digest(self.package), result.stderr)
+
+    def test_push_unless_published(self):
+        lines = ChartPackage.push_unless_published_command(
+            '%s "$PACKAGE" %s' % (CHECK_CHART_PUBLISHED, self.index), 'echo "pushing $PACKAGE"')
+        new_version = write_package(os.path.join(self.tmp.name, 'tomcat-0.4.4.tgz'), '0.4.4')
+        for package, expected in [(self.package, 'tomcat-0.4.3.tgz is already published\n'),
+                                  (new_version, 'pushing %s\n' % new_version)]:
+            result = subprocess.run(['bash', '-ec', '\n'.join(lines)], env=dict(os.environ, PACKAGE=package),
+                                    stdout=subprocess.PIPE, universal_newlines=True, check=True)
+            self.assertEqual(result.stdout, expected)
+
+    def test_build_push_commands(self):
+        env = {
+            'ACTION': 'push',
+            'CHART_NAME': 'tomcat',
+            'CHART_REPO_URL': 'cm://repo.example.com/',
+            'HELM_VERSION': '3.9.0',
+            'HELM_REPOSITORY_CACHE': '/root/.helm/helm/repository',
+            'SKIP_PUBLISHED_CHARTS': 'true',
+            'CFSTEP_PACKAGER': 'python'
+        }
+        command = EntrypointScriptBuilder(env).build_commands()[-1]
+        self.assertEqual(command.phase, 'push')
+        self.assertEqual(command.lines, [
+            'cf_chart_status=$(%s "$PACKAGE" /root/.helm/helm/repository/remote-index.yaml)' % CHECK_CHART_PUBLISHED,
+            'if [ "$cf_chart_status" = "published" ]; then',
+            '  echo "$(basename "$PACKAGE") is already published"',
+            'else',
+            '  helm push $PACKAGE remote',
+            'fi'])
+
+        # A retry would repackage the chart with "helm package" under another digest and fail the check
+        del env['CFSTEP_PACKAGER']
+        with self.assertRaisesRegex(Exception, 'SKIP_PUBLISHED_CHARTS requires .* CFSTEP_PACKAGER=python'):
+            EntrypointScriptBuilder(env).build_commands()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+import unittest
+import json
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+parent_dir_name = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(parent_dir_name)
+from lib.ChartPackage import ChartPackage
+from lib.ChartPackager import ChartPackager
+from lib.EntrypointScriptBuilder import EntrypointScriptBuilder, PACKAGE_CHART
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(data)
+
+
+class ChartPackagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.chart_dir = os.path.join(self.tmp.name, 'src', 'tomcat')
+        write_file(os.path.join(self.chart_dir, 'Chart.yaml'),
+                   'apiVersion: v2\nname: tomcat\nversion: 0.4.3\nappVersion: "9.0"\n')
+        write_file(os.path.join(self.chart_dir, 'values.yaml'), 'replicas: 1\n')
+        write_file(os.path.join(self.chart_dir, 'templates', 'deployment.yaml'), 'kind: Deployment\n')
+        write_file(os.path.join(self.chart_dir, 'templates', '.notes.swp'), 'swap\n')
+        write_file(os.path.join(self.chart_dir, 'ci', 'values.yaml'), 'replicas: 2\n')
+        write_file(os.path.join(self.chart_dir, '.helmignore'), '# CI only\nci/\n*.bak\n')
+        write_file(os.path.join(self.chart_dir, 'values.yaml.bak'), 'replicas: 0\n')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def destination(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def test_package_is_reproducible(self):
+        path, digest = ChartPackager().package(self.chart_dir, self.destination('first'))
+        self.assertEqual(path, os.path.join(self.destination('first'), 'tomcat-0.4.3.tgz'))
+        self.assertEqual(digest, ChartPackage.digest(path))
+        with tarfile.open(path) as tar:
+            self.assertEqual(tar.getnames(), ['tomcat/.helmignore', 'tomcat/Chart.yaml',
+                                              'tomcat/templates/deployment.yaml', 'tomcat/values.yaml'])
+            self.assertEqual(set((member.mtime, member.uid, member.gid, member.mode) for member in tar.getmembers()),
+                             {(0, 0, 0, 0o644)})
+
+        os.utime(os.path.join(self.chart_dir, 'values.yaml'), (1600000000, 1600000000))
+        _, second_digest = ChartPackager().package(self.chart_dir, self.destination('second'))
+        self.assertEqual(second_digest, digest)
+
+        write_file(os.path.join(self.chart_dir, 'values.yaml'), 'replicas: 3\n')
+        _, changed_digest = ChartPackager().package(self.chart_dir, self.destination('third'))
+        self.assertNotEqual(changed_digest, digest)
+
+    def test_version_overrides(self):
+        path, _ = ChartPackager().package(self.chart_dir, self.destination('out'), '1.0.0', '10.1')
+        self.assertEqual(os.path.basename(path), 'tomcat-1.0.0.tgz')
+        self.assertEqual(ChartPackage.metadata(path),
+                         {'apiVersion': 'v2', 'name': 'tomcat', 'version': '1.0.0', 'appVersion': '10.1'})
+
+    def test_cache(self):
+        cache_dir = self.destination('cache')
+        packager = ChartPackager(cache_dir)
+        _, digest = packager.package(self.chart_dir, self.destination('first'))
+        self.assertFalse(packager.hit)
+        path, cached_digest = packager.package(self.chart_dir, self.destination('second'))
+        self.assertTrue(packager.hit)
+        self.assertEqual(cached_digest, digest)
+        self.assertTrue(os.path.isfile(path))
+
+        # Another version of the chart is not taken from the cache
+        packager.package(self.chart_dir, self.destination('third'), '0.4.4')
+        self.assertFalse(packager.hit)
+
+    def test_ignore_rules(self):
+        def ignored(rules, rel_path, is_dir=False):
+            return ChartPackager.ignored(rel_path, is_dir, ChartPackager.parse_ignore_rules(rules))
+
+        # The first matching rule wins: a later negation does not include a file again
+        self.assertTrue(ignored(['*.yaml', '!values.yaml'], 'values.yaml'))
+        # A negated rule excludes the paths it does not match
+        self.assertTrue(ignored(['!*.yaml'], 'README.md'))
+        self.assertTrue(ignored(['!*.yaml'], 'templates', True))
+        self.assertFalse(ignored(['!*.yaml'], 'values.yaml'))
+        # "*" does not match a slash, rooted rules only match at the top of the chart
+        self.assertTrue(ignored(['templates/*.yaml'], 'templates/a.yaml'))
+        self.assertFalse(ignored(['templates/*.yaml'], 'templates/sub/a.yaml'))
+        self.assertTrue(ignored(['/values.yaml'], 'values.yaml'))
+        self.assertFalse(ignored(['/values.yaml'], 'ci/values.yaml'))
+        self.assertTrue(ignored(['*.yaml'], 'ci/values.yaml'))
+        self.assertFalse(ignored(['ci/'], 'ci', False))
+        self.assertTrue(ignored(['[^a]*.md'], 'README.md'))
+        self.assertFalse(ignored(['[^R]*.md'], 'README.md'))
+        with self.assertRaisesRegex(Exception, r'\*\* is not supported'):
+            ChartPackager.parse_ignore_rules(['templates/**/*.bak'])
+        with self.assertRaisesRegex(Exception, 'unterminated character class'):
+            ChartPackager.parse_ignore_rules(['[a'])
+
+    def test_symlinked_directories(self):
+        write_file(os.path.join(self.tmp.name, 'shared', 'files', 'config.ini'), 'debug=false\n')
+        os.symlink(os.path.join(self.tmp.name, 'shared', 'files'), os.path.join(self.chart_dir, 'files'))
+        self.assertEqual(ChartPackager.files(self.chart_dir), [
+            '.helmignore', 'Chart.yaml', 'files/config.ini', 'templates/deployment.yaml', 'values.yaml'])
+
+        os.symlink(self.chart_dir, os.path.join(self.chart_dir, 'templates', 'loop'))
+        with self.assertRaisesRegex(Exception, 'loops back'):
+            ChartPackager.files(self.chart_dir)
+
+    def test_validation(self):
+        with self.assertRaisesRegex(Exception, 'not a valid SemVer version'):
+            ChartPackager().package(self.chart_dir, self.destination('out'), '1.0.0.0')
+        write_file(os.path.join(self.chart_dir, 'Chart.yaml'), 'apiVersion: v2\nversion: 0.4.3\n')
+        with self.assertRaisesRegex(Exception, 'has no name'):
+            ChartPackager().package(self.chart_dir, self.destination('out'))
+        write_file(os.path.join(self.chart_dir, 'Chart.yaml'),
+                   'apiVersion: v2\nname: tomcat\nversion: 0.4.3\ndependencies:\n'
+                   '  - name: mysql\n    version: ~1.0.0\n    repository: https://charts.example.com\n'
+                   '    import-values:\n      - child: exports\n        parent: mysql\n'
+                   '  - name: redis\n    version: 2.0.0\n    repository: https://charts.example.com\n')
+        os.makedirs(os.path.join(self.chart_dir, 'charts', 'redis'))
+        write_file(os.path.join(self.chart_dir, 'charts', 'redis', 'Chart.yaml'), 'name: redis\nversion: 2.0.0\n')
+        with self.assertRaisesRegex(Exception, r'^The dependencies mysql of the chart .* are missing'):
+            ChartPackager().package(self.chart_dir, self.destination('out'))
+
+    def test_local_dependencies_are_reproducible(self):
+        mysql_dir = os.path.join(self.tmp.name, 'src', 'mysql')
+        write_file(os.path.join(mysql_dir, 'Chart.yaml'), 'apiVersion: v2\nname: mysql\nversion: 1.0.0\n')
+        write_file(os.path.join(mysql_dir, 'values.yaml'), 'port: 3306\n')
+        with open(os.path.join(self.chart_dir, 'Chart.yaml'), 'a') as f:
+            f.write('dependencies:\n  - name: mysql\n    version: 1.0.0\n    repository: file://../mysql\n')
+
+        def dependency_build(mtime):
+            # Like "helm dependency build", which packages file:// dependencies with the current time
+            archive = os.path.join(self.chart_dir, 'charts', 'mysql-1.0.0.tgz')
+            os.makedirs(os.path.dirname(archive), exist_ok=True)
+            with tarfile.open(archive, 'w:gz') as tar:
+                for name in ['Chart.yaml', 'values.yaml']:
+                    info = tar.gettarinfo(os.path.join(mysql_dir, name), 'mysql/' + name)
+                    info.mtime = mtime
+                    with open(os.path.join(mysql_dir, name), 'rb') as f:
+                        tar.addfile(info, f)
+
+        dependency_build(1600000000)
+        path, digest = ChartPackager().package(self.chart_dir, self.destination('first'))
+        dependency_build(1700000000)
+        _, second_digest = ChartPackager().package(self.chart_dir, self.destination('second'))
+        self.assertEqual(second_digest, digest)
+
+        mysql_path, _ = ChartPackager().package(mysql_dir, self.destination('mysql'))
+        with tarfile.open(path) as tar, open(mysql_path, 'rb') as f:
+            self.assertEqual(tar.extractfile('tomcat/charts/mysql-1.0.0.tgz').read(), f.read())
+
+    def test_package_chart(self):
+        run = [PACKAGE_CHART, '--destination', self.destination('out'), '--cache-dir', self.destination('cache'),
+               self.chart_dir]
+        env = dict(os.environ, SOURCE_DATE_EPOCH='1600000000')
+        first = json.loads(subprocess.check_output(run, env=env, universal_newlines=True))
+        path = os.path.join(self.destination('out'), 'tomcat-0.4.3.tgz')
+        self.assertEqual(first, {'package': path, 'digest': ChartPackage.digest(path), 'cached': False})
+        with tarfile.open(path) as tar:
+            self.assertEqual(set(member.mtime for member in tar.getmembers()), {1600000000})
+
+        exported = subprocess.check_output(run[:-1] + ['--export', '--version', '0.4.4', self.chart_dir], env=env,
+                                           universal_newlines=True)
+        path = os.path.join(self.destination('out'), 'tomcat-0.4.4.tgz')
+        self.assertEqual(exported, 'PACKAGE=%s\nPACKAGE_DIGEST=%s\n' % (path, ChartPackage.digest(path)))
+
+    def test_build_push_commands(self):
+        env = {
+            'ACTION': 'push',
+            'CHART_NAME': 'tomcat',
+            'CHART_VERSION': '0.4.4',
+            'CHART_REPO_URL': 'cm://repo.example.com/',
+            'HELM_VERSION': '3.9.0',
+            'CFSTEP_PACKAGER': 'python',
+            'CFSTEP_CACHE_DIR': '/codefresh/volume/cfstep-helm'
+        }
+        command = EntrypointScriptBuilder(env).build_commands()[-2]
+        self.assertEqual(command.phase, 'package')
+        self.assertEqual(command.lines, [
+            'cf_package=$(%s --destination /tmp --cache-dir /codefresh/volume/cfstep-helm --export --version 0.4.4 '
+            'tomcat)' % PACKAGE_CHART,
+            'eval "$cf_package"'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+import os
+import sys
+
+parent_dir_name = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(parent_dir_name)
+from lib.EnvironmentScanner import EnvironmentScanner
+
+
+class EnvironmentScannerTest(unittest.TestCase):
+    def test_classification(self):
+        env = {
+            'VALUESFILE_b': 'b.yaml',
+            'customfile_a': 'a.yaml',
+            'CUSTOM_image_tag': '1.0',
+            'VALUE_image_pull..policy': 'Always',
+            'value_image_tag': '2.0',
+            'VALUESTRING_build_id': '0123',
+            'CF_CTX_repo_URL': 'https://repo.example.com',
+            'CF_CTX_repo2_URL': 'https://repo2.example.com',
+            'CF_CTX_REPO_HELMREPO_USERNAME': 'user',
+            'CF_CTX_REPO_HELMREPO_PASSWORD': 'pass',
+            'HELMREPO_USERNAME': 'default-user',
+            'PATH': '/usr/bin',
+            'CHART_NAME': 'tomcat',
+        }
+        scanner = EnvironmentScanner(env)
+        self.assertEqual(scanner.valuesfiles, ['b.yaml', 'a.yaml'])
+        # "value_image_tag" sorts after "CUSTOM_image_tag" and wins
+        self.assertEqual(scanner.values, {'image.tag': '2.0', 'image.pull_policy': 'Always'})
+        self.assertEqual(scanner.string_values, {'build.id': '0123'})
+        self.assertEqual(scanner.context_repo_names, ['repo2', 'repo'])
+        self.assertEqual(scanner.repo_credentials('repo'), ['https://repo.example.com', 'user', 'pass'])
+        self.assertEqual(scanner.repo_credentials('repo2'), ['https://repo2.example.com', 'default-user', None])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the services the step talks to, so that the non dry-run paths can be tested and timed offline:
+
+- the Codefresh API: Helm repo contexts (/api/contexts/<name>) and Azure Helm repo tokens
+  (/api/clusters/aks/helm/repos/<service>/token, /api/clusters/aks-sp/helm/repos/<service>/token)
+- an Artifactory-style Helm repo under /artifactory/<repo>/, answering with X-Artifactory-Id headers and accepting
+  chart uploads with PUT (as "curl -T" does)
+- a Nexus-style Helm repo under /nexus/repository/<repo>/, the same but answering with a Nexus Server header
+- a ChartMuseum-style Helm repo under /chartmuseum/: uploads with POST /chartmuseum/api/charts, index.yaml and chart
+  archives generated from the uploaded charts
+- an Azure-style Helm repo under /azure/<repo>/_blobs/: uploads with PUT, or PATCH to replace an existing blob
+
+Every request is delayed by `latency` seconds and recorded in `requests` as (method, path) pairs, and the client
+address of every connection in `connections`. The next `failures` requests fail with a 503 status.
+
+Usage: python3 tests/LocalCodefreshServer.py [--port PORT] [--latency MS] [--api-key KEY]
+"""
+import argparse
+import base64
+import hashlib
+import io
+import json
+import tarfile
+import threading
+import time
+import urllib.parse
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class LocalCodefreshServer(object):
+
+    def __init__(self, api_key=None, username=None, password=None, latency=0, port=0):
+        self.api_key = api_key
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.failures = 0
+        self.connections = set()
+        self.contexts = {}
+        self.artifacts = {}
+        self.charts = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler_class())
+        self.url = 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def add_context(self, name, repository_url, variables=None):
+        self.contexts[name] = {
+            'metadata': {'name': name},
+            'spec': {'type': 'helm-repository', 'data': {'repositoryUrl': repository_url, 'variables': variables}},
+        }
+
+    def artifactory_url(self, repo='helm'):
+        return '%s/artifactory/%s/' % (self.url, repo)
+
+    def nexus_url(self, repo='helm'):
+        return '%s/nexus/repository/%s/' % (self.url, repo)
+
+    def chartmuseum_url(self):
+        return '%s/chartmuseum/' % self.url
+
+    def azure_url(self, repo='helm'):
+        return '%s/azure/%s/' % (self.url, repo)
+
+    def add_chart(self, archive):
+        """
+        Store the chart archive `archive` (bytes) in the ChartMuseum repo, returning its (name, version), or None if
+        that version is already stored.
+        """
+        with tarfile.open(fileobj=io.BytesIO(archive), mode='r:gz') as tar:
+            chart_yaml = next(member for member in tar.getmembers() if member.name.count('/') == 1 and
+                              member.name.endswith('/Chart.yaml'))
+            metadata = {}
+            for line in tar.extractfile(chart_yaml).read().decode().splitlines():
+                key, sep, value = line.partition(':')
+                if sep and not line.startswith(' '):
+                    metadata[key.strip()] = value.strip().strip('"\'')
+        name, version = metadata['name'], metadata['version']
+        with self._lock:
+            if (name, version) in self.charts:
+                return None
+            self.charts[(name, version)] = archive
+        return name, version
+
+    def index_yaml(self):
+        lines = ['apiVersion: v1', 'entries:']
+        with self._lock:
+            charts = sorted(self.charts.items())
+        for name in sorted(set(name for (name, _), _ in charts)):
+            lines.append('  %s:' % name)
+            for (chart_name, version), archive in charts:
+                if chart_name != name:
+                    continue
+                lines += ['  - name: %s' % name,
+                          '    version: %s' % version,
+                          '    digest: %s' % hashlib.sha256(archive).hexdigest(),
+                          '    urls:',
+                          '    - charts/%s-%s.tgz' % (name, version)]
+        return '\n'.join(lines) + '\n'
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_HEAD(self):
+                self._handle('HEAD')
+
+            def do_POST(self):
+                self._handle('POST')
+
+            def do_PUT(self):
+                self._handle('PUT')
+
+            def do_PATCH(self):
+                self._handle('PATCH')
+
+            def _handle(self, method):
+                path = urllib.parse.urlsplit(self.path).path
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                with server._lock:
+                    server.requests.append((method, path))
+                    server.connections.add(self.client_address)
+                    failure = server.failures > 0
+                    if failure:
+                        server.failures -= 1
+                time.sleep(server.latency)
+                if failure:
+                    return self._respond(503, {'message': 'Service Unavailable'})
+
+                if path.startswith('/api/'):
+                    if server.api_key is not None and self.headers.get('Authorization') != server.api_key:
+                        return self._respond(401, {'message': 'Unauthorized'})
+                    return self._api(method, path)
+                if not self._authorized():
+                    return self._respond(401, {'message': 'Unauthorized'},
+                                         headers={'WWW-Authenticate': 'Basic realm="helm"'})
+                if path.startswith('/artifactory/'):
+                    return self._put_upload_repo(method, path, body, {'X-Artifactory-Id': 'local-artifactory',
+                                                                      'Server': 'Artifactory/7.0.0'})
+                if path.startswith('/nexus/repository/'):
+                    return self._put_upload_repo(method, path, body, {'Server': 'Nexus/3.38.0-01 (OSS)'})
+                if path.startswith('/chartmuseum/'):
+                    return self._chartmuseum(method, path, body)
+                if path.startswith('/azure/') and '/_blobs/' in path:
+                    return self._azure(method, path, body)
+                self._respond(404, {'message': 'Not found'})
+
+            def _api(self, method, path):
+                parts = path.strip('/').split('/')
+                if method == 'GET' and len(parts) == 3 and parts[1] == 'contexts':
+                    context = server.contexts.get(parts[2])
+                    if context is None:
+                        return self._respond(404, {'message': 'Context %s not found' % parts[2]})
+                    return self._respond(200, context)
+                if len(parts) == 7 and parts[1:3] in (['clusters', 'aks'], ['clusters', 'aks-sp']) and \
+                        parts[3:5] == ['helm', 'repos'] and parts[6] == 'token':
+                    return self._respond(200, {'access_token': '%s-token-%s' % (parts[2], parts[5])})
+                self._respond(404, {'message': 'Not found'})
+
+            def _put_upload_repo(self, method, path, body, headers):
+                if method == 'PUT':
+                    with server._lock:
+                        server.artifacts[path] = body
+                    return self._respond(201, {'path': path}, headers)
+                if method in ['GET', 'HEAD'] and path.endswith('/'):
+                    return self._respond(200, {'repo': path}, headers)
+                with server._lock:
+                    artifact = server.artifacts.get(path)
+                if artifact is None:
+                    return self._respond(404, {'message': 'Not found'}, headers)
+                self._respond(200, artifact, headers)
+
+            def _chartmuseum(self, method, path, body):
+                if method == 'POST' and path == '/chartmuseum/api/charts':
+                    try:
+                        added = server.add_chart(body)
+                    except (tarfile.TarError, StopIteration, KeyError, OSError):
+                        return self._respond(400, {'error': 'invalid chart archive'})
+                    if added is None:
+                        return self._respond(409, {'error': 'file already exists'})
+                    return self._respond(201, {'saved': True})
+                if method in ['GET', 'HEAD'] and path == '/chartmuseum/index.yaml':
+                    return self._respond(200, server.index_yaml().encode())
+                if method in ['GET', 'HEAD'] and path.startswith('/chartmuseum/charts/'):
+                    file_name = path[len('/chartmuseum/charts/'):]
+                    with server._lock:
+                        charts = list(server.charts.items())
+                    for (name, version), archive in charts:
+                        if file_name == '%s-%s.tgz' % (name, version):
+                            return self._respond(200, archive)
+                self._respond(404, {'error': 'not found'})
+
+            def _azure(self, method, path, body):
+                with server._lock:
+                    exists = path in server.artifacts
+                    if method == 'PUT' and exists:
+                        return self._respond(409, {'message': 'Blob already exists'})
+                    if method in ['PUT', 'PATCH']:
+                        server.artifacts[path] = body
+                        return self._respond(201 if method == 'PUT' else 200, {'path': path})
+                    artifact = server.artifacts.get(path)
+                if method == 'GET' and artifact is not None:
+                    return self._respond(200, artifact)
+                self._respond(404, {'message': 'Not found'})
+
+            def _authorized(self):
+                if server.username is None:
+                    return True
+                expected = base64.b64encode(('%s:%s' % (server.username, server.password)).encode()).decode()
+                return self.headers.get('Authorization') == 'Basic ' + expected
+
+            def _respond(self, status, body, headers=None):
+                data = body if isinstance(body, bytes) else json.dumps(body).encode()
+                headers = dict(headers or {})
+                # A single Server header, which tells the repo type apart
+                self.send_response_only(status)
+                self.send_header('Server', headers.pop('Server', self.version_string()))
+                self.send_header('Date', self.date_time_string())
+                self.send_header('Content-Type', 'application/octet-stream' if isinstance(body, bytes) else
+                                 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the Codefresh API and Helm repos')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0, help='latency of every request in ms (default: 0)')
+    parser.add_argument('--api-key', help='API key expected in the Authorization header of API requests')
+    args = parser.parse_args()
+    server = LocalCodefreshServer(api_key=args.api_key, latency=args.latency / 1000, port=args.port)
+    print('Serving on %s' % server.url)
+    server._server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
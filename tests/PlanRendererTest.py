@@ -0,0 +1,46 @@
+import unittest
+import os
+import sys
+
+parent_dir_name = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(parent_dir_name)
+from lib.Command import Command, ParallelCommands, ShellScript, ShellWord
+from lib.PlanRenderer import PlanRenderer
+
+
+class PlanRendererTest(unittest.TestCase):
+    def test_exec_step(self):
+        command = Command(['helm', 'upgrade', 'tomcat', 'tomcat', '--install'], network=True, idempotent=True)
+        command.add('--set', ShellWord('a=one\\ two'), ShellWord('--set b="foo:bar"'))
+        self.assertEqual(PlanRenderer.render_step(command), {
+            'type': 'exec',
+            'argv': ['helm', 'upgrade', 'tomcat', 'tomcat', '--install', '--set', 'a=one two', '--set', 'b=foo:bar'],
+            'phase': None, 'kind': 'helm upgrade', 'secret': False, 'network': True, 'idempotent': True,
+            'parallel_safe': False
+        })
+
+    def test_shell_step(self):
+        command = Command(['helm', 'push', ShellWord('$PACKAGE'), 'remote'], secret=True, dry_run=True)
+        self.assertEqual(PlanRenderer.render_step(command), {
+            'type': 'shell', 'script': 'echo helm push $PACKAGE remote',
+            'phase': None, 'kind': 'helm push', 'secret': True, 'network': False, 'idempotent': False,
+            'parallel_safe': False
+        })
+        self.assertEqual(PlanRenderer.render_step(ShellScript(['a=1', 'echo $a']))['script'], 'a=1\necho $a')
+
+    def test_dry_run(self):
+        self.assertEqual(PlanRenderer.render_step(Command(['helm', 'version'], dry_run=True))['argv'],
+                         ['echo', 'helm', 'version'])
+
+    def test_parallel_step(self):
+        step = PlanRenderer.render_step(ParallelCommands(
+            [('a', Command(['helm', 'repo', 'add', 'a', 'https://a.example.com/'], parallel_safe=True))], 3,
+            'add Helm repos'))
+        self.assertEqual(step['type'], 'parallel')
+        self.assertEqual(step['concurrency'], 3)
+        self.assertEqual(step['jobs'][0]['name'], 'a')
+        self.assertEqual(step['jobs'][0]['argv'], ['helm', 'repo', 'add', 'a', 'https://a.example.com/'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+import os
+import sys
+import tempfile
+
+parent_dir_name = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(parent_dir_name)
+from lib.RepoIndex import RepoIndex
+
+INDEX = '''apiVersion: v1
+entries:
+  redis:
+  - apiVersion: v1
+    digest: redisdigest
+    name: redis
+    urls:
+    - https://charts.example.com/redis-10.5.7.tgz
+    version: 10.5.7
+  tomcat:
+  - apiVersion: v1
+    appVersion: "7.0"
+    created: "2020-01-01T00:00:00Z"
+    digest: 1234abcd
+    maintainers:
+    - email: maintainer@example.com
+      name: maintainer
+    name: tomcat
+    urls:
+    - https://charts.example.com/tomcat-0.4.3.tgz
+    version: 0.4.3
+  - digest: "5678ef00"
+    name: tomcat
+    urls: [tomcat-0.4.2.tgz]
+    version: "0.4.2"
+generated: "2020-01-01T00:00:00Z"
+'''
+
+
+class RepoIndexTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.index_path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as index_file:
+            index_file.write(INDEX)
+
+    def tearDown(self):
+        os.remove(self.index_path)
+
+    def test_find(self):
+        entry = RepoIndex.find(self.index_path, 'tomcat', '0.4.3')
+        self.assertEqual(entry['digest'], '1234abcd')
+        self.assertEqual(entry['name'], 'tomcat')
+        self.assertEqual(entry['urls'], ['https://charts.example.com/tomcat-0.4.3.tgz'])
+
+        entry = RepoIndex.find(self.index_path, 'tomcat', '0.4.2')
+        self.assertEqual(entry['digest'], '5678ef00')
+        self.assertEqual(entry['urls'], ['tomcat-0.4.2.tgz'])
+
+        self.assertEqual(RepoIndex.find(self.index_path, 'redis', '10.5.7')['digest'], 'redisdigest')
+
+    def test_find_missing(self):
+        self.assertIsNone(RepoIndex.find(self.index_path, 'tomcat', '0.4.1'))
+        self.assertIsNone(RepoIndex.find(self.index_path, 'mysql', '1.0.0'))
+
+    def test_entries(self):
+        self.assertEqual([entry['version'] for entry in RepoIndex.entries(self.index_path, 'tomcat')],
+                         ['0.4.3', '0.4.2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import os
+import sys
+import tempfile
+import urllib.error
+
+parent_dir_name = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(parent_dir_name)
+sys.path.append(os.path.join(parent_dir_name, 'tests'))
+from lib.EntrypointScriptBuilder import EntrypointScriptBuilder
+from lib.RepoTypeDetector import RepoTypeDetector
+from LocalCodefreshServer import LocalCodefreshServer
+from unittest.mock import MagicMock, patch
+
+
+def response(headers):
+    result = MagicMock()
+    result.info.return_value = headers
+    return result
+
+
+class RepoTypeDetectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_detect(self):
+        self.assertEqual(RepoTypeDetector.detect(response({'X-Artifactory-Id': 'id'})), 'artifactory')
+        self.assertEqual(RepoTypeDetector.detect(response({'server': 'Artifactory/7.0.0'})), 'artifactory')
+        self.assertEqual(RepoTypeDetector.detect(response({'Server': 'Nexus/3.38.0-01 (OSS)'})), 'nexus')
+        self.assertEqual(RepoTypeDetector.detect(response({'X-Harbor-Csrf-Token': 'token'})), 'harbor')
+        self.assertIsNone(RepoTypeDetector.detect(response({'Server': 'nginx'})))
+
+    def test_probe_falls_back_to_ranged_get(self):
+        requests = []
+
+        def opener(request):
+            requests.append(request)
+            if request.get_method() == 'HEAD':
+                raise urllib.error.HTTPError(request.full_url, 405, 'Method Not Allowed', {}, None)
+            return response({'Server': 'Nexus/3.38.0-01 (OSS)'})
+
+        result = RepoTypeDetector.probe('https://nexus.example.com/repository/helm/', 'user', 'pass', opener)
+        self.assertEqual(RepoTypeDetector.detect(result), 'nexus')
+        self.assertEqual([request.get_method() for request in requests], ['HEAD', 'GET'])
+        self.assertEqual(requests[1].get_header('Range'), 'bytes=0-0')
+        self.assertEqual(requests[1].get_header('Authorization'), 'Basic dXNlcjpwYXNz')
+
+    def test_cache(self):
+        detector = RepoTypeDetector(self.tmp.name, ttl=60)
+        key = RepoTypeDetector.key('https://my-repo.jfrog.io/artifactory/helm', 'user')
+        self.assertEqual(key, RepoTypeDetector.key('https://my-repo.jfrog.io/artifactory/helm/', 'user'))
+        self.assertNotEqual(key, RepoTypeDetector.key('https://my-repo.jfrog.io/artifactory/helm/', 'other'))
+        self.assertIsNone(detector.cached_type(key))
+        detector.store(key, 'artifactory')
+        self.assertEqual(RepoTypeDetector(self.tmp.name, ttl=60).cached_type(key), 'artifactory')
+        self.assertEqual(os.stat(detector.path).st_mode & 0o777, 0o600)
+
+        expired = RepoTypeDetector(self.tmp.name, ttl=0)
+        expired.store(key, 'artifactory')
+        self.assertIsNone(expired.cached_type(key))
+
+    def test_push_detects_repo_type_once(self):
+        with LocalCodefreshServer(username='user', password='pass') as server:
+            env = {
+                'ACTION': 'push',
+                'KUBE_CONTEXT': 'local',
+                'CHART_NAME': 'tomcat',
+                'CHART_REPO_URL': server.artifactory_url(),
+                'HELM_VERSION': '3.9.0',
+                'HELMREPO_USERNAME': 'user',
+                'HELMREPO_PASSWORD': 'pass',
+                'CFSTEP_CACHE_DIR': self.tmp.name
+            }
+            with patch('sys.stdout'):
+                first_script = EntrypointScriptBuilder(dict(env)).build()
+                second_script = EntrypointScriptBuilder(dict(env)).build()
+            self.assertEqual(server.requests, [('HEAD', '/artifactory/helm/')])
+            self.assertEqual(first_script, second_script)
+            self.assertTrue(first_script.endswith('-T $PACKAGE %s$(basename $PACKAGE)' % server.artifactory_url()))
+
+            # Another user is validated again
+            env['HELMREPO_USERNAME'] = 'other'
+            with patch('sys.stdout'), self.assertRaises(SystemExit):
+                EntrypointScriptBuilder(env).build()
+            self.assertEqual(len(server.requests), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+import json
+import os
+import sys
+
+parent_dir_name = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(parent_dir_name)
+from lib.SetValuesCompiler import SetValuesCompiler
+
+
+class SetValuesCompilerTest(unittest.TestCase):
+    def test_nesting(self):
+        values = json.loads(SetValuesCompiler.compile(
+            {'image.repository': 'nginx', 'image.tag': '1.19', 'pull_policy': 'Always', 'hosts[1].name': 'b'}, {}))
+        self.assertEqual(values, {'image': {'repository': 'nginx', 'tag': '1.19'}, 'pull_policy': 'Always',
+                                  'hosts': [None, {'name': 'b'}]})
+
+    def test_typing(self):
+        values = json.loads(SetValuesCompiler.compile(
+            {'a': 'true', 'b': 'False', 'c': 'null', 'd': '0', 'e': '42', 'f': '042', 'g': '1.5', 'h': '-7'},
+            {'s': '42', 't': 'true'}))
+        self.assertEqual(values, {'a': True, 'b': False, 'c': None, 'd': 0, 'e': 42, 'f': '042', 'g': '1.5',
+                                  'h': -7, 's': '42', 't': 'true'})
+
+    def test_lists_and_escapes(self):
+        values = json.loads(SetValuesCompiler.compile(
+            {'list': '{a,1,true}', 'escaped': 'a\\,b', 'trailing': 'value1,', 'several': 'x,other=y'}, {}))
+        self.assertEqual(values, {'list': ['a', 1, True], 'escaped': 'a,b', 'trailing': 'value1',
+                                  'several': 'x', 'other': 'y'})
+
+    def test_string_values_applied_last(self):
+        values = json.loads(SetValuesCompiler.compile({'a.b': '1', 'a.c': '2'}, {'a.b': '3'}))
+        self.assertEqual(values, {'a': {'b': '3', 'c': 2}})
+
+    def test_exponent_form_integers(self):
+        self.assertTrue(SetValuesCompiler.has_exponent_form_integers('image.tag', '1234567'))
+        self.assertTrue(SetValuesCompiler.has_exponent_form_integers('ids', '{1,-1000000}'))
+        self.assertFalse(SetValuesCompiler.has_exponent_form_integers('replicas', '999999'))
+        self.assertFalse(SetValuesCompiler.has_exponent_form_integers('build', '01234567'))
+        self.assertFalse(SetValuesCompiler.has_exponent_form_integers('version', '1.2345678'))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            SetValuesCompiler.compile({'list': '{a,b'}, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+parent_dir_name = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(parent_dir_name)
+from lib.Command import Command, ShellScript
+from lib.ShellRenderer import ShellRenderer
+from lib.Tracer import Tracer, STATUS_ERROR, STATUS_OK
+
+
+class TracerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.trace_file = os.path.join(self.tmp.name, 'trace.jsonl')
+        self.env = {
+            'CFSTEP_TRACE_FILE': self.trace_file,
+            'TRACEPARENT': '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01',
+        }
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read_spans(self):
+        spans = []
+        with open(self.trace_file) as f:
+            for line in f:
+                request = json.loads(line)
+                for resource_spans in request['resourceSpans']:
+                    for scope_spans in resource_spans['scopeSpans']:
+                        spans += scope_spans['spans']
+        return dict((span['name'], span) for span in spans)
+
+    @staticmethod
+    def attributes(span):
+        return dict((attribute['key'], list(attribute['value'].values())[0]) for attribute in span['attributes'])
+
+    def test_export(self):
+        tracer = Tracer(self.env)
+        tracer.attributes = {'helm.release': 'tomcat', 'helm.chart.version': None}
+        with tracer.span('init'):
+            with tracer.span('GET /api/contexts/repo') as span:
+                span.set_attribute('cfstep.cache.hit', False)
+        with self.assertRaises(ValueError):
+            with tracer.span('materialize chart'):
+                raise ValueError('invalid chart')
+        tracer.export()
+        tracer.export()
+
+        spans = self.read_spans()
+        self.assertEqual(sorted(spans), ['GET /api/contexts/repo', 'init', 'materialize chart'])
+        for span in spans.values():
+            self.assertEqual(span['traceId'], '0af7651916cd43dd8448eb211c80319c')
+            self.assertLessEqual(int(span['startTimeUnixNano']), int(span['endTimeUnixNano']))
+        self.assertEqual(spans['init']['parentSpanId'], tracer.root.span_id)
+        self.assertEqual(spans['GET /api/contexts/repo']['parentSpanId'], spans['init']['spanId'])
+        self.assertEqual(self.attributes(spans['GET /api/contexts/repo']),
+                         {'helm.release': 'tomcat', 'cfstep.cache.hit': False})
+        self.assertEqual(spans['init']['status'], {'code': STATUS_OK})
+        self.assertEqual(spans['materialize chart']['status'], {'code': STATUS_ERROR, 'message': 'invalid chart'})
+
+    def test_disabled(self):
+        tracer = Tracer({})
+        with tracer.span('init'):
+            pass
+        tracer.export()
+        self.assertIsNone(tracer.root.parent_span_id)
+        self.assertEqual(len(tracer.trace_id), 32)
+        self.assertFalse(os.path.exists(self.trace_file))
+        self.assertNotIn('cf_span_start', ShellRenderer.render([Command(['true'])], tracer=tracer))
+
+    def test_render(self):
+        tracer = Tracer(self.env)
+        tracer.attributes = {'helm.repo.scheme': 'cm'}
+        with tracer.span('init'):
+            pass
+        tracer.export()
+        commands = [
+            Command(['true'], phase='kube-context'),
+            ShellScript('PACKAGE="chart-1.0.0.tgz"', phase='package'),
+            Command(['sh', '-c', 'exit 2'], phase='push'),
+            Command(['echo', 'not run'], phase='upgrade'),
+        ]
+        result = subprocess.run(['bash', '-ec', ShellRenderer.render(commands, tracer=tracer)],
+                                stdout=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(result.returncode, 2)
+        self.assertNotIn('not run', result.stdout)
+
+        spans = self.read_spans()
+        self.assertEqual(sorted(spans), ['cfstep-helm', 'init', 'package', 'sh', 'true'])
+        root = spans['cfstep-helm']
+        self.assertEqual(root['spanId'], tracer.root.span_id)
+        self.assertEqual(root['parentSpanId'], 'b7ad6b7169203331')
+        self.assertEqual(root['status'], {'code': STATUS_ERROR, 'message': 'exit code 2'})
+        self.assertEqual(spans['true']['status'], {'code': STATUS_OK})
+        self.assertEqual(spans['sh']['status'], {'code': STATUS_ERROR, 'message': 'exit code 2'})
+        self.assertEqual(self.attributes(spans['package']),
+                         {'helm.repo.scheme': 'cm', 'cfstep.phase': 'package', 'cfstep.command': 'shell'})
+        for name in ['true', 'package', 'sh']:
+            self.assertEqual(spans[name]['parentSpanId'], root['spanId'])
+            self.assertLessEqual(int(root['startTimeUnixNano']), int(spans[name]['startTimeUnixNano']))
+            self.assertLessEqual(int(spans[name]['startTimeUnixNano']), int(spans[name]['endTimeUnixNano']))
+
+
+if __name__ == '__main__':
+    unittest.main()